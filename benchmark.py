@@ -0,0 +1,510 @@
+"""
+SyncClipboard 基准测试
+- 服务端：在本机启动独立的 server.py（临时目录、随机端口），由同步引擎（内存剪贴板）驱动
+  测量 text / image / file 各尺寸的上传、拉取（完整响应与 304）、下载的延迟和吞吐
+  加 --encrypt 时启用端到端加密（结果类型带 +e2e 后缀，可与未加密的结果对比加密开销）
+- 客户端：测量编码/解码辅助函数（哈希、压缩、打包/解包、加解密、旧版 Base64 解码、Qt 图片编解码）的耗时、CPU 时间和峰值内存
+- 结果写入 JSON 文件，可用 --compare 与其他版本的结果对比
+
+用法：
+    python benchmark.py                                # 默认尺寸 1KB,64KB,1MB,16MB,200MB
+    python benchmark.py --sizes 1KB,1MB --repeat 5     # 快速运行
+    python benchmark.py --server http://host:8910/prefix --skip-client
+    python benchmark.py --encrypt --skip-client          # 端到端加密的上传/下载
+    python benchmark.py --compare old.json --output new.json
+"""
+import argparse
+import base64
+import contextlib
+import hashlib
+import importlib.util
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import uuid
+from datetime import datetime
+
+from sync_engine import (
+    ClientConfig, ClipboardImage, ContentCipher, MemoryClipboard, SyncEngine,
+    base64_to_file_stream, blob_part_path, extract_archive, file_sha256, iter_compressed_file,
+    iter_tar_stream, collect_archive_entries, remove_file, stream_sha256, zstandard,
+)
+
+RESULT_FORMAT = 1  # 结果文件格式版本
+DEFAULT_SIZES = "1KB,64KB,1MB,16MB,200MB"
+TEXT_MAX_SIZE = 16 * 1024 * 1024  # 文本超过该大小时跳过（JSON 上传整体读入内存，更大的文本没有实际意义）
+SEED = 20251112  # 固定随机种子，保证不同版本使用相同的测试数据
+SIZE_UNITS = {"B": 1, "KB": 1024, "MB": 1024 ** 2, "GB": 1024 ** 3}
+BENCH_ENCRYPTION_KEY = "syncclipboard-benchmark"  # 加密测试使用的口令（固定，保证结果可对比）
+HAS_CRYPTOGRAPHY = importlib.util.find_spec("cryptography") is not None
+
+# =======================
+# 测试数据
+# =======================
+def parse_size(text):
+    """解析 1KB / 64KB / 200MB 形式的大小"""
+    text = text.strip().upper()
+    for unit in ("GB", "MB", "KB", "B"):
+        if text.endswith(unit):
+            return int(float(text[:-len(unit)]) * SIZE_UNITS[unit])
+    return int(text)
+
+def format_size(size):
+    for unit in ("GB", "MB", "KB"):
+        if size >= SIZE_UNITS[unit] and size % SIZE_UNITS[unit] == 0:
+            return f"{size // SIZE_UNITS[unit]}{unit}"
+    return f"{size}B"
+
+def make_text(size):
+    """可压缩的文本（随机单词），内容由固定种子决定"""
+    rng = random.Random(SEED)
+    words = ["".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(2, 10))) for _ in range(2000)]
+    parts, total = [], 0
+    while total < size:
+        word = rng.choice(words)
+        parts.append(word)
+        total += len(word) + 1
+    return " ".join(parts)[:size]
+
+def make_binary(size):
+    """不可压缩的二进制数据（模拟已压缩的图片、压缩包等），内容由固定种子决定"""
+    block_size = max(1, min(size, 1024 * 1024))
+    block = random.Random(SEED).getrandbits(block_size * 8).to_bytes(block_size, "little")
+    return (block * (size // len(block) + 1))[:size]
+
+def unique_variant(data, index):
+    """修改开头的字节得到不同的内容，避免重复测量时命中服务端秒传"""
+    marker = f"{index:016d}".encode() if isinstance(data, bytes) else f"{index:016d}"
+    return marker + data[len(marker):]
+
+# =======================
+# 统计与计时
+# =======================
+def summarize(samples, size=0):
+    """多次测量的统计值（毫秒），size 不为 0 时按中位数计算吞吐（MB/s）"""
+    samples = sorted(samples)
+    result = {
+        "count": len(samples),
+        "min_ms": round(samples[0] * 1000, 3),
+        "median_ms": round(statistics.median(samples) * 1000, 3),
+        "mean_ms": round(statistics.mean(samples) * 1000, 3),
+        "p95_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000, 3),
+    }
+    if size:
+        median = statistics.median(samples)
+        result["mb_per_s"] = round(size / (1024 * 1024) / median, 2) if median > 0 else None
+    return result
+
+def repeat_count(size, repeat):
+    """大数据减少重复次数，避免单项测试耗时过长"""
+    if size >= 64 * 1024 * 1024:
+        return max(1, min(repeat, 3))
+    return repeat
+
+@contextlib.contextmanager
+def quiet(verbose):
+    """屏蔽引擎的日志输出（出错时由调用方打印捕获的内容）"""
+    if verbose:
+        yield None
+        return
+    buffer = io.StringIO()
+    with contextlib.redirect_stdout(buffer):
+        yield buffer
+
+# =======================
+# 本地服务端
+# =======================
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_local_server(work_dir, max_size):
+    """在临时目录中生成配置并启动 server.py，返回 (进程, 服务端地址)"""
+    port = free_port()
+    data_mb = max(1024, max_size * 4 // (1024 * 1024))
+    with open(os.path.join(work_dir, "config.ini"), "w", encoding="utf-8") as f:
+        f.write(
+            "[server]\n"
+            "host = 127.0.0.1\n"
+            f"port = {port}\n"
+            "url_prefix =\n"
+            f"data_dir = {os.path.join(work_dir, 'data')}\n"
+            f"blob_disk_mb = {data_mb}\n"
+            "blob_cache_mb = 64\n"
+            f"history_mb = {data_mb}\n"
+        )
+    server_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "server.py")
+    log = open(os.path.join(work_dir, "server.log"), "w", encoding="utf-8")
+    process = subprocess.Popen([sys.executable, server_script], cwd=work_dir, stdout=log, stderr=subprocess.STDOUT)
+    server_url = f"http://127.0.0.1:{port}"
+    
+    # 等待服务端就绪
+    import httpx
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if process.poll() is not None:
+            break
+        try:
+            if httpx.get(f"{server_url}/status", timeout=1).status_code == 200:
+                return process, server_url
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    process.terminate()
+    log.close()
+    with open(os.path.join(work_dir, "server.log"), encoding="utf-8") as f:
+        print(f.read())
+    raise RuntimeError("本地服务端启动失败")
+
+def make_engine(server_url, encryption_key=""):
+    """创建不启动后台任务的同步引擎（各操作经 run_sync 在引擎的网络线程中执行）：关闭提示，不限制文件大小，使用独立频道"""
+    config = ClientConfig()
+    config.server_url = server_url
+    config.encryption_key = encryption_key
+    config.channel = f"bench-{uuid.uuid4().hex[:8]}"
+    config.client_name = "benchmark"
+    config.enable_popup = False
+    config.enable_sound = False
+    config.max_file_size = 0
+    return SyncEngine(config, MemoryClipboard())
+
+# =======================
+# 服务端基准
+# =======================
+def upload_job(content_type, payload, work_dir):
+    """准备一份内容的上传参数（文件先写入磁盘，不计入上传耗时）"""
+    if content_type == "text":
+        return {"content_type": "text", "text": payload}
+    if content_type == "image":
+        return {"content_type": "image", "image": ClipboardImage(payload, 1920, 1080, "png")}
+    file_path = os.path.join(work_dir, "payload.bin")
+    with open(file_path, "wb") as f:
+        f.write(payload)
+    return {"content_type": "file", "file_path": file_path}
+
+def fetched_matches(engine, content_type, data, payload):
+    """拉取结果是否为刚上传的内容（启用加密时先解密文本，数据按相同的盐重新加密后比较哈希）"""
+    if not data or data.get("content_type") != content_type or bool(data.get("encrypted")) != bool(engine.cipher):
+        return False
+    if content_type == "text":
+        return engine.decrypt_metadata(data).get("content") == payload
+    blob_sha256 = hashlib.sha256(payload).hexdigest()
+    if engine.cipher:
+        blob_sha256 = hashlib.sha256(engine.cipher.encrypt_bytes(payload, engine.cipher.content_salt(blob_sha256))).hexdigest()
+    return data.get("blob_id") == blob_sha256
+
+def bench_server_case(engine, content_type, size, repeat, work_dir, verbose):
+    """测量一种类型、一个尺寸的上传、拉取、下载，返回结果列表"""
+    base = make_text(size) if content_type == "text" else make_binary(size)
+    uploads, fetches, not_modified, downloads = [], [], [], []
+    upload_cpu = []
+    for index in range(repeat_count(size, repeat)):
+        payload = unique_variant(base, index)
+        job = upload_job(content_type, payload, work_dir)
+        
+        # 上传（包含秒传检查、压缩、流式/分块上传）
+        with quiet(verbose) as log:
+            cpu_start, start = time.process_time(), time.perf_counter()
+            engine.run_sync(engine.upload_clipboard(**job))
+            uploads.append(time.perf_counter() - start)
+            upload_cpu.append(time.process_time() - cpu_start)
+            
+            # 完整拉取（不带 ETag），同时确认上传成功
+            engine.state.last_fetch_etag = None
+            start = time.perf_counter()
+            data = engine.run_sync(engine.fetch_clipboard())
+            fetches.append(time.perf_counter() - start)
+        if not fetched_matches(engine, content_type, data, payload):
+            if log is not None:
+                print(log.getvalue())
+            raise RuntimeError(f"{content_type} {format_size(size)} 上传后拉取到的内容不一致")
+        
+        # 内容未变化的拉取（304）
+        with quiet(verbose):
+            start = time.perf_counter()
+            engine.run_sync(engine.fetch_clipboard())
+            not_modified.append(time.perf_counter() - start)
+        
+        # 下载文件/图片数据（流式写入临时文件并校验 SHA-256）
+        if content_type != "text":
+            part_path = blob_part_path(data["blob_id"])
+            with quiet(verbose):
+                start = time.perf_counter()
+                ok = engine.run_sync(engine.download_blob_to_file(data["blob_id"], part_path))
+                downloads.append(time.perf_counter() - start)
+            remove_file(part_path)
+            if not ok:
+                raise RuntimeError(f"{content_type} {format_size(size)} 下载失败")
+    
+    case = {"group": "server", "type": f"{content_type}+e2e" if engine.cipher else content_type,
+            "size": size, "size_label": format_size(size)}
+    results = [
+        {**case, "op": "upload", **summarize(uploads, size), "client_cpu_ms": round(statistics.median(upload_cpu) * 1000, 3)},
+        {**case, "op": "fetch", **summarize(fetches, size if content_type == "text" else 0)},
+        {**case, "op": "fetch_304", **summarize(not_modified)},
+    ]
+    if downloads:
+        results.append({**case, "op": "download", **summarize(downloads, size)})
+    return results
+
+def run_server_benchmarks(server_url, types, sizes, repeat, verbose, encryption_key=""):
+    engine = make_engine(server_url, encryption_key)
+    results = []
+    work_dir = tempfile.mkdtemp(prefix="syncclipboard_bench_")
+    try:
+        # 预热：导入 httpx、启动网络线程、建立连接、获取服务端支持的压缩编码，不计入第一项测试
+        with quiet(verbose):
+            engine.run_sync(engine.fetch_clipboard())
+            engine.run_sync(engine.get_upload_encoding())
+            engine.cipher  # 派生加密密钥（scrypt）
+        
+        for content_type in types:
+            for size in sizes:
+                if content_type == "text" and size > TEXT_MAX_SIZE:
+                    print(f"⏭️  跳过 text {format_size(size)}（文本上限 {format_size(TEXT_MAX_SIZE)}）")
+                    continue
+                print(f"⏱️  服务端 {content_type} {format_size(size)} ...")
+                case_results = bench_server_case(engine, content_type, size, repeat, work_dir, verbose)
+                for r in case_results:
+                    print(f"   {r['op']:<10} 中位数 {r['median_ms']:10.2f} ms" +
+                          (f" | {r['mb_per_s']} MB/s" if r.get("mb_per_s") else ""))
+                results.extend(case_results)
+    finally:
+        engine.stop()
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+# =======================
+# 客户端辅助函数基准
+# =======================
+def measure(func, repeat):
+    """测量耗时与 CPU 时间（多次取统计值），再单独运行一次用 tracemalloc 测量 Python 分配的峰值内存"""
+    samples, cpu = [], []
+    for _ in range(repeat):
+        cpu_start, start = time.process_time(), time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+        cpu.append(time.process_time() - cpu_start)
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return samples, statistics.median(cpu), peak
+
+def drain(chunks):
+    for _ in chunks:
+        pass
+
+def client_cases(size, work_dir):
+    """客户端辅助函数的测试项：[(名称, 函数)]"""
+    file_path = os.path.join(work_dir, "payload.bin")
+    text_path = os.path.join(work_dir, "payload.txt")
+    archive_path = os.path.join(work_dir, "payload.tar")
+    extract_dir = os.path.join(work_dir, "extract")
+    out_path = os.path.join(work_dir, "decoded.bin")
+    encrypted_path = os.path.join(work_dir, "payload.enc")
+    cipher = ContentCipher(BENCH_ENCRYPTION_KEY, "benchmark") if HAS_CRYPTOGRAPHY else None
+    
+    def open_encrypted():
+        # 与上传时相同：按需加密的密文视图，盐由明文哈希派生
+        return cipher.open_encrypted(open(file_path, "rb"), size, cipher.content_salt(file_sha256(file_path)))
+    
+    def encrypt_sha256():
+        with open_encrypted() as f:
+            return stream_sha256(f)
+    
+    def prepare():
+        with open(file_path, "wb") as f:
+            f.write(make_binary(size))
+        with open(text_path, "w", encoding="utf-8") as f:
+            f.write(make_text(size))
+        entries, _ = collect_archive_entries([file_path, text_path])
+        with open(archive_path, "wb") as f:
+            for chunk in iter_tar_stream(entries):
+                f.write(chunk)
+        if cipher:
+            with open_encrypted() as src, open(encrypted_path, "wb") as f:
+                shutil.copyfileobj(src, f, 1024 * 1024)
+    
+    def decode_base64():
+        with open(out_path, "wb") as f:
+            base64_to_file_stream(encoded, f)
+    
+    def extract():
+        shutil.rmtree(extract_dir, ignore_errors=True)
+        os.makedirs(extract_dir)
+        extract_archive(archive_path, extract_dir)
+    
+    prepare()
+    with open(file_path, "rb") as f:
+        encoded = base64.b64encode(f.read()).decode("ascii")
+    cases = [
+        ("file_sha256", lambda: file_sha256(file_path)),
+        ("gzip_text_stream", lambda: drain(iter_compressed_file(text_path, "gzip"))),
+        ("tar_stream", lambda: drain(iter_tar_stream(collect_archive_entries([file_path, text_path])[0]))),
+        ("tar_extract", extract),
+        ("base64_to_file_stream", decode_base64),
+    ]
+    if zstandard:
+        cases.insert(2, ("zstd_text_stream", lambda: drain(iter_compressed_file(text_path, "zstd"))))
+    if cipher:
+        # 加密上传路径（明文哈希 + 密文哈希）与下载后的流式解密
+        cases.append(("aesgcm_encrypt_sha256", encrypt_sha256))
+        cases.append(("aesgcm_decrypt_file", lambda: cipher.decrypt_file(encrypted_path, out_path)))
+    return cases
+
+def image_cases(size):
+    """Qt 图片编解码测试项（未安装 PyQt5 时跳过）；size 按 RGB32 原始像素数据计算图片尺寸"""
+    try:
+        from PyQt5 import QtCore, QtGui
+        from client_gui import QtClipboardImage, bytes_to_image
+    except ImportError:
+        return []
+    # 编码插件（webp、jpeg）需要 QCoreApplication 才能加载
+    if QtCore.QCoreApplication.instance() is None:
+        image_cases.app = QtCore.QCoreApplication([sys.argv[0]])
+    
+    # 模拟截图：上半部分为纯色块，下半部分为噪声
+    side = max(16, int((size / 4) ** 0.5))
+    pixels = b"\xf0\xf0\xf0\xff" * (side * (side // 2)) + make_binary(side * (side - side // 2) * 4)
+    image = QtGui.QImage(pixels, side, side, side * 4, QtGui.QImage.Format_RGB32).copy()
+    clipboard_image = QtClipboardImage(image)
+    png_data, _ = clipboard_image.encode("png")
+    
+    cases = [("image_fingerprint", clipboard_image.fingerprint),
+             ("image_decode_png", lambda: bytes_to_image(png_data))]
+    for image_format in ("png", "webp", "jpeg"):
+        cases.append((f"image_encode_{image_format}",
+                      lambda image_format=image_format: clipboard_image.encode(image_format, 85)))
+    return cases
+
+def run_client_benchmarks(sizes, repeat, with_images):
+    results = []
+    work_dir = tempfile.mkdtemp(prefix="syncclipboard_bench_")
+    try:
+        for size in sizes:
+            print(f"⏱️  客户端辅助函数 {format_size(size)} ...")
+            cases = client_cases(size, work_dir)
+            if with_images:
+                cases += image_cases(size)
+            for name, func in cases:
+                samples, cpu, peak = measure(func, repeat_count(size, repeat))
+                result = {"group": "client", "type": name, "size": size, "size_label": format_size(size),
+                          "op": name, **summarize(samples, size),
+                          "cpu_ms": round(cpu * 1000, 3), "peak_python_kb": round(peak / 1024, 1)}
+                print(f"   {name:<22} 中位数 {result['median_ms']:10.2f} ms | CPU {result['cpu_ms']:10.2f} ms"
+                      f" | 峰值内存 {result['peak_python_kb']:10.1f} KB")
+                results.append(result)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+# =======================
+# 结果文件与对比
+# =======================
+def git_revision():
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip() or None
+    except Exception:
+        return None
+
+def result_key(result):
+    return f"{result['group']}/{result['type']}/{result['size_label']}/{result['op']}"
+
+def compare_results(baseline, results, threshold):
+    """与基准结果对比中位数耗时，返回变慢超过阈值的项数"""
+    baseline_map = {result_key(r): r for r in baseline["results"]}
+    regressions = 0
+    print(f"\n📊 与基准对比（{baseline.get('revision') or baseline.get('timestamp')}，阈值 {threshold:.0%}）:")
+    for result in results:
+        old = baseline_map.get(result_key(result))
+        if not old or not old["median_ms"]:
+            continue
+        change = result["median_ms"] / old["median_ms"] - 1
+        mark = "🔴" if change > threshold else ("🟢" if change < -threshold else "  ")
+        if change > threshold:
+            regressions += 1
+        print(f"{mark} {result_key(result):<48} {old['median_ms']:10.2f} → {result['median_ms']:10.2f} ms ({change:+.1%})")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="SyncClipboard 基准测试")
+    parser.add_argument("--server", default=None, help="使用已运行的服务端（包含 URL 前缀），默认在本机启动临时服务端")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help=f"数据大小列表（默认 {DEFAULT_SIZES}）")
+    parser.add_argument("--types", default="text,image,file", help="服务端测试的内容类型")
+    parser.add_argument("--repeat", type=int, default=10, help="每项重复次数（64MB 以上最多 3 次）")
+    parser.add_argument("--skip-server", action="store_true", help="不测试服务端")
+    parser.add_argument("--skip-client", action="store_true", help="不测试客户端辅助函数")
+    parser.add_argument("--no-images", action="store_true", help="不测试 Qt 图片编解码")
+    parser.add_argument("--encrypt", action="store_true", help="服务端测试启用端到端加密（需要安装 cryptography）")
+    parser.add_argument("--output", default="benchmark_results.json", help="结果文件路径")
+    parser.add_argument("--compare", default=None, help="对比的基准结果文件")
+    parser.add_argument("--threshold", type=float, default=0.1, help="判定变慢的比例（默认 0.1 即 10%%）")
+    parser.add_argument("--verbose", action="store_true", help="显示同步引擎日志")
+    args = parser.parse_args(argv)
+    if args.encrypt and not HAS_CRYPTOGRAPHY:
+        parser.error("--encrypt 需要安装 cryptography")
+    
+    sizes = [parse_size(s) for s in args.sizes.split(",") if s.strip()]
+    types = [t.strip() for t in args.types.split(",") if t.strip()]
+    results = []
+    
+    if not args.skip_server:
+        server_process = None
+        work_dir = None
+        server_url = args.server
+        try:
+            if not server_url:
+                work_dir = tempfile.mkdtemp(prefix="syncclipboard_bench_server_")
+                server_process, server_url = start_local_server(work_dir, max(sizes))
+                print(f"🚀 本地服务端已启动: {server_url}")
+            results += run_server_benchmarks(server_url, types, sizes, args.repeat, args.verbose,
+                                             BENCH_ENCRYPTION_KEY if args.encrypt else "")
+        finally:
+            if server_process:
+                server_process.terminate()
+                server_process.wait(10)
+            if work_dir:
+                shutil.rmtree(work_dir, ignore_errors=True)
+    
+    if not args.skip_client:
+        results += run_client_benchmarks(sizes, args.repeat, not args.no_images)
+    
+    report = {
+        "format": RESULT_FORMAT,
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "server": args.server or "local",
+        "seed": SEED,
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"💾 结果已保存: {args.output}")
+    
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if compare_results(baseline, results, args.threshold):
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
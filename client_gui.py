@@ -1,20 +1,62 @@
+import time
+STARTUP_TIME = time.perf_counter()  # 启动计时起点（导入 PyQt5 之前）
+
 import sys
 import os
-import time
+import argparse
+import asyncio
 import threading
-import uuid
 import platform
 import subprocess
-import requests
-import pyperclip
-import configparser
-import base64
-import tempfile
-from datetime import datetime
+import hashlib
 from PyQt5 import QtWidgets, QtGui, QtCore
+import qasync
+STARTUP_QT_IMPORTED = time.perf_counter()
+
+from sync_engine import AsyncSignal, ClientConfig, ClipboardBackend, ClipboardImage, LazyModule, SyncEngine, get_config_path
+STARTUP_ENGINE_IMPORTED = time.perf_counter()
+
+def _import_pyperclip():
+    import pyperclip
+    return pyperclip
+
+pyperclip = LazyModule("pyperclip", _import_pyperclip)  # 首次读写文本剪贴板时才导入
 
 # =======================
-# 读取配置文件
+# 启动耗时分析
+# =======================
+FIRST_FETCH_PROFILE_TIMEOUT = 30  # --profile-startup 等待首次拉取的最长时间（秒）
+
+class StartupProfile:
+    """启动耗时记录：按时间点记录各阶段，--profile-startup 时输出各阶段耗时后退出"""
+    
+    def __init__(self, start):
+        self.start = start
+        self.marks = []
+        self.lock = threading.Lock()
+    
+    def mark(self, phase, at=None):
+        """记录阶段完成的时间点（后台线程也可调用）"""
+        with self.lock:
+            self.marks.append((phase, at or time.perf_counter()))
+    
+    def report(self):
+        """各阶段耗时（相对上一阶段）与累计耗时"""
+        lines = ["⏱️  启动耗时分析（不含 Python 解释器自身启动）:"]
+        last = self.start
+        with self.lock:
+            marks = sorted(self.marks, key=lambda m: m[1])
+        for phase, at in marks:
+            lines.append(f"   {(at - last) * 1000:8.1f} ms | 累计 {(at - self.start) * 1000:8.1f} ms | {phase}")
+            last = at
+        return "\n".join(lines)
+
+STARTUP_PROFILE = StartupProfile(STARTUP_TIME)
+STARTUP_PROFILE.mark("导入 PyQt5 及标准库", STARTUP_QT_IMPORTED)
+STARTUP_PROFILE.mark("导入同步引擎", STARTUP_ENGINE_IMPORTED)
+
+# =======================
+# 启动辅助函数
 # =======================
 SINGLE_INSTANCE_MUTEX = None
 
@@ -71,14 +113,19 @@ def ensure_qt_plugin_paths():
         pass
 
 
-def load_icon_with_reader(file_path):
-    """使用 QImageReader 读取图像并构造 QIcon（作为 QIcon 失败时的回退）"""
+def load_icon_with_reader(file_path, variants=True):
+    """
+    使用 QImageReader 读取图像并构造 QIcon（作为 QIcon 失败时的回退）
+    :param variants: 是否预先缩放出多个常见尺寸；启动时为 False，只用原图（由 Qt 按需缩放），托盘显示后再补充
+    """
     try:
         reader = QtGui.QImageReader(file_path)
         image = reader.read()
         if image and not image.isNull():
             pixmap = QtGui.QPixmap.fromImage(image)
             if not pixmap.isNull():
+                if not variants:
+                    return QtGui.QIcon(pixmap)
                 icon = QtGui.QIcon()
                 # 提供多个常见尺寸，提升托盘显示适配性
                 for size in (16, 20, 22, 24, 32, 40, 48, 64):
@@ -88,45 +135,45 @@ def load_icon_with_reader(file_path):
         pass
     return None
 
-def resolve_app_icon():
-    """根据平台和配置解析应用图标，保持现有逻辑不变（Windows 优先 ico，失败回退 icns）。"""
-    if not APP_ICON:
+def resolve_app_icon(app_icon, variants=True):
+    """根据平台和配置解析应用图标，保持现有逻辑不变（Windows 优先 ico，失败回退 icns）。variants 见 load_icon_with_reader"""
+    if not app_icon:
         return None
     try:
         if platform.system() == "Windows":
-            # 先尝试 ico（优先 icon.ico，再尝试与 APP_ICON 同名的 .ico）
-            if APP_ICON.endswith(".icns"):
+            # 先尝试 ico（优先 icon.ico，再尝试与 app_icon 同名的 .ico）
+            if app_icon.endswith(".icns"):
                 candidate_names = [
                     "icon.ico",
-                    os.path.basename(APP_ICON).replace(".icns", ".ico"),
+                    os.path.basename(app_icon).replace(".icns", ".ico"),
                 ]
                 for candidate in candidate_names:
                     icon_path = get_resource_path(candidate)
                     if icon_path and os.path.exists(icon_path):
                         icon_try = QtGui.QIcon(icon_path)
                         if icon_try.isNull():
-                            icon_try = load_icon_with_reader(icon_path)
+                            icon_try = load_icon_with_reader(icon_path, variants)
                         if icon_try and not icon_try.isNull():
                             return icon_try
                 # 回退：尝试直接加载 icns
-                fallback_icon_path = get_resource_path(APP_ICON)
+                fallback_icon_path = get_resource_path(app_icon)
                 if fallback_icon_path and os.path.exists(fallback_icon_path):
                     icon_try = QtGui.QIcon(fallback_icon_path)
                     if icon_try.isNull():
-                        icon_try = load_icon_with_reader(fallback_icon_path)
+                        icon_try = load_icon_with_reader(fallback_icon_path, variants)
                     if icon_try and not icon_try.isNull():
                         return icon_try
                 return None
             else:
-                # APP_ICON 非 icns，按路径直接加载
-                icon_path = get_resource_path(APP_ICON)
+                # app_icon 非 icns，按路径直接加载
+                icon_path = get_resource_path(app_icon)
                 if icon_path and os.path.exists(icon_path):
                     icon_try = QtGui.QIcon(icon_path)
                     return icon_try if not icon_try.isNull() else None
                 return None
         else:
             # macOS/Linux
-            icon_path = get_resource_path(APP_ICON)
+            icon_path = get_resource_path(app_icon)
             if icon_path and os.path.exists(icon_path):
                 if platform.system() == "Darwin" and icon_path.endswith(".icns"):
                     icon_try = QtGui.QIcon(icon_path)
@@ -140,29 +187,6 @@ def resolve_app_icon():
     except Exception:
         return None
 
-def get_config_path():
-    """获取配置文件路径（兼容打包后的应用）"""
-    # 优先级1: 可执行文件所在目录（打包后）
-    if getattr(sys, 'frozen', False):
-        # Nuitka 打包后
-        exe_dir = os.path.dirname(sys.executable)
-        config_path = os.path.join(exe_dir, "config.ini")
-        if os.path.exists(config_path):
-            return config_path
-    
-    # 优先级2: 当前工作目录
-    if os.path.exists("config.ini"):
-        return "config.ini"
-    
-    # 优先级3: 脚本所在目录
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    config_path = os.path.join(script_dir, "config.ini")
-    if os.path.exists(config_path):
-        return config_path
-    
-    # 未找到配置文件，返回默认路径
-    return "config.ini"
-
 def get_resource_path(relative_path):
     """获取资源文件路径（兼容打包后的应用）"""
     if not relative_path:
@@ -199,197 +223,29 @@ def get_resource_path(relative_path):
     # 未找到资源文件
     return ""
 
-config = configparser.ConfigParser()
-config_file_path = get_config_path()
-config.read(config_file_path, encoding="utf-8")
-print(f"📝 配置文件路径: {config_file_path}")
-
-# 全局配置
-APP_NAME = config.get("global", "app_name", fallback="SyncClipboard")
-APP_VERSION = config.get("global", "app_version", fallback="1.0.0")
-APP_ICON = config.get("global", "app_icon", fallback="")
-
-# 客户端配置
-CLIENT_NAME = config.get("client", "client_name", fallback=platform.node()).strip('"\'')
-URL_PREFIX = config.get("server", "url_prefix", fallback="")
-SERVER_URL = f"{config.get('client', 'server_url', fallback='http://127.0.0.1:8000')}{URL_PREFIX}"
-SYNC_INTERVAL = config.getfloat("client", "sync_interval", fallback=1.0)
-ENABLE_SOUND = config.getboolean("client", "enable_sound", fallback=True)
-ENABLE_POPUP = config.getboolean("client", "enable_popup", fallback=True)
-
-
-# 文件同步配置
-max_file_size_str = config.get("client", "max_file_size", fallback="false").strip().lower()
-if max_file_size_str == "false":
-    MAX_FILE_SIZE = None  # 不同步文件
-elif max_file_size_str == "0":
-    MAX_FILE_SIZE = 0  # 无限制
-else:
-    try:
-        MAX_FILE_SIZE = float(max_file_size_str) * 1024 * 1024  # 转换为字节
-    except ValueError:
-        MAX_FILE_SIZE = None
-        print(f"⚠️  配置项 max_file_size 格式错误: {max_file_size_str}，将不同步文件")
-
-DEVICE_ID = f"{platform.node()}-{uuid.uuid4().hex[:6]}"
-last_sync_time = None  # 最后一次从服务器同步的时间（服务器的updated_at）
-last_sync_download_time = 0  # 最后一次实际下载内容的本地时间戳（用于保护期）
-last_downloaded_file = None  # 最后一次下载的文件路径（用于清理）
-stop_flag = False
-is_setting_clipboard = False  # 标志：正在设置剪贴板（防止检测到自己的设置操作）
-SYNC_PROTECTION_SECONDS = 2  # 同步保护时间（秒）
-
-# 上传下载开关
-allow_upload = True  # 允许上传数据
-allow_download = True  # 允许下载数据
-
-# =======================
-# HTTP Session 配置（启用 Keep-Alive）
-# =======================
-http_session = requests.Session()
-# 配置连接池：最大连接数和keep-alive
-adapter = requests.adapters.HTTPAdapter(
-    pool_connections=10,  # 连接池大小
-    pool_maxsize=20,      # 最大连接数
-    max_retries=0,        # 不自动重试（避免重复上传）
-    pool_block=False
-)
-http_session.mount('http://', adapter)
-http_session.mount('https://', adapter)
-# 设置默认请求头，明确启用 keep-alive
-http_session.headers.update({
-    'Connection': 'keep-alive',
-    'Keep-Alive': 'timeout=30, max=100'
-})
-
-# =======================
-# 辅助函数
-# =======================
-def get_timestamp():
-    """获取当前时间戳字符串（精确到毫秒）"""
-    return datetime.now().strftime("%H:%M:%S.%f")[:-3]
-
-# =======================
-# 文件处理辅助函数
-# =======================
-def get_clipboard_files():
-    """获取剪贴板中的文件列表（使用PyQt5）"""
-    try:
-        clipboard = QtWidgets.QApplication.clipboard()
-        mime_data = clipboard.mimeData()
-        
-        if mime_data.hasUrls():
-            files = []
-            for url in mime_data.urls():
-                # macOS可能返回file://格式的URL
-                if url.isLocalFile():
-                    file_path = url.toLocalFile()
-                    
-                    # macOS特殊处理：有时路径可能需要规范化
-                    if platform.system() == "Darwin":
-                        file_path = os.path.normpath(file_path)
-                    
-                    if os.path.isfile(file_path):
-                        files.append(file_path)
-            return files
-    except Exception as e:
-        print(f"❌ 获取剪贴板文件失败: {e}")
-        import traceback
-        if platform.system() == "Darwin":
-            traceback.print_exc()
-    return []
-
-def file_to_base64(file_path):
-    """将文件转换为Base64编码"""
-    try:
-        with open(file_path, 'rb') as f:
-            return base64.b64encode(f.read()).decode('utf-8')
-    except Exception as e:
-        print(f"❌ 文件编码失败 {file_path}: {e}")
-        return None
-
-def base64_to_file(base64_data, file_name, target_dir=None):
-    """将Base64数据保存为文件"""
-    try:
-        if target_dir is None:
-            target_dir = tempfile.gettempdir()
-        
-        file_path = os.path.join(target_dir, file_name)
-        
-        # 如果文件已存在，添加序号
-        if os.path.exists(file_path):
-            name, ext = os.path.splitext(file_name)
-            counter = 1
-            while os.path.exists(file_path):
-                file_path = os.path.join(target_dir, f"{name}_{counter}{ext}")
-                counter += 1
-        
-        file_data = base64.b64decode(base64_data)
-        with open(file_path, 'wb') as f:
-            f.write(file_data)
-        
-        return file_path
-    except Exception as e:
-        print(f"❌ 文件解码失败: {e}")
-        return None
-
-def set_clipboard_file(file_path):
-    """将文件设置到剪贴板（仅用于主线程直接调用）"""
-    try:
-        clipboard = QtWidgets.QApplication.clipboard()
-        mime_data = QtCore.QMimeData()
-        
-        if not os.path.exists(file_path):
-            print(f"❌ 文件不存在: {file_path}")
-            return False
-        
-        file_path = os.path.abspath(file_path)
-        url = QtCore.QUrl.fromLocalFile(file_path)
-        mime_data.setUrls([url])
-        clipboard.setMimeData(mime_data)
-        
-        print(f"✅ 文件已设置到剪贴板: {file_path}")
-        return True
-    except Exception as e:
-        print(f"❌ 设置文件到剪贴板失败: {e}")
-        return False
-
 # =======================
-# 图片处理辅助函数
+# Qt 剪贴板后端
 # =======================
-def get_clipboard_image():
-    """获取剪贴板中的图片"""
-    try:
-        clipboard = QtWidgets.QApplication.clipboard()
-        mime_data = clipboard.mimeData()
-        
-        if mime_data.hasImage():
-            image = clipboard.image()
-            if not image.isNull():
-                return image
-    except Exception as e:
-        print(f"❌ 获取剪贴板图片失败: {e}")
-    return None
+EVENT_WATCH_RECHECK_SECONDS = 30  # 事件模式下的兜底检查间隔（防止个别通知丢失）
+HISTORY_MENU_SIZE = 10  # 托盘“最近内容”菜单显示的条数
+LAZY_DOWNLOAD_TIMEOUT = 60  # 粘贴延迟下载的内容时最长等待时间（秒），超时后下载在后台继续
 
-def image_to_base64(image):
-    """将QImage转换为Base64编码的PNG"""
+def image_to_bytes(image, image_format="png", quality=-1):
+    """将QImage编码为指定格式（png / webp / jpeg）的字节"""
     try:
         byte_array = QtCore.QByteArray()
         buffer_qt = QtCore.QBuffer(byte_array)
         buffer_qt.open(QtCore.QIODevice.WriteOnly)
-        image.save(buffer_qt, "PNG")
+        ok = image.save(buffer_qt, image_format.upper(), quality)
         buffer_qt.close()
-        
-        # Base64编码
-        return base64.b64encode(byte_array.data()).decode('utf-8')
+        return byte_array.data() if ok else None
     except Exception as e:
         print(f"❌ 图片编码失败: {e}")
         return None
 
-def base64_to_image(base64_data):
-    """将Base64数据转换为QImage"""
+def bytes_to_image(image_data):
+    """将图片字节（PNG等）转换为QImage"""
     try:
-        image_data = base64.b64decode(base64_data)
         image = QtGui.QImage()
         image.loadFromData(image_data)
         return image if not image.isNull() else None
@@ -397,395 +253,282 @@ def base64_to_image(base64_data):
         print(f"❌ 图片解码失败: {e}")
         return None
 
-def set_clipboard_image(image):
-    """将图片设置到剪贴板（仅用于主线程）"""
-    try:
-        clipboard = QtWidgets.QApplication.clipboard()
-        clipboard.setImage(image)
-        return True
-    except Exception as e:
-        print(f"❌ 设置图片到剪贴板失败: {e}")
-        return False
+_image_writer_formats = None
 
-# =======================
-# 系统提示音
-# =======================
-def play_sound():
-    if not ENABLE_SOUND:
-        return
-    try:
-        system = platform.system()
-        if system == "Darwin":  # macOS
-            subprocess.run(["afplay", "/System/Library/Sounds/Ping.aiff"])
-        elif system == "Windows":
-            import winsound
-            winsound.MessageBeep()
-        else:
-            QtWidgets.QApplication.beep()
-    except Exception as e:
-        print("⚠️ 提示音播放失败:", e)
+def image_upload_format(image_format):
+    """实际使用的图片格式：本机 Qt 不支持配置的格式（如缺少 WebP 插件）时回退为 PNG"""
+    global _image_writer_formats
+    if _image_writer_formats is None:
+        _image_writer_formats = {bytes(f).decode().lower() for f in QtGui.QImageWriter.supportedImageFormats()}
+        if image_format not in _image_writer_formats:
+            print(f"⚠️  当前环境不支持 {image_format} 编码，图片将以 png 上传")
+    return image_format if image_format in _image_writer_formats else "png"
 
-# =======================
-# 剪贴板同步逻辑
-# =======================
-def upload_clipboard(tray_app, content_type="text", text="", file_path=None, image=None):
-    """上传剪贴板内容到服务端"""
-    try:
-        if content_type == "image" and image:
-            # 上传图片
-            image_data = image_to_base64(image)
-            if image_data is None:
-                return
-            
-            image_size = len(image_data)
-            width = image.width()
-            height = image.height()
-            
-            response = http_session.post(f"{SERVER_URL}/upload", json={
-                "device_id": DEVICE_ID,
-                "client_name": CLIENT_NAME,
-                "content_type": "image",
-                "image_data": image_data,
-                "image_width": width,
-                "image_height": height,
-                "image_size": image_size
-            }, timeout=15)
-            
-            if response.status_code == 200:
-                print(f"✅ 上传图片成功: {width}x{height} ({image_size/1024:.1f}KB) | {get_timestamp()}")
-                
-                if ENABLE_POPUP:
-                    tray_app.safe_notify(
-                        "📤 图片同步",
-                        f"已上传: {width}x{height} ({image_size/1024:.1f}KB)",
-                        QtWidgets.QSystemTrayIcon.Information,
-                        2000
-                    )
-                play_sound()
-            
-        elif content_type == "file" and file_path:
-            # 上传文件
-            file_name = os.path.basename(file_path)
-            file_size = os.path.getsize(file_path)
-            file_data = file_to_base64(file_path)
-            
-            if file_data is None:
-                return
-            
-            response = http_session.post(f"{SERVER_URL}/upload", json={
-                "device_id": DEVICE_ID,
-                "client_name": CLIENT_NAME,
-                "content_type": "file",
-                "file_name": file_name,
-                "file_data": file_data,
-                "file_size": file_size
-            }, timeout=10)
-            
-            if response.status_code == 200:
-                print(f"✅ 上传文件成功: {file_name} ({file_size/1024:.1f}KB) | {get_timestamp()}")
-                
-                if ENABLE_POPUP:
-                    tray_app.safe_notify(
-                        "📤 文件同步",
-                        f"已上传: {file_name} ({file_size/1024:.1f}KB)",
-                        QtWidgets.QSystemTrayIcon.Information,
-                        2000
-                    )
-                play_sound()
-        else:
-            # 上传文本
-            text_preview = text[:30] if len(text) <= 30 else text[:30] + "..."
-            
-            response = http_session.post(f"{SERVER_URL}/upload", json={
-                "device_id": DEVICE_ID,
-                "client_name": CLIENT_NAME,
-                "content_type": "text",
-                "content": text
-            }, timeout=3)
-            
-            if response.status_code == 200:
-                print(f"✅ 上传文本成功: {text_preview!r} | {get_timestamp()}")
-                
-                if ENABLE_POPUP:
-                    tray_app.safe_notify(
-                        "📤 剪贴板同步",
-                        "上传成功",
-                        QtWidgets.QSystemTrayIcon.Information,
-                        2000
-                    )
-                play_sound()
-    except Exception as e:
-        pass
-
-def fetch_clipboard(last_sync_time=None):
-    """从服务端拉取最新内容"""
-    try:
-        params = {}
-        if last_sync_time:
-            params["last_sync_time"] = last_sync_time
-        
-        r = http_session.get(f"{SERVER_URL}/fetch", params=params, timeout=3)
-        return r.json()
-    except Exception as e:
-        print("❌ 拉取失败:", e)
-        return None
-
-def clipboard_watcher(tray_app):
-    """监听剪贴板变化并上传（带3秒保护期）"""
-    global is_setting_clipboard, last_sync_download_time, allow_upload
-    
-    # 用于检测是否真正发生变化的缓存
-    last_text = ""
-    last_files = []
-    last_image_data = None
-
-    def skip_recent_download_guard() -> bool:
-        """距离上次下载过短则跳过上传，并按原样打印提示与等待。"""
-        if last_sync_download_time > 0:
-            elapsed = time.time() - last_sync_download_time
-            if elapsed < SYNC_PROTECTION_SECONDS:
-                print(f"🛡️ 距离上次下载 {elapsed:.1f}s < {SYNC_PROTECTION_SECONDS}s，跳过上传")
-                time.sleep(0.5)
-                return True
-        return False
-
-    while not stop_flag:
+class QtClipboardImage(ClipboardImage):
+    """剪贴板中的 QImage"""
+    
+    def __init__(self, image):
+        super().__init__(None, image.width(), image.height())
+        self.image = image
+    
+    def fingerprint(self):
+        """图片指纹：尺寸、像素格式加像素数据的哈希（直接读取 QImage 的像素缓冲区，不复制、不编码），用于判断剪贴板图片是否变化"""
+        image = self.image
+        bits = image.constBits()
+        bits.setsize(image.sizeInBytes())
+        return (image.width(), image.height(), image.format(), image.bytesPerLine(),
+                hashlib.sha256(bits).digest())
+    
+    def encode(self, image_format="png", quality=-1, max_dimension=0):
+        """
+        按配置转码剪贴板图片（在图片编码线程池中执行，不占用监听和上传线程）
+        超过 max_dimension 时按比例缩小；JPEG 不支持透明，透明区域以白色填充
+        返回 (编码后的字节, 格式)，编码失败时字节为 None
+        """
+        image = self.image
+        image_format = image_upload_format(image_format)
+        if max_dimension > 0 and max(image.width(), image.height()) > max_dimension:
+            image = image.scaled(max_dimension, max_dimension,
+                                 QtCore.Qt.KeepAspectRatio, QtCore.Qt.SmoothTransformation)
+        if image_format == "jpeg" and image.hasAlphaChannel():
+            opaque = QtGui.QImage(image.size(), QtGui.QImage.Format_RGB32)
+            opaque.fill(QtCore.Qt.white)
+            painter = QtGui.QPainter(opaque)
+            painter.drawImage(0, 0, image)
+            painter.end()
+            image = opaque
+        if image_format == "png":
+            quality = -1
+        return image_to_bytes(image, image_format, quality), image_format
+
+class LazyMimeData(QtCore.QMimeData):
+    """
+    延迟下载的剪贴板内容：放入剪贴板时只声明可提供的格式（图片或文件列表），
+    其他程序粘贴、真正请求数据时才调用 materialize 从服务端下载，结果缓存在对象中，重复粘贴不再下载
+    """
+    def __init__(self, data, materialize):
+        super().__init__()
+        self.content_type = data.get("content_type")
+        self._materialize = materialize
+        self._value = None
+        self._task = None  # 进行中（或已完成）的下载
+    
+    def formats(self):
+        return ["application/x-qt-image"] if self.content_type == "image" else ["text/uri-list"]
+    
+    def hasFormat(self, mime_type):
+        return mime_type in self.formats()
+    
+    async def _download(self):
+        """下载（同步引擎的后台任务）并在线程池中解码，失败返回 None"""
         try:
-            # 优先级0：检查是否允许上传
-            if not allow_upload:
-                time.sleep(0.5)
-                continue
-            
-            # 优先级1：正在设置剪贴板，跳过
-            if is_setting_clipboard:
-                time.sleep(0.3)
-                continue
-
-            # 开始检测剪贴板内容
-            # 优先级1：文件
-            current_files = get_clipboard_files()
-            if current_files and current_files != last_files:
-                last_files = current_files
-                last_text = ""
-                last_image_data = None
-                
-                if skip_recent_download_guard():
-                    continue
-                
-                file_path = current_files[0]
-                has_directory = any(os.path.isdir(path) for path in current_files)
-
-                if has_directory:
-                    if ENABLE_POPUP:
-                        tray_app.safe_notify(
-                            "⛔️ 不支持的剪贴板类型",
-                            "当前版本暂不支持同步文件夹内容",
-                            QtWidgets.QSystemTrayIcon.Warning,
-                            3000
-                        )
-                    time.sleep(0.5)
-                    continue
-
-                if MAX_FILE_SIZE is not None:
-                    file_size = os.path.getsize(file_path)
-                    file_name = os.path.basename(file_path)
-
-                    if MAX_FILE_SIZE == 0 or file_size <= MAX_FILE_SIZE:
-                        upload_clipboard(tray_app, content_type="file", file_path=file_path)
-                    else:
-                        max_mb = MAX_FILE_SIZE / (1024 * 1024)
-                        file_mb = file_size / (1024 * 1024)
-                        if ENABLE_POPUP:
-                            tray_app.safe_notify(
-                                "⚠️  文件过大",
-                                f"{file_name}\n大小 {file_mb:.1f}MB 超出限制 {max_mb:.1f}MB",
-                                QtWidgets.QSystemTrayIcon.Warning,
-                                3000
-                            )
-            
-            # 优先级2：图片（如果没有文件）
-            elif not current_files:
-                current_image = get_clipboard_image()
-                if current_image:
-                    # 简单比较：将图片转为base64字符串
-                    image_data = image_to_base64(current_image)
-                    if image_data and image_data != last_image_data:
-                        last_image_data = image_data
-                        last_text = ""
-                        last_files = []
-                        
-                        if skip_recent_download_guard():
-                            continue
-                        
-                        image_size = len(image_data)
-                        if MAX_FILE_SIZE and (MAX_FILE_SIZE == 0 or image_size <= MAX_FILE_SIZE):
-                            upload_clipboard(tray_app, content_type="image", image=current_image)
-                        elif MAX_FILE_SIZE:
-                            max_mb = MAX_FILE_SIZE / (1024 * 1024)
-                            image_mb = image_size / (1024 * 1024)
-                            if ENABLE_POPUP:
-                                tray_app.safe_notify(
-                                    "⚠️  图片过大",
-                                    f"{current_image.width()}x{current_image.height()}\n大小 {image_mb:.1f}MB 超出限制 {max_mb:.1f}MB",
-                                    QtWidgets.QSystemTrayIcon.Warning,
-                                    3000
-                                )
-                
-                # 优先级3：文本（如果既没有文件也没有图片）
-                else:
-                    current_text = pyperclip.paste()
-                    if current_text != last_text:
-                        last_text = current_text
-                        last_files = []
-                        last_image_data = None
-                        
-                        if skip_recent_download_guard():
-                            continue
-                        
-                        upload_clipboard(tray_app, content_type="text", text=current_text)
-        
+            value = await self._materialize()
+            if value is not None and self.content_type == "image":
+                value = await asyncio.to_thread(bytes_to_image, value)
+            return value
         except Exception as e:
-            print("❌ 剪贴板监听错误:", e)
-        
-        time.sleep(0.5)
-
-def sync_from_server(tray_app):
-    """定时从服务端拉取更新并写入剪贴板"""
-    global last_sync_time, is_setting_clipboard, last_sync_download_time, last_downloaded_file, allow_download
-    
-    while not stop_flag:
-        # 检查是否允许下载
-        if not allow_download:
-            time.sleep(SYNC_INTERVAL)
-            continue
+            print(f"❌ 延迟下载失败: {e}")
+            return None
+    
+    def _result(self):
+        task = self._task
+        return None if task is None or not task.done() or task.cancelled() else task.result()
+    
+    def materialize(self):
+        """
+        下载内容（只下载一次，失败时下次粘贴重试）
+        Qt 在主线程调用 retrieveData 并同步等待数据：下载在事件循环中进行，这里在局部事件循环中等待，
+        同步引擎的其他任务（拉取、上传）和托盘操作照常处理；最多等待 LAZY_DOWNLOAD_TIMEOUT 秒，超时返回 None，下载在后台继续
+        """
+        if self._value is not None:
+            return self._value
+        if self._task is None or (self._task.done() and self._result() is None):
+            self._task = asyncio.ensure_future(self._download())
+        
+        task = self._task
+        if not task.done():
+            loop = QtCore.QEventLoop()
+            timer = QtCore.QTimer(loop)
+            timer.setSingleShot(True)
+            timer.timeout.connect(loop.quit)
+            timer.start(LAZY_DOWNLOAD_TIMEOUT * 1000)
+            task.add_done_callback(lambda _: loop.quit())
+            loop.exec_()
+        if not task.done():
+            print(f"⏳ 下载超过 {LAZY_DOWNLOAD_TIMEOUT} 秒，继续在后台下载，完成后可再次粘贴")
+            return None
         
-        # 传入last_sync_time，让服务端判断是否需要返回数据
-        data = fetch_clipboard(last_sync_time)
+        self._value = self._result()
+        return self._value
+    
+    def retrieveData(self, mime_type, preferred_type):
+        if not self.hasFormat(mime_type):
+            return None
+        value = self.materialize()
+        if value is None:
+            return None
+        if self.content_type == "image":
+            return value
+        return [QtCore.QUrl.fromLocalFile(os.path.abspath(path)) for path in value]
+
+class QtClipboard(QtCore.QObject, ClipboardBackend):
+    """
+    系统剪贴板（PyQt5）：文本通过 pyperclip 读写，文件和图片通过 QClipboard 读写
+    QClipboard 只能在主线程访问：同步引擎运行在主线程的事件循环中（qasync），读写直接在主线程进行
+    """
+    supports_lazy = True
+    
+    def __init__(self, clipboard_watch="auto"):
+        super().__init__()
+        self.clipboard_watch = clipboard_watch
+        self.changed = AsyncSignal()  # 剪贴板变化通知（事件模式下由 dataChanged 信号触发）
         
-        if data:
-            # 如果服务端返回 no_update，说明没有新内容，跳过处理
-            if data.get("status") == "no_update":
-                time.sleep(SYNC_INTERVAL)
-                continue
+        # 事件模式：剪贴板（及 X11 选区、macOS 查找缓冲区）变化时唤醒监听任务
+        if self.event_mode():
+            clipboard = QtWidgets.QApplication.clipboard()
+            clipboard.dataChanged.connect(self.changed.set)
+            if clipboard.supportsSelection():
+                clipboard.selectionChanged.connect(self.changed.set)
+            if clipboard.supportsFindBuffer():
+                clipboard.findBufferChanged.connect(self.changed.set)
+    
+    def event_mode(self):
+        """是否使用剪贴板变化通知驱动检测（否则轮询）"""
+        if self.clipboard_watch == "auto":
+            # macOS 不会通知其他应用对剪贴板的修改；Wayland 下只有窗口获得焦点时才有通知
+            return platform.system() != "Darwin" and os.environ.get("XDG_SESSION_TYPE") != "wayland"
+        return self.clipboard_watch == "event"
+    
+    async def call(self, func, *args):
+        # 引擎的事件循环就是 Qt 主线程，直接调用
+        return func(*args)
+    
+    def get_text(self):
+        return pyperclip.paste()
+    
+    def set_text(self, text):
+        pyperclip.copy(text)
+    
+    def get_files(self):
+        """获取剪贴板中的文件和文件夹列表"""
+        try:
+            clipboard = QtWidgets.QApplication.clipboard()
+            mime_data = clipboard.mimeData()
             
-            # 有新内容，处理更新
-            updated_at = data.get("updated_at")
-            if updated_at:
-                # 检查是否是自己上传的内容
-                if data.get("device_id") == DEVICE_ID:
-                    # 是自己上传的，直接更新时间戳，不处理
-                    last_sync_time = updated_at
-                else:
-                    content_type = data.get("content_type", "text")
-                    client_name = data.get("client_name", "未知设备")
-                    
-                    if content_type == "image":
-                        # 处理图片同步
-                        image_data = data.get("image_data")
-                        image_width = data.get("image_width", 0)
-                        image_height = data.get("image_height", 0)
-                        image_size = data.get("image_size", 0)
-                        
-                        if image_data:
-                            image = base64_to_image(image_data)
-                            if image:
-                                # 记录下载时间（写入剪贴板之前），用于保护期判断
-                                last_sync_download_time = time.time()
-                                
-                                is_setting_clipboard = True
-                                tray_app.safe_set_image(image)
-                                
-                                print(f"✅ 下载图片成功: {image_width}x{image_height} ({image_size/1024:.1f}KB) | {get_timestamp()}")
-                                if ENABLE_POPUP:
-                                    tray_app.safe_notify(
-                                        "📥 图片同步",
-                                        f"已接收到来自[{client_name}]的图片内容\n{image_width}x{image_height}\n💡 按 Ctrl+V 可直接粘贴",
-                                        QtWidgets.QSystemTrayIcon.Information,
-                                        4000
-                                    )
-                                play_sound()
-                                
-                    elif content_type == "file":
-                        # 处理文件同步
-                        file_name = data.get("file_name")
-                        file_data = data.get("file_data")
-                        file_size = data.get("file_size", 0)
-                        
-                        if file_name and file_data:
-                            # 删除上一次下载的文件
-                            if last_downloaded_file and os.path.exists(last_downloaded_file):
-                                try:
-                                    os.remove(last_downloaded_file)
-                                    print(f"🗑️  已清理上一次的文件: {os.path.basename(last_downloaded_file)}")
-                                except Exception as e:
-                                    print(f"⚠️  清理文件失败: {e}")
-                            
-                            saved_path = base64_to_file(file_data, file_name)
-                            if saved_path:
-                                # 记录本次下载的文件路径
-                                last_downloaded_file = saved_path
-                                
-                                # 记录下载时间（写入剪贴板之前），用于保护期判断
-                                last_sync_download_time = time.time()
-                                
-                                is_setting_clipboard = True
-                                tray_app.safe_set_file(saved_path)
-                                
-                                print(f"✅ 下载文件成功: {file_name} ({file_size/1024:.1f}KB) | {get_timestamp()}")
-                                if ENABLE_POPUP:
-                                    tray_app.safe_notify(
-                                        "📥 文件同步",
-                                        f"已接收到来自[{client_name}]的文件内容\n{file_name}\n💡 按 Ctrl+V 可直接粘贴",
-                                        QtWidgets.QSystemTrayIcon.Information,
-                                        4000
-                                    )
-                                play_sound()
-                    
-                    else:
-                        # 处理文本同步
-                        new_text = data.get("content", "")
-                        text_preview = new_text[:30] if len(new_text) <= 30 else new_text[:30] + "..."
-                        
-                        # 记录下载时间（写入剪贴板之前），用于保护期判断
-                        last_sync_download_time = time.time()
+            if mime_data.hasUrls():
+                files = []
+                for url in mime_data.urls():
+                    # macOS可能返回file://格式的URL
+                    if url.isLocalFile():
+                        file_path = url.toLocalFile()
                         
-                        is_setting_clipboard = True
-                        pyperclip.copy(new_text)
-                        is_setting_clipboard = False  # 文本设置是同步的，立即清除标志
+                        # macOS特殊处理：有时路径可能需要规范化
+                        if platform.system() == "Darwin":
+                            file_path = os.path.normpath(file_path)
                         
-                        print(f"✅ 下载文本成功: {text_preview!r} | {get_timestamp()}")
-                        if ENABLE_POPUP:
-                            tray_app.safe_notify(
-                                "📥 剪贴板同步",
-                                f"已接收到来自[{client_name}]的文本内容",
-                                QtWidgets.QSystemTrayIcon.Information,
-                                3000
-                            )
-                        play_sound()
-                    
-                    # 处理完成，更新时间戳
-                    last_sync_time = updated_at
+                        if os.path.isfile(file_path) or os.path.isdir(file_path):
+                            files.append(file_path)
+                return files
+        except Exception as e:
+            print(f"❌ 获取剪贴板文件失败: {e}")
+            import traceback
+            if platform.system() == "Darwin":
+                traceback.print_exc()
+        return []
+    
+    def set_files(self, paths):
+        """设置文件（一个或多个文件/文件夹）到剪贴板"""
+        paths = [path for path in paths if os.path.exists(path)]
+        if not paths:
+            return
         
-        time.sleep(SYNC_INTERVAL)
+        mime_data = QtCore.QMimeData()
+        # 使用绝对路径
+        mime_data.setUrls([QtCore.QUrl.fromLocalFile(os.path.abspath(path)) for path in paths])
+        QtWidgets.QApplication.clipboard().setMimeData(mime_data)
+    
+    def get_image(self):
+        """获取剪贴板中的图片"""
+        try:
+            clipboard = QtWidgets.QApplication.clipboard()
+            mime_data = clipboard.mimeData()
+            
+            if mime_data.hasImage():
+                image = clipboard.image()
+                if not image.isNull():
+                    return QtClipboardImage(image)
+        except Exception as e:
+            print(f"❌ 获取剪贴板图片失败: {e}")
+        return None
+    
+    def decode_image(self, image_data):
+        return bytes_to_image(image_data)
+    
+    def set_image(self, image):
+        QtWidgets.QApplication.clipboard().setImage(image)
+        return image.width(), image.height()
+    
+    def set_lazy(self, data, materialize):
+        QtWidgets.QApplication.clipboard().setMimeData(LazyMimeData(data, materialize))
+    
+    def is_lazy(self):
+        return isinstance(QtWidgets.QApplication.clipboard().mimeData(), LazyMimeData)
+    
+    def clear(self):
+        QtWidgets.QApplication.clipboard().clear()
+    
+    async def wait_for_change(self):
+        """等待下一次检测：事件模式下等待剪贴板变化（或兜底超时），轮询模式下等待0.5秒"""
+        if self.event_mode():
+            await self.changed.wait(EVENT_WATCH_RECHECK_SECONDS)
+            # 先清除再读取剪贴板，读取期间的新变化会重新触发
+            self.changed.clear()
+        else:
+            # 轮询模式下 changed 只由 wake 设置（重新开启上传时立即返回）
+            await self.changed.wait(0.5)
+            self.changed.clear()
+    
+    def wake(self):
+        self.changed.set()
+
+def history_item_label(item):
+    """历史菜单中的显示文字"""
+    client_name = item.get("client_name") or "未知设备"
+    content_type = item.get("content_type", "text")
+    if content_type == "image":
+        label = f"🖼️ {item.get('image_width', 0)}x{item.get('image_height', 0)}"
+    elif content_type == "file":
+        label = f"📁 {item.get('file_name')}"
+    elif item.get("encrypted"):
+        label = "📝 🔒 加密文本"
+    else:
+        preview = item.get("content_preview", "").replace("\n", " ").strip()
+        label = f"📝 {preview[:30]}{'...' if item.get('content_length', 0) > 30 else ''}"
+    return f"{label}  [{client_name}]"
 
 # =======================
 # 托盘应用部分
 # =======================
 class ClipboardTrayApp(QtWidgets.QSystemTrayIcon):
+    """托盘程序：同步引擎的通知后端（通知、进度提示、提示音），并提供上传/下载开关和历史记录菜单"""
     # 定义自定义信号（必须在类级别定义）
     notify_signal = QtCore.pyqtSignal(str, str, int, int)  # title, message, icon, duration
-    set_file_signal = QtCore.pyqtSignal(str)  # file_path - 在主线程设置文件到剪贴板
-    set_image_signal = QtCore.pyqtSignal(object)  # QImage - 在主线程设置图片到剪贴板
+    progress_signal = QtCore.pyqtSignal(str)  # 传输进度文本 - 在主线程更新托盘提示
     
-    def __init__(self, icon, parent=None):
+    def __init__(self, icon, engine, parent=None):
         super(ClipboardTrayApp, self).__init__(icon, parent)
+        self.engine = engine
+        self.config = engine.config
+        config = self.config
         
         # 创建托盘图标右键菜单
         self.menu = QtWidgets.QMenu()
         
         # 添加客户端名称（不可点击）
-        client_name_action = self.menu.addAction(f"🏷️  {CLIENT_NAME}")
+        client_name_action = self.menu.addAction(f"🏷️  {config.client_name}")
         client_name_action.setEnabled(False)  # 设置为禁用状态，不可点击
+        channel_action = self.menu.addAction(f"📺 频道: {config.channel}")
+        channel_action.setEnabled(False)
         
         # 添加分隔线
         self.menu.addSeparator()
@@ -793,18 +536,27 @@ class ClipboardTrayApp(QtWidgets.QSystemTrayIcon):
         # 添加上传开关
         self.upload_action = self.menu.addAction("📤 允许上传数据")
         self.upload_action.setCheckable(True)
-        self.upload_action.setChecked(allow_upload)
+        self.upload_action.setChecked(engine.state.allow_upload)
         self.upload_action.triggered.connect(self.toggle_upload)
         
         # 添加下载开关
         self.download_action = self.menu.addAction("📥 允许下载数据")
         self.download_action.setCheckable(True)
-        self.download_action.setChecked(allow_download)
+        self.download_action.setChecked(engine.state.allow_download)
         self.download_action.triggered.connect(self.toggle_download)
         
         # 添加分隔线
         self.menu.addSeparator()
         
+        # 添加历史记录子菜单（打开时先显示上次的记录，后台从服务端拉取后更新）
+        self.history_menu = self.menu.addMenu("🕘 最近内容")
+        self.history_menu.aboutToShow.connect(self.refresh_history_menu)
+        self.history_items = None  # 上次拉取到的历史记录
+        self.history_loading = False
+        
+        # 添加分隔线
+        self.menu.addSeparator()
+        
         # 添加退出菜单项
         exit_action = self.menu.addAction("退出")
         exit_action.triggered.connect(self.quit_application)
@@ -813,40 +565,35 @@ class ClipboardTrayApp(QtWidgets.QSystemTrayIcon):
         self.setContextMenu(self.menu)
         
         # 设置鼠标悬停提示（显示应用名称和版本）
-        self.setToolTip(f"{APP_NAME} v{APP_VERSION}")
+        self.setToolTip(f"{config.app_name} v{config.app_version}")
         
         # 显示托盘图标（确保可以看到图标和右键菜单）
         self.show()
         
         # 连接信号到槽函数
         self.notify_signal.connect(self._show_notification)
-        self.set_file_signal.connect(self._set_file_to_clipboard)
-        self.set_image_signal.connect(self._set_image_to_clipboard)
+        self.progress_signal.connect(self._show_progress)
         
         # Windows特定：设置AppUserModelID（用于通知）
         if platform.system() == "Windows":
             try:
                 import ctypes
                 ctypes.windll.shell32.SetCurrentProcessExplicitAppUserModelID(
-                    f"{APP_NAME}.SyncClipboard.App.{APP_VERSION}"
+                    f"{config.app_name}.SyncClipboard.App.{config.app_version}"
                 )
                 print("✅ 已设置Windows AppUserModelID")
             except Exception as e:
                 print(f"⚠️  设置AppUserModelID失败: {e}")
-
-        # 启动后台线程
-        threading.Thread(target=clipboard_watcher, args=(self,), daemon=True).start()
-        threading.Thread(target=sync_from_server, args=(self,), daemon=True).start()
-
+        
         # 显示启动通知
-        if ENABLE_POPUP:
+        if config.enable_popup:
             QtCore.QTimer.singleShot(500, self._show_startup_notification)
     
     def _show_startup_notification(self):
         """显示启动通知"""
         self.showMessage(
-            f"📋 {APP_NAME}",
-            f"v{APP_VERSION} 已启动（同步间隔 {SYNC_INTERVAL}s）",
+            f"📋 {self.config.app_name}",
+            f"v{self.config.app_version} 已启动（{self.config.sync_mode_text()}）",
             QtWidgets.QSystemTrayIcon.Information,
             2500
         )
@@ -863,57 +610,39 @@ class ClipboardTrayApp(QtWidgets.QSystemTrayIcon):
         """线程安全的通知方法"""
         self.notify_signal.emit(title, message, icon, duration)
     
-    def _set_file_to_clipboard(self, file_path):
-        """在主线程中设置文件到剪贴板（槽函数）"""
-        global is_setting_clipboard
-        try:
-            clipboard = QtWidgets.QApplication.clipboard()
-            mime_data = QtCore.QMimeData()
-            
-            if not os.path.exists(file_path):
-                return
-            
-            # 使用绝对路径
-            file_path = os.path.abspath(file_path)
-            url = QtCore.QUrl.fromLocalFile(file_path)
-            mime_data.setUrls([url])
-            clipboard.setMimeData(mime_data)
-            
-        except Exception as e:
-            pass
-        finally:
-            # 清除标志，允许clipboard_watcher继续检测
-            is_setting_clipboard = False
+    def notify(self, title, message, warning=False, duration=2000):
+        """引擎通知接口"""
+        icon = QtWidgets.QSystemTrayIcon.Warning if warning else QtWidgets.QSystemTrayIcon.Information
+        self.safe_notify(title, message, icon, duration)
     
-    def safe_set_file(self, file_path):
-        """线程安全的文件设置方法"""
-        self.set_file_signal.emit(file_path)
+    def _show_progress(self, text):
+        """在主线程中更新托盘提示（槽函数），空文本恢复默认提示"""
+        title = f"{self.config.app_name} v{self.config.app_version}"
+        self.setToolTip(f"{title}\n{text}" if text else title)
     
-    def _set_image_to_clipboard(self, image):
-        """在主线程中设置图片到剪贴板（槽函数）"""
-        global is_setting_clipboard
-        try:
-            clipboard = QtWidgets.QApplication.clipboard()
-            clipboard.setImage(image)
-            
-        except Exception as e:
-            pass
-        finally:
-            # 清除标志，允许clipboard_watcher继续检测（但仍有3秒保护期）
-            is_setting_clipboard = False
+    def progress(self, text):
+        """线程安全的传输进度显示方法（引擎进度接口）"""
+        self.progress_signal.emit(text)
     
-    def safe_set_image(self, image):
-        """线程安全的图片设置方法"""
-        self.set_image_signal.emit(image)
+    def play_sound(self):
+        """系统提示音"""
+        system = platform.system()
+        if system == "Darwin":  # macOS
+            subprocess.run(["afplay", "/System/Library/Sounds/Ping.aiff"])
+        elif system == "Windows":
+            import winsound
+            winsound.MessageBeep()
+        else:
+            QtWidgets.QApplication.beep()
     
     def toggle_upload(self):
         """切换上传开关"""
-        global allow_upload
         allow_upload = self.upload_action.isChecked()
+        self.engine.set_allow_upload(allow_upload)
         status = "已启用" if allow_upload else "已禁用"
         print(f"📤 上传功能 {status}")
         
-        if ENABLE_POPUP:
+        if self.config.enable_popup:
             self.safe_notify(
                 "📤 上传设置",
                 f"上传功能{status}",
@@ -923,12 +652,12 @@ class ClipboardTrayApp(QtWidgets.QSystemTrayIcon):
     
     def toggle_download(self):
         """切换下载开关"""
-        global allow_download
         allow_download = self.download_action.isChecked()
+        self.engine.set_allow_download(allow_download)
         status = "已启用" if allow_download else "已禁用"
         print(f"📥 下载功能 {status}")
         
-        if ENABLE_POPUP:
+        if self.config.enable_popup:
             self.safe_notify(
                 "📥 下载设置",
                 f"下载功能{status}",
@@ -936,73 +665,160 @@ class ClipboardTrayApp(QtWidgets.QSystemTrayIcon):
                 2000
             )
     
+    def refresh_history_menu(self):
+        """打开历史记录子菜单：先显示上次拉取的记录，在后台任务中拉取最新记录（网络请求不阻塞界面）"""
+        self.fill_history_menu(self.history_items, None if self.history_items is not None else "⏳ 正在加载...")
+        if not self.history_loading:
+            self.history_loading = True
+            self.engine.spawn(self.load_history())
+    
+    async def load_history(self):
+        """拉取最新的历史记录：更新缓存和菜单，失败时保留上次的记录"""
+        try:
+            items = await self.engine.fetch_history(HISTORY_MENU_SIZE)
+        finally:
+            self.history_loading = False
+        if items is None:
+            self.fill_history_menu(self.history_items, "⚠️  无法连接服务端")
+            return
+        self.history_items = items
+        self.fill_history_menu(items)
+    
+    def fill_history_menu(self, items, status=None):
+        """用历史记录填充子菜单，status 为显示在顶部的状态文字"""
+        self.history_menu.clear()
+        if status:
+            self.history_menu.addAction(status).setEnabled(False)
+        if items is None:
+            return
+        if not items and not status:
+            self.history_menu.addAction("（暂无记录）").setEnabled(False)
+            return
+        for item in items:
+            action = self.history_menu.addAction(history_item_label(item))
+            action.triggered.connect(lambda checked=False, seq=item["seq"]: self.restore_history(seq))
+    
+    def restore_history(self, seq):
+        """在后台任务中恢复历史记录到剪贴板（下载文件/图片可能较慢，不阻塞界面）"""
+        self.engine.spawn(self.engine.restore_history_item(seq))
+    
+    @QtCore.pyqtSlot()
     def quit_application(self):
         """退出应用程序"""
-        global stop_flag, last_downloaded_file
         print("👋 正在退出应用...")
         
-        # 停止后台线程
-        stop_flag = True
-        
-        # 清理最后一次下载的临时文件
-        if last_downloaded_file and os.path.exists(last_downloaded_file):
-            try:
-                os.remove(last_downloaded_file)
-                print(f"🗑️  已清理临时文件: {os.path.basename(last_downloaded_file)}")
-            except Exception as e:
-                print(f"⚠️  清理文件失败: {e}")
-        
         # 隐藏托盘图标
         self.hide()
-        
-        # 退出应用程序
-        QtWidgets.QApplication.quit()
+        asyncio.ensure_future(self.shutdown())
+    
+    async def shutdown(self):
+        try:
+            # 停止同步引擎：取消进行中的请求、等待和重试（立即结束），清理下载的临时文件
+            await self.engine.aclose()
+        finally:
+            # 退出应用程序
+            QtWidgets.QApplication.quit()
 
 # =======================
 # 主入口
 # =======================
+def default_tray_icon():
+    """图标加载失败时的备用图标"""
+    if platform.system() == "Darwin":
+        # macOS：创建一个简单的彩色圆形图标（22x22）
+        pixmap = QtGui.QPixmap(44, 44)
+        pixmap.fill(QtCore.Qt.transparent)
+        painter = QtGui.QPainter(pixmap)
+        painter.setRenderHint(QtGui.QPainter.Antialiasing)
+        painter.setBrush(QtGui.QColor(30, 144, 255))
+        painter.setPen(QtCore.Qt.NoPen)
+        painter.drawEllipse(2, 2, 18, 18)
+        painter.end()
+        return QtGui.QIcon(pixmap)
+    # Windows/Linux：尝试主题图标或创建方形图标
+    icon = QtGui.QIcon.fromTheme("edit-paste")
+    if icon.isNull():
+        pixmap = QtGui.QPixmap(32, 32)
+        pixmap.fill(QtGui.QColor(30, 144, 255))
+        icon = QtGui.QIcon(pixmap)
+    return icon
+
+def finish_startup(app, tray_app, engine, config, icon_resolved, profile_startup):
+    """
+    托盘显示后（事件循环已启动）再执行的启动工作：
+    清空剪贴板、启动同步引擎的后台任务（httpx 在启动时于线程中导入并创建连接池）、补充图标尺寸
+    """
+    STARTUP_PROFILE.mark("托盘显示（事件循环启动）")
+    
+    # 启动前清空剪贴板，避免脏数据触发同步（Qt 剪贴板在主线程清空，pyperclip 可能调用外部程序，放到线程池）
+    QtWidgets.QApplication.clipboard().clear()
+    
+    async def start_engine():
+        try:
+            await asyncio.to_thread(lambda: pyperclip.copy(""))
+        except Exception as e:
+            print(f"⚠️  清空文本剪贴板失败: {e}")
+        print("🧹 启动时已清空剪贴板")
+        STARTUP_PROFILE.mark("清空剪贴板")
+        engine.start()
+        STARTUP_PROFILE.mark("启动后台任务")
+        if profile_startup:
+            await engine.first_fetch_event.wait(FIRST_FETCH_PROFILE_TIMEOUT)
+            STARTUP_PROFILE.mark("首次拉取完成（含导入 httpx、建立连接）" if engine.first_fetch_event.is_set()
+                                 else f"首次拉取超时（{FIRST_FETCH_PROFILE_TIMEOUT}s）")
+            print(STARTUP_PROFILE.report())
+            tray_app.quit_application()
+    
+    asyncio.ensure_future(start_engine())
+    
+    # 托盘已显示，再加载预缩放多个尺寸的完整图标（只有 Windows 下 QIcon 无法解码时的回退路径会预缩放）
+    if icon_resolved and platform.system() == "Windows":
+        icon = resolve_app_icon(config.app_icon)
+        if icon and not icon.isNull():
+            app.setWindowIcon(icon)
+            tray_app.setIcon(icon)
+        STARTUP_PROFILE.mark("加载完整图标")
+
 def main():
+    parser = argparse.ArgumentParser(description="SyncClipboard 托盘客户端")
+    parser.add_argument("--profile-startup", action="store_true",
+                        help="输出启动各阶段（导入、初始化、托盘显示、首次拉取）耗时后退出")
+    args, qt_argv = parser.parse_known_args()
+    
+    config_file_path = get_config_path()
+    config = ClientConfig(config_file_path)
+    print(f"📝 配置文件路径: {config_file_path}")
+    STARTUP_PROFILE.mark("读取配置")
+    
     # Windows 单实例保护（尽早执行，避免多开）
-    if not ensure_single_instance_windows(APP_NAME):
+    if not ensure_single_instance_windows(config.app_name):
         # 已有实例在运行，直接退出
         return 0
-
-    app = QtWidgets.QApplication(sys.argv)
-    app.setApplicationName(APP_NAME)
-    app.setApplicationVersion(APP_VERSION)
+    
+    app = QtWidgets.QApplication(sys.argv[:1] + qt_argv)
+    app.setApplicationName(config.app_name)
+    app.setApplicationVersion(config.app_version)
+    # Qt 事件循环同时作为 asyncio 事件循环：同步引擎的网络任务与界面运行在同一个主线程中
+    loop = qasync.QEventLoop(app)
+    asyncio.set_event_loop(loop)
     
     # 确保 Qt 插件路径就绪（onefile 场景尤为重要）
     ensure_qt_plugin_paths()
-
+    
     # Windows特定设置
     if platform.system() == "Windows":
         app.setQuitOnLastWindowClosed(False)  # 防止没有窗口时退出
+    STARTUP_PROFILE.mark("创建 QApplication")
     
-    # 加载应用图标
-    icon = resolve_app_icon()
+    # 加载应用图标（先不预缩放多个尺寸，托盘显示后再补充）
+    icon = resolve_app_icon(config.app_icon, variants=False)
+    icon_resolved = icon is not None and not icon.isNull()
     
     # 如果图标加载失败，使用备用方案
-    if icon is None or icon.isNull():
+    if not icon_resolved:
         print("⚠️  使用默认图标")
-        if platform.system() == "Darwin":
-            # macOS：创建一个简单的彩色圆形图标（22x22）
-            pixmap = QtGui.QPixmap(44, 44)
-            pixmap.fill(QtCore.Qt.transparent)
-            painter = QtGui.QPainter(pixmap)
-            painter.setRenderHint(QtGui.QPainter.Antialiasing)
-            painter.setBrush(QtGui.QColor(30, 144, 255))
-            painter.setPen(QtCore.Qt.NoPen)
-            painter.drawEllipse(2, 2, 18, 18)
-            painter.end()
-            icon = QtGui.QIcon(pixmap)
-        else:
-            # Windows/Linux：尝试主题图标或创建方形图标
-            icon = QtGui.QIcon.fromTheme("edit-paste")
-            if icon.isNull():
-                pixmap = QtGui.QPixmap(32, 32)
-                pixmap.fill(QtGui.QColor(30, 144, 255))
-                icon = QtGui.QIcon(pixmap)
-
+        icon = default_tray_icon()
+    
     # 设置应用图标到 QApplication（在某些 Windows 环境可提升托盘图标稳定性）
     try:
         if icon and not icon.isNull():
@@ -1011,47 +827,50 @@ def main():
             pass
     except Exception as _e:
         pass
+    STARTUP_PROFILE.mark("加载图标")
     
-    # 启动前清空剪贴板，避免脏数据触发同步
-    global is_setting_clipboard, last_sync_download_time, last_downloaded_file
-
-    clipboard = QtWidgets.QApplication.clipboard()
-    clipboard.clear()
-    pyperclip.copy("")
-
-    is_setting_clipboard = False
-    last_sync_download_time = 0
-    last_downloaded_file = None
-
-    print("🧹 启动时已清空剪贴板")
-
-    tray_app = ClipboardTrayApp(icon)
+    qt_clipboard = QtClipboard(config.clipboard_watch)
+    try:
+        engine = SyncEngine(config, qt_clipboard)
+    except RuntimeError as e:
+        # 配置了加密口令但缺少加密依赖：不能以明文继续同步
+        print(f"❌ {e}")
+        QtWidgets.QMessageBox.critical(None, config.app_name, str(e))
+        return 1
+    tray_app = ClipboardTrayApp(icon, engine)
     try:
         if icon and not icon.isNull():
             tray_app.setIcon(icon)  # 再次显式设置一遍，增强稳定性
     except Exception as _e:
         pass
     
+    # 托盘作为引擎的通知后端；其余启动工作在托盘显示后执行
+    engine.notifier = tray_app
+    STARTUP_PROFILE.mark("创建托盘")
+    QtCore.QTimer.singleShot(0, lambda: finish_startup(app, tray_app, engine, config, icon_resolved, args.profile_startup))
+    
     # 诊断信息
-    print(f"🧩 {APP_NAME} v{APP_VERSION} 已启动（后台模式）")
-    print(f"🏷️  客户端名称: {CLIENT_NAME}")
-    print(f"📱 设备ID: {DEVICE_ID}")
-    print(f"🔗 服务端地址: {SERVER_URL}")
+    print(f"🧩 {config.app_name} v{config.app_version} 已启动（后台模式）")
+    print(f"🏷️  客户端名称: {config.client_name}")
+    print(f"📱 设备ID: {config.device_id}")
+    print(f"🔗 服务端地址: {config.server_url}")
+    print(f"📺 频道: {config.channel}")
     print(f"🔌 HTTP Keep-Alive: 已启用（连接池大小: 10-20）")
+    print(f"🔁 拉取模式: {config.sync_mode_text()}")
+    print(f"👀 剪贴板检测: {'系统通知' if qt_clipboard.event_mode() else '轮询（0.5秒）'}")
     print(f"🖥️  操作系统: {platform.system()}")
     
     # 文件同步配置信息
-    if MAX_FILE_SIZE is None:
-        print(f"📁 文件同步: 已禁用")
-    elif MAX_FILE_SIZE == 0:
-        print(f"📁 文件同步: 已启用（无大小限制）")
-    else:
-        print(f"📁 文件同步: 已启用（限制 {MAX_FILE_SIZE/(1024*1024):.1f}MB）")
+    print(f"📁 文件同步: {config.file_sync_text()}")
+    if config.lazy_download:
+        print(f"⏳ 延迟下载: 已启用（图片/文件粘贴时才下载）")
+    if config.encryption_key:
+        print(f"🔐 端到端加密: 已启用（服务端只保存密文）")
     
     print(f"💡 提示: 使用 Ctrl+C 或任务管理器退出程序")
     
-    sys.exit(app.exec_())
+    with loop:
+        sys.exit(loop.run_forever())
 
 if __name__ == "__main__":
-    main()
-
+    sys.exit(main())
@@ -0,0 +1,376 @@
+"""
+SyncClipboard 负载测试：模拟多台设备按真实协议轮询 /fetch、定期 /upload，逐级增加客户端数量，
+输出每一级的请求速率、p50/p95/p99 延迟、错误率，以及服务端进程的 CPU 与内存占用
+
+每个虚拟客户端持有一条 Keep-Alive 连接（与客户端的 httpx 连接池一致），按 sync_interval（带随机抖动）拉取，
+同一频道内的客户端互相看到对方上传的内容；所有客户端在同一个 asyncio 事件循环中运行，不依赖额外的 HTTP 库
+
+用法：
+    python loadtest.py                                      # 本机启动临时服务端，客户端数 10,50,100,200,500
+    python loadtest.py --clients 100,1000,2000 --sync-interval 2 --step-seconds 30
+    python loadtest.py --protocol last_sync_time            # 旧版客户端协议（last_sync_time 参数）
+    python loadtest.py --server http://host:8910/prefix --server-pid 1234
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import os
+import platform
+import random
+import shutil
+import ssl
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime
+from urllib.parse import quote, urlencode, urlsplit
+
+from benchmark import git_revision, start_local_server
+
+RESULT_FORMAT = 1  # 结果文件格式版本
+JITTER = 0.2  # 轮询间隔随机抖动比例（与客户端 PollScheduler 一致）
+REQUEST_TIMEOUT = 10  # 单个请求超时（秒）
+
+# =======================
+# 最小 HTTP/1.1 客户端
+# =======================
+class HttpError(Exception):
+    pass
+
+class HttpConnection:
+    """单条 Keep-Alive 连接，串行发送请求；连接出错后下次请求时重新建立"""
+    
+    def __init__(self, server_url, channel):
+        url = urlsplit(server_url)
+        self.host = url.hostname
+        self.port = url.port or (443 if url.scheme == "https" else 80)
+        self.ssl = ssl.create_default_context() if url.scheme == "https" else None
+        self.prefix = url.path.rstrip("/")
+        self.headers = f"Host: {url.netloc}\r\nX-Channel: {quote(channel)}\r\nAccept-Encoding: gzip\r\nConnection: keep-alive\r\n"
+        self.reader = None
+        self.writer = None
+    
+    async def request(self, method, path, params=None, headers=None, body=b""):
+        """发送请求，返回 (状态码, 响应头, 响应体)"""
+        try:
+            return await asyncio.wait_for(self._request(method, path, params, headers, body), REQUEST_TIMEOUT)
+        except BaseException:
+            self.close()
+            raise
+    
+    async def _request(self, method, path, params, headers, body):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port, ssl=self.ssl)
+        target = f"{self.prefix}{path}" + (f"?{urlencode(params)}" if params else "")
+        extra = "".join(f"{name}: {value}\r\n" for name, value in (headers or {}).items())
+        self.writer.write(f"{method} {target} HTTP/1.1\r\n{self.headers}{extra}Content-Length: {len(body)}\r\n\r\n".encode() + body)
+        await self.writer.drain()
+        
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise HttpError("连接已关闭")
+        status = int(status_line.split()[1])
+        response_headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            response_headers[name.strip().lower()] = value.strip()
+        
+        if response_headers.get("transfer-encoding") == "chunked":
+            chunks = []
+            while True:
+                size = int((await self.reader.readline()).split(b";")[0], 16)
+                chunk = await self.reader.readexactly(size + 2)
+                if size == 0:
+                    break
+                chunks.append(chunk[:-2])
+            data = b"".join(chunks)
+        elif status in (204, 304) or method == "HEAD":
+            data = b""
+        else:
+            data = await self.reader.readexactly(int(response_headers.get("content-length", 0)))
+        if response_headers.get("content-encoding") == "gzip":
+            data = gzip.decompress(data)
+        if response_headers.get("connection", "").lower() == "close":
+            self.close()
+        return status, response_headers, data
+    
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+# =======================
+# 虚拟客户端
+# =======================
+class Stats:
+    """一个统计窗口（一级负载）内的请求结果"""
+    
+    def __init__(self):
+        self.latencies = {"fetch": [], "upload": []}
+        self.errors = {"fetch": 0, "upload": 0}
+        self.error_samples = {}
+        self.full_fetches = 0
+    
+    def record(self, kind, latency, error=None):
+        if error is None:
+            self.latencies[kind].append(latency)
+        else:
+            self.errors[kind] += 1
+            self.error_samples[error] = self.error_samples.get(error, 0) + 1
+
+class VirtualClient:
+    """按真实协议运行的虚拟客户端：定时拉取（ETag 或 last_sync_time），按上传间隔上传文本"""
+    
+    def __init__(self, index, server_url, channel, args):
+        self.index = index
+        self.connection = HttpConnection(server_url, channel)
+        self.args = args
+        self.device_id = f"loadtest-{index}"
+        self.etag = None
+        self.last_sync_time = None
+        self.stopped = False
+    
+    def jittered(self, interval):
+        return interval * random.uniform(1 - JITTER, 1 + JITTER)
+    
+    async def fetch(self, stats):
+        headers, params = {}, {}
+        if self.args.protocol == "etag" and self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.args.protocol == "last_sync_time" and self.last_sync_time:
+            params["last_sync_time"] = self.last_sync_time
+        status, response_headers, body = await self.connection.request("GET", "/fetch", params, headers)
+        if status == 200:
+            data = json.loads(body)
+            if data.get("status") != "no_update":
+                stats.full_fetches += 1
+                self.etag = response_headers.get("etag")
+                self.last_sync_time = data.get("updated_at")
+        elif status != 304:
+            raise HttpError(f"/fetch HTTP {status}")
+    
+    async def upload(self, seq):
+        body = json.dumps({
+            "device_id": self.device_id,
+            "client_name": self.device_id,
+            "content_type": "text",
+            "content": f"{self.device_id} #{seq} " + "x" * self.args.text_size
+        }).encode()
+        status, _, _ = await self.connection.request("POST", "/upload", headers={"Content-Type": "application/json"}, body=body)
+        if status != 200:
+            raise HttpError(f"/upload HTTP {status}")
+    
+    async def run(self, get_stats):
+        args = self.args
+        # 错开各客户端的启动时间，避免同时发起请求
+        await asyncio.sleep(random.uniform(0, args.sync_interval))
+        next_upload = time.monotonic() + (random.uniform(0, args.upload_interval) if args.upload_interval > 0 else float("inf"))
+        seq = 0
+        while not self.stopped:
+            if time.monotonic() >= next_upload:
+                seq += 1
+                await self.timed("upload", self.upload(seq), get_stats())
+                next_upload += self.jittered(args.upload_interval)
+            await self.timed("fetch", self.fetch(get_stats()), get_stats())
+            await asyncio.sleep(self.jittered(args.sync_interval))
+        self.connection.close()
+    
+    async def timed(self, kind, coro, stats):
+        start = time.perf_counter()
+        try:
+            await coro
+            stats.record(kind, time.perf_counter() - start)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            stats.record(kind, time.perf_counter() - start, error=f"{type(e).__name__}: {e}"[:120])
+
+# =======================
+# 服务端资源监控
+# =======================
+def process_usage(pid):
+    """进程累计 CPU 时间（秒）与常驻内存（字节）；优先使用 psutil，否则读取 /proc（Linux），都不可用时返回 None"""
+    try:
+        import psutil
+        process = psutil.Process(pid)
+        cpu = process.cpu_times()
+        return cpu.user + cpu.system, process.memory_info().rss
+    except ImportError:
+        pass
+    except Exception:
+        return None
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        cpu_seconds = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+        with open(f"/proc/{pid}/status") as f:
+            rss = next(int(line.split()[1]) * 1024 for line in f if line.startswith("VmRSS:"))
+        return cpu_seconds, rss
+    except (OSError, StopIteration, IndexError, ValueError):
+        return None
+
+def percentile(samples, p):
+    if not samples:
+        return None
+    samples = sorted(samples)
+    return round(samples[min(len(samples) - 1, int(len(samples) * p / 100))] * 1000, 2)
+
+# =======================
+# 逐级加压
+# =======================
+def raise_open_file_limit():
+    """每个虚拟客户端占用一条连接，尽量提高可打开的文件数上限"""
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if soft < hard:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    except (ImportError, ValueError, OSError):
+        pass
+
+def step_result(clients, stats, elapsed, server_before, server_after, client_cpu):
+    """汇总一级负载的统计结果"""
+    fetches, uploads = stats.latencies["fetch"], stats.latencies["upload"]
+    total = len(fetches) + len(uploads)
+    errors = stats.errors["fetch"] + stats.errors["upload"]
+    result = {
+        "clients": clients,
+        "seconds": round(elapsed, 2),
+        "requests": total + errors,
+        "requests_per_s": round((total + errors) / elapsed, 1),
+        "error_rate": round(errors / (total + errors), 4) if total + errors else 0,
+        "full_fetches": stats.full_fetches,
+        "fetch_p50_ms": percentile(fetches, 50),
+        "fetch_p95_ms": percentile(fetches, 95),
+        "fetch_p99_ms": percentile(fetches, 99),
+        "upload_p50_ms": percentile(uploads, 50),
+        "upload_p95_ms": percentile(uploads, 95),
+        "upload_p99_ms": percentile(uploads, 99),
+        "fetch_mean_ms": round(statistics.mean(fetches) * 1000, 2) if fetches else None,
+        "errors": dict(sorted(stats.error_samples.items(), key=lambda e: -e[1])[:5]),
+        "generator_cpu_percent": round(client_cpu / elapsed * 100, 1),
+    }
+    if server_before and server_after:
+        server_cpu = server_after[0] - server_before[0]
+        result["server_cpu_percent"] = round(server_cpu / elapsed * 100, 1)
+        # 每个请求的服务端 CPU 时间应与客户端数量无关，随客户端数增长说明存在 O(客户端数) 的处理路径
+        result["server_cpu_ms_per_request"] = round(server_cpu * 1000 / (total + errors), 3) if total + errors else None
+        result["server_rss_mb"] = round(server_after[1] / (1024 * 1024), 1)
+    return result
+
+async def run_load(server_url, server_pid, args):
+    client_counts = sorted(int(n) for n in args.clients.split(",") if n.strip())
+    run_id = uuid.uuid4().hex[:6]
+    clients, tasks, results = [], [], []
+    stats = Stats()
+    get_stats = lambda: stats
+    
+    try:
+        for count in client_counts:
+            # 增加虚拟客户端（已有客户端继续运行），每 clients_per_channel 个客户端共享一个频道
+            while len(clients) < count:
+                index = len(clients)
+                channel = f"load-{run_id}-{index // args.clients_per_channel}"
+                client = VirtualClient(index, server_url, channel, args)
+                clients.append(client)
+                tasks.append(asyncio.ensure_future(client.run(get_stats)))
+            
+            # 预热：新客户端错开启动需要一个拉取间隔，之后才开始统计
+            await asyncio.sleep(args.sync_interval * (1 + JITTER))
+            stats = Stats()
+            server_before = process_usage(server_pid) if server_pid else None
+            cpu_start, start = time.process_time(), time.perf_counter()
+            await asyncio.sleep(args.step_seconds)
+            elapsed = time.perf_counter() - start
+            window, stats = stats, Stats()
+            server_after = process_usage(server_pid) if server_pid else None
+            
+            result = step_result(count, window, elapsed, server_before, server_after, time.process_time() - cpu_start)
+            results.append(result)
+            print_step(result)
+            if result["generator_cpu_percent"] > 90:
+                print("⚠️  负载生成器 CPU 已接近饱和，结果可能受生成器限制")
+            if args.max_error_rate is not None and result["error_rate"] > args.max_error_rate:
+                print(f"🛑 错误率 {result['error_rate']:.1%} 超过 {args.max_error_rate:.1%}，停止加压")
+                break
+    finally:
+        for client in clients:
+            client.stopped = True
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    return results
+
+def print_step(r):
+    server = (f" | 服务端 CPU {r['server_cpu_percent']:5.1f}%（{r['server_cpu_ms_per_request']} ms/请求）"
+              f" 内存 {r['server_rss_mb']:7.1f}MB"
+              if "server_cpu_percent" in r else "")
+    print(f"👥 {r['clients']:>6} 客户端 | {r['requests_per_s']:8.1f} req/s | fetch p50/p95/p99 "
+          f"{r['fetch_p50_ms']}/{r['fetch_p95_ms']}/{r['fetch_p99_ms']} ms | upload p95 {r['upload_p95_ms']} ms"
+          f" | 错误率 {r['error_rate']:.2%}{server}")
+    for error, count in r["errors"].items():
+        print(f"   ❌ {count} × {error}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="SyncClipboard 负载测试")
+    parser.add_argument("--server", default=None, help="使用已运行的服务端（包含 URL 前缀），默认在本机启动临时服务端")
+    parser.add_argument("--server-pid", type=int, default=None, help="使用 --server 时，用于采集 CPU/内存的服务端进程 PID")
+    parser.add_argument("--clients", default="10,50,100,200,500", help="逐级的虚拟客户端数量")
+    parser.add_argument("--step-seconds", type=float, default=20, help="每一级的统计时长（秒）")
+    parser.add_argument("--sync-interval", type=float, default=2, help="客户端拉取间隔（秒），同 config.ini 的 sync_interval")
+    parser.add_argument("--upload-interval", type=float, default=30, help="每个客户端的上传间隔（秒），0 表示不上传")
+    parser.add_argument("--clients-per-channel", type=int, default=3, help="共享一个频道的客户端数（同一用户的多台设备）")
+    parser.add_argument("--protocol", choices=("etag", "last_sync_time"), default="etag",
+                        help="拉取协议：etag（当前客户端，If-None-Match）或 last_sync_time（旧版客户端）")
+    parser.add_argument("--text-size", type=int, default=200, help="上传文本的大小（字符）")
+    parser.add_argument("--max-error-rate", type=float, default=0.05, help="某一级错误率超过该值时停止加压")
+    parser.add_argument("--output", default="loadtest_results.json", help="结果文件路径")
+    args = parser.parse_args(argv)
+    
+    raise_open_file_limit()
+    server_process = None
+    work_dir = None
+    server_url, server_pid = args.server, args.server_pid
+    try:
+        if not server_url:
+            work_dir = tempfile.mkdtemp(prefix="syncclipboard_load_")
+            server_process, server_url = start_local_server(work_dir, 0)
+            server_pid = server_process.pid
+            print(f"🚀 本地服务端已启动: {server_url}（PID {server_pid}）")
+        if server_pid and process_usage(server_pid) is None:
+            print("⚠️  无法读取服务端进程的 CPU/内存（需要 Linux 或安装 psutil）")
+            server_pid = None
+        print(f"🔁 拉取间隔 {args.sync_interval:g}s，上传间隔 {args.upload_interval:g}s，协议 {args.protocol}，"
+              f"每级 {args.step_seconds:g}s")
+        results = asyncio.run(run_load(server_url, server_pid, args))
+    finally:
+        if server_process:
+            server_process.terminate()
+            server_process.wait(10)
+        if work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    
+    report = {
+        "format": RESULT_FORMAT,
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "server": args.server or "local",
+        "settings": {name: value for name, value in vars(args).items() if name not in ("output", "server", "server_pid")},
+        "steps": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"💾 结果已保存: {args.output}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
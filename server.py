@@ -1,99 +1,1353 @@
+import asyncio
+import atexit
+import base64
+import gzip
+import hashlib
+import json
+import math
+import os
+import re
+import shutil
+import tempfile
+import time
+import uuid
+import zlib
+from collections import Counter, OrderedDict, deque, namedtuple
+from itertools import islice
 from datetime import datetime, timezone
-from fastapi import FastAPI, Request
+from urllib.parse import unquote
+from fastapi import FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.requests import ClientDisconnect, HTTPConnection
 import uvicorn
 import configparser
 
+try:
+    import zstandard  # 可选依赖：安装后支持 zstd 压缩
+except ImportError:
+    zstandard = None
+
 # 读取配置文件
 config = configparser.ConfigParser()
 config.read("config.ini", encoding="utf-8")
 HOST = config.get("server", "host", fallback="0.0.0.0")
 PORT = config.getint("server", "port", fallback=8000)
 URL_PREFIX = config.get("server", "url_prefix", fallback="")
+# 长轮询单次最长挂起时间（秒），客户端请求的 wait 会被截断到该值
+LONG_POLL_MAX_SECONDS = config.getfloat("server", "long_poll_max", fallback=60)
+# 建议的客户端最短轮询间隔（秒），随“无更新”响应下发，用于集中降低轮询压力；0 表示不限制
+POLL_INTERVAL_HINT = config.getfloat("server", "poll_interval", fallback=0)
+# 单个 WebSocket 客户端推送超时（秒），超时的连接会被断开
+PUSH_SEND_TIMEOUT = config.getfloat("server", "push_send_timeout", fallback=10)
+# 文件/图片数据落盘目录，留空则在系统临时目录下创建（退出时清理）
+DATA_DIR = config.get("server", "data_dir", fallback="").strip()
+if DATA_DIR:
+    os.makedirs(DATA_DIR, exist_ok=True)
+else:
+    DATA_DIR = tempfile.mkdtemp(prefix="syncclipboard_server_")
+    atexit.register(shutil.rmtree, DATA_DIR, ignore_errors=True)
+# 磁盘数据上限（MB）：超出后淘汰最久未使用且不再被引用的数据
+BLOB_DISK_LIMIT = config.getfloat("server", "blob_disk_mb", fallback=1024) * 1024 * 1024
+# 内存热数据缓存上限（MB），0 表示不缓存
+BLOB_CACHE_LIMIT = config.getfloat("server", "blob_cache_mb", fallback=64) * 1024 * 1024
+# 历史记录保留条数，以及历史内容总大小上限（MB），超出任一限制时淘汰最旧的记录
+HISTORY_MAX_ITEMS = config.getint("server", "history_size", fallback=50)
+HISTORY_MAX_BYTES = config.getfloat("server", "history_mb", fallback=256) * 1024 * 1024
+# 频道空闲多久（秒，无请求且无在线连接）后被回收，及同时存在的频道数上限
+CHANNEL_IDLE_SECONDS = config.getfloat("server", "channel_idle_seconds", fallback=86400)
+MAX_CHANNELS = config.getint("server", "max_channels", fallback=10000)
+# 分块上传的分块大小（MB），及未完成的分块上传保留多久（小时）后被清理
+UPLOAD_CHUNK_SIZE = max(1, int(config.getfloat("server", "upload_chunk_mb", fallback=4) * 1024 * 1024))
+UPLOAD_EXPIRE_SECONDS = config.getfloat("server", "upload_expire_hours", fallback=24) * 3600
+MAX_CHUNKED_UPLOADS = config.getint("server", "max_chunked_uploads", fallback=4)
+# JSON 请求体（文本、旧版客户端 Base64 内嵌的文件/图片）解压前后的大小上限（MB）
+MAX_JSON_BYTES = int(config.getfloat("server", "max_json_mb", fallback=32) * 1024 * 1024)
 
 app = FastAPI()
 
-# 用内存保存剪贴板内容
-clipboard_store = {
-    "content": "",
-    "content_type": "text",  # text, file 或 image
-    "file_name": None,       # 文件名（当content_type=file时）
-    "file_data": None,       # 文件数据（Base64编码）
-    "file_size": 0,          # 文件大小（字节）
-    "image_data": None,      # 图片数据（Base64编码的PNG）
-    "image_width": 0,        # 图片宽度
-    "image_height": 0,       # 图片高度
-    "image_size": 0,         # 图片大小（字节）
-    "updated_at": None,
-    "device_id": None,
-    "client_name": None      # 客户端名称
-}
+# =======================
+# 监控指标（Prometheus 文本格式）
+# =======================
+METRICS = []
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = tuple(1024 * 4 ** i for i in range(10))  # 1KB ~ 256MB
 
-@app.post(f"{URL_PREFIX}/upload")
-async def upload_clipboard(request: Request):
-    data = await request.json()
+def escape_label_value(value):
+    """按 Prometheus 文本格式转义标签值中的反斜杠、双引号和换行"""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def format_labels(names, values, extra=""):
+    pairs = [f'{name}="{escape_label_value(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class MetricCounter:
+    """计数器（只增不减）"""
+    
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.values = Counter()
+        METRICS.append(self)
+    
+    def inc(self, amount=1, **labels):
+        self.values[tuple(labels.get(name, "") for name in self.labels)] += amount
+    
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(self.values.items()):
+            lines.append(f"{self.name}{format_labels(self.labels, key)} {value}")
+        return lines
+
+class MetricHistogram:
+    """直方图（累计分桶 + 总和 + 次数）"""
+    
+    def __init__(self, name, help_text, buckets, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.labels = labels
+        self.series = {}  # 标签值 -> [各桶计数..., +Inf计数, 总和]
+        METRICS.append(self)
+    
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, "") for name in self.labels)
+        series = self.series.get(key)
+        if series is None:
+            series = self.series[key] = [0] * (len(self.buckets) + 2)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[i] += 1
+        series[-2] += 1
+        series[-1] += value
+    
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for key, series in sorted(self.series.items()):
+            for bound, count in zip(self.buckets, series):
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{format_labels(self.labels, key, le)} {count}")
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{format_labels(self.labels, key, le)} {series[-2]}")
+            lines.append(f"{self.name}_sum{format_labels(self.labels, key)} {series[-1]}")
+            lines.append(f"{self.name}_count{format_labels(self.labels, key)} {series[-2]}")
+        return lines
+
+class MetricGauge:
+    """仪表盘：抓取时调用函数取当前值"""
+    
+    def __init__(self, name, help_text, func):
+        self.name = name
+        self.help_text = help_text
+        self.func = func
+        METRICS.append(self)
+    
+    def render(self):
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} gauge", f"{self.name} {self.func()}"]
+
+requests_total = MetricCounter("syncclipboard_requests_total", "HTTP 请求数", ("endpoint", "status"))
+request_duration = MetricHistogram("syncclipboard_request_duration_seconds", "HTTP 请求耗时（秒）", LATENCY_BUCKETS, ("endpoint",))
+fetch_results = MetricCounter("syncclipboard_fetch_results_total", "/fetch 响应类型（not_modified、no_update 或 full）", ("result",))
+payload_bytes = MetricHistogram("syncclipboard_payload_bytes", "上传内容大小（字节）", SIZE_BUCKETS, ("content_type",))
+bytes_received = MetricCounter("syncclipboard_received_bytes_total", "HTTP 请求体接收字节数")
+bytes_sent = MetricCounter("syncclipboard_sent_bytes_total", "HTTP 响应体与推送发送字节数")
+
+def endpoint_name(path, query_string):
+    """将请求路径归类为接口名（避免 blob_id、seq 等参数导致标签基数膨胀）"""
+    if not path.startswith(URL_PREFIX):
+        return "other"
+    path = path[len(URL_PREFIX):]
+    if path == "/fetch":
+        return "fetch_long_poll" if b"wait=" in query_string else "fetch"
+    if path.startswith("/download/"):
+        return "download"
+    if path.startswith("/history/"):
+        return "history_item"
+    if path.startswith("/blobs/"):
+        return "blob_check"
+    if path.startswith("/upload/chunked/"):
+        if path.endswith("/commit"):
+            return "upload_chunked_commit"
+        return "upload_chunk" if path.count("/") == 4 else "upload_chunked_status"
+    if path in ("/upload", "/upload/stream", "/upload/chunked", "/history", "/status", "/metrics"):
+        return path[1:].replace("/", "_")
+    return "other"
+
+class MetricsMiddleware:
+    """ASGI 中间件：统计每个 HTTP 请求的次数、状态码、耗时和收发字节数"""
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        endpoint = endpoint_name(scope["path"], scope.get("query_string", b""))
+        start = time.perf_counter()
+        status_code = 500
+        
+        async def counting_receive():
+            message = await receive()
+            if message["type"] == "http.request":
+                bytes_received.inc(len(message.get("body", b"")))
+            return message
+        
+        async def counting_send(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            elif message["type"] == "http.response.body":
+                bytes_sent.inc(len(message.get("body", b"")))
+            await send(message)
+        
+        try:
+            await self.app(scope, counting_receive, counting_send)
+        finally:
+            requests_total.inc(endpoint=endpoint, status=str(status_code))
+            request_duration.observe(time.perf_counter() - start, endpoint=endpoint)
+
+app.add_middleware(MetricsMiddleware)
+
+# =======================
+# 压缩编码
+# =======================
+# 服务端支持的压缩编码（按优先级），客户端通过 /status 获取后用于压缩上传内容
+SUPPORTED_ENCODINGS = ("zstd", "gzip") if zstandard else ("gzip",)
+# JSON 响应体达到该大小才压缩
+COMPRESS_MIN_BYTES = 1024
+# 压缩数据损坏时解压器抛出的异常
+DECOMPRESS_ERRORS = (zlib.error, ValueError) + ((zstandard.ZstdError,) if zstandard else ())
+
+def make_decompressor(encoding):
+    """创建流式解压器（gzip / zstd）"""
+    if encoding == "gzip":
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if encoding == "zstd" and zstandard:
+        return zstandard.ZstdDecompressor().decompressobj()
+    raise HTTPException(status_code=415, detail=f"不支持的 Content-Encoding: {encoding}")
+
+def decompress_bytes(data, encoding, max_length):
+    """
+    解压完整的请求体：解压出的数据超过 max_length 字节时停止解压并返回 413（防止很小的压缩炸弹耗尽内存）
+    数据损坏或不完整时返回 400
+    """
+    try:
+        if encoding == "zstd" and zstandard:
+            raw = bytearray()
+            with zstandard.ZstdDecompressor().stream_reader(data, read_across_frames=True) as reader:
+                for chunk in iter(lambda: reader.read(min(1024 * 1024, max_length + 1 - len(raw))), b""):
+                    raw += chunk
+                    if len(raw) > max_length:
+                        break
+        else:
+            decompressor = make_decompressor(encoding)
+            raw = decompressor.decompress(data, max_length + 1)
+            if len(raw) <= max_length:
+                if not decompressor.eof:
+                    raise ValueError("数据不完整")
+                raw += decompressor.flush()
+    except DECOMPRESS_ERRORS as e:
+        raise HTTPException(status_code=400, detail=f"压缩数据损坏: {e}")
+    if len(raw) > max_length:
+        raise HTTPException(status_code=413, detail="解压后的请求体过大")
+    return bytes(raw)
+
+def compress_bytes(data, encoding):
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    return gzip.compress(data, compresslevel=6)
+
+def accepted_encoding(conn: HTTPConnection, encodings=SUPPORTED_ENCODINGS):
+    """按服务端优先级，选出客户端 Accept-Encoding 中支持的编码（都不支持返回 None）"""
+    accepted = {token.split(";")[0].strip().lower() for token in conn.headers.get("accept-encoding", "").split(",")}
+    for encoding in encodings:
+        if encoding in accepted:
+            return encoding
+    return None
+
+async def read_body(request: Request, limit):
+    """读取请求体，超过 limit 字节时停止接收并返回 413（Content-Length 已超出时直接拒绝）"""
+    content_length = request.headers.get("content-length", "")
+    if content_length.isdigit() and int(content_length) > limit:
+        raise HTTPException(status_code=413, detail="请求体过大")
+    body = bytearray()
+    async for chunk in request.stream():
+        body += chunk
+        if len(body) > limit:
+            raise HTTPException(status_code=413, detail="请求体过大")
+    return bytes(body)
+
+async def read_json(request: Request):
+    """读取 JSON 请求体（可按 Content-Encoding 压缩）：超过 MAX_JSON_BYTES 返回 413，格式错误返回 400"""
+    limit = MAX_JSON_BYTES
+    body = await read_body(request, limit)
+    encoding = request_encoding(request)
+    if encoding:
+        body = decompress_bytes(body, encoding, limit)
+    try:
+        data = json.loads(body)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="请求体不是合法的 JSON")
+    if not isinstance(data, dict):
+        raise HTTPException(status_code=400, detail="请求体应为 JSON 对象")
+    return data
+
+def request_encoding(request: Request):
+    """请求体的压缩编码（未压缩返回 None）"""
+    encoding = request.headers.get("content-encoding", "").strip().lower()
+    if encoding in ("", "identity"):
+        return None
+    if encoding not in SUPPORTED_ENCODINGS:
+        raise HTTPException(status_code=415, detail=f"不支持的 Content-Encoding: {encoding}")
+    return encoding
+
+# =======================
+# 内容寻址数据存储
+# =======================
+# size: 原始字节数；stored_size: 磁盘上的字节数；encoding: 存储时的压缩编码（None 为未压缩）
+BlobInfo = namedtuple("BlobInfo", ["size", "stored_size", "encoding"])
+ENCODING_SUFFIXES = {"gzip": "gz", "zstd": "zst"}
+
+class BlobTooLarge(Exception):
+    """数据超过磁盘数据上限（blob_disk_mb），无法保存"""
+
+class BlobStore:
+    """
+    以 SHA-256（原始内容）为键的文件/图片数据存储：数据落盘保存，相同内容只保存一份。
+    - 客户端压缩上传的数据按压缩形式保存，下载时直接发送给支持该编码的客户端，不重复压缩
+    - 被当前剪贴板引用的数据不会被淘汰；未引用的数据按 LRU 保留在磁盘上限内，供重复上传时秒传
+    - 较小的热数据额外缓存在内存中（LRU，受 blob_cache_mb 限制）
+    """
+    # 未压缩: <sha256>；压缩: <sha256>-<原始字节数>.gz / .zst
+    FILE_NAME_RE = re.compile(r"^([0-9a-f]{64})(?:-(\d+)\.(gz|zst))?$")
+    
+    def __init__(self, root, disk_limit, cache_limit):
+        self.root = root
+        self.disk_limit = disk_limit
+        self.cache_limit = cache_limit
+        self.disk = OrderedDict()   # sha256 -> BlobInfo（按最近使用排序）
+        self.disk_bytes = 0
+        self.reserved_bytes = 0     # 未完成的分块上传预留的磁盘空间
+        self.cache = OrderedDict()  # sha256 -> 磁盘上的字节（可能是压缩形式）
+        self.cache_bytes = 0
+        self.refs = Counter()       # sha256 -> 引用计数
+        self._load_existing()
+    
+    def _load_existing(self):
+        """启动时载入数据目录中已有的数据（配置了持久化 data_dir 时），清理残留的临时文件"""
+        suffix_encodings = {suffix: encoding for encoding, suffix in ENCODING_SUFFIXES.items()}
+        entries = []
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if name.endswith(".part"):
+                remove_file(path)
+                continue
+            match = self.FILE_NAME_RE.match(name)
+            if not match:
+                continue
+            sha256, raw_size, suffix = match.groups()
+            encoding = suffix_encodings.get(suffix)
+            if encoding and encoding not in SUPPORTED_ENCODINGS:
+                continue
+            stored_size = os.path.getsize(path)
+            info = BlobInfo(int(raw_size) if raw_size else stored_size, stored_size, encoding)
+            entries.append((os.path.getmtime(path), sha256, info))
+        for _, sha256, info in sorted(entries):
+            self.disk[sha256] = info
+            self.disk_bytes += info.stored_size
+        self._trim_disk()
+    
+    @staticmethod
+    def file_name(sha256, info):
+        if info.encoding:
+            return f"{sha256}-{info.size}.{ENCODING_SUFFIXES[info.encoding]}"
+        return sha256
+    
+    def path(self, sha256):
+        return os.path.join(self.root, self.file_name(sha256, self.disk[sha256]))
+    
+    def has(self, sha256):
+        return sha256 in self.disk
+    
+    def info(self, sha256):
+        return self.disk.get(sha256)
+    
+    def size(self, sha256):
+        """原始内容字节数"""
+        info = self.disk.get(sha256)
+        return info.size if info else 0
+    
+    def touch(self, sha256):
+        """标记为最近使用"""
+        if sha256 in self.disk:
+            self.disk.move_to_end(sha256)
+    
+    def _commit(self, tmp_path, sha256, info):
+        """
+        将临时文件登记为正式数据（内容已存在则丢弃临时文件）
+        刚登记的数据尚未被历史引用，淘汰时跳过，由调用方随后加入历史（引用）
+        """
+        if sha256 in self.disk:
+            remove_file(tmp_path)
+        else:
+            os.replace(tmp_path, os.path.join(self.root, self.file_name(sha256, info)))
+            self.disk[sha256] = info
+            self.disk_bytes += info.stored_size
+        self.touch(sha256)
+        self._trim_disk(keep=sha256)
+        return sha256, info.size
+    
+    def put_bytes(self, data):
+        """保存内存中的未压缩数据，返回 (sha256, 字节数)"""
+        sha256 = hashlib.sha256(data).hexdigest()
+        if sha256 in self.disk:
+            self.touch(sha256)
+            return sha256, len(data)
+        if len(data) > self.disk_limit:
+            raise BlobTooLarge(len(data))
+        tmp_path = os.path.join(self.root, f"{uuid.uuid4().hex}.part")
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        self._cache_put(sha256, data)
+        return self._commit(tmp_path, sha256, BlobInfo(len(data), len(data), None))
+    
+    async def put_stream(self, chunks, encoding=None):
+        """
+        边接收边写入临时文件（不在内存中保留完整数据），返回 (sha256, 原始字节数)
+        写入的字节数超过磁盘上限时中止并抛出 BlobTooLarge
+        :param encoding: 请求体的压缩编码，数据按压缩形式保存，仅流式解压用于计算原始内容的哈希
+        """
+        tmp_path = os.path.join(self.root, f"{uuid.uuid4().hex}.part")
+        decompressor = make_decompressor(encoding) if encoding else None
+        digest = hashlib.sha256()
+        size = 0
+        stored_size = 0
+        try:
+            with open(tmp_path, "wb") as f:
+                async for chunk in chunks:
+                    if not chunk:
+                        continue
+                    stored_size += len(chunk)
+                    if stored_size > self.disk_limit:
+                        raise BlobTooLarge(stored_size)
+                    f.write(chunk)
+                    raw = decompressor.decompress(chunk) if decompressor else chunk
+                    digest.update(raw)
+                    size += len(raw)
+                if decompressor:
+                    raw = decompressor.flush()
+                    digest.update(raw)
+                    size += len(raw)
+        except BaseException:
+            # 客户端中途断开、压缩数据损坏等情况，丢弃不完整的数据
+            remove_file(tmp_path)
+            raise
+        return self._commit(tmp_path, digest.hexdigest(), BlobInfo(size, stored_size, encoding))
+    
+    def put_file(self, tmp_path, sha256, size):
+        """登记数据目录中已写好并校验过的未压缩文件（分块上传），返回 (sha256, 字节数)"""
+        return self._commit(tmp_path, sha256, BlobInfo(size, size, None))
+    
+    def read(self, sha256):
+        """读取磁盘上的字节（可能是压缩形式）：命中内存缓存直接返回；可缓存的小数据读入缓存；大数据返回 None（由调用方按文件流式发送）"""
+        data = self.cache.get(sha256)
+        if data is not None:
+            self.cache.move_to_end(sha256)
+            self.touch(sha256)
+            return data
+        if not self._cacheable(self.disk[sha256].stored_size):
+            return None
+        with open(self.path(sha256), "rb") as f:
+            data = f.read()
+        self._cache_put(sha256, data)
+        self.touch(sha256)
+        return data
+    
+    def iter_decoded(self, sha256, chunk_size=1024 * 1024):
+        """流式读取并解压为原始内容（用于不支持该压缩编码的客户端）"""
+        decompressor = make_decompressor(self.disk[sha256].encoding)
+        with open(self.path(sha256), "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                raw = decompressor.decompress(chunk)
+                if raw:
+                    yield raw
+        raw = decompressor.flush()
+        if raw:
+            yield raw
+    
+    def _cacheable(self, size):
+        # 单条数据不超过缓存上限的 1/4，避免一个大文件挤掉所有热数据
+        return 0 < size <= self.cache_limit / 4
+    
+    def _cache_put(self, sha256, data):
+        if not self._cacheable(len(data)) or sha256 in self.cache:
+            return
+        self.cache[sha256] = data
+        self.cache_bytes += len(data)
+        while self.cache_bytes > self.cache_limit:
+            _, evicted = self.cache.popitem(last=False)
+            self.cache_bytes -= len(evicted)
+    
+    def acquire(self, sha256):
+        """增加引用（被引用的数据不会被淘汰）"""
+        if sha256:
+            self.refs[sha256] += 1
+    
+    def release(self, sha256):
+        """释放引用，并按磁盘上限淘汰不再使用的数据"""
+        if not sha256:
+            return
+        self.refs[sha256] -= 1
+        if self.refs[sha256] <= 0:
+            del self.refs[sha256]
+        self._trim_disk()
+    
+    def reserve(self, size):
+        """
+        为分块上传预留磁盘空间（计入磁盘上限，必要时淘汰未引用的数据）
+        被引用的数据和其他上传的预留加上 size 仍超过上限时抛出 BlobTooLarge
+        """
+        self.reserved_bytes += size
+        self._trim_disk()
+        if self.disk_bytes + self.reserved_bytes > self.disk_limit:
+            self.reserved_bytes -= size
+            raise BlobTooLarge(size)
+    
+    def unreserve(self, size):
+        """释放预留的磁盘空间（上传完成登记为数据或会话被丢弃时）"""
+        self.reserved_bytes -= size
+    
+    def _trim_disk(self, keep=None):
+        """从最久未使用的数据开始删除未引用数据（keep 除外），直到低于磁盘上限（含分块上传的预留）"""
+        if self.disk_bytes + self.reserved_bytes <= self.disk_limit:
+            return
+        for sha256 in list(self.disk):
+            if self.disk_bytes + self.reserved_bytes <= self.disk_limit:
+                break
+            if self.refs.get(sha256) or sha256 == keep:
+                continue
+            path = self.path(sha256)
+            self.disk_bytes -= self.disk.pop(sha256).stored_size
+            data = self.cache.pop(sha256, None)
+            if data is not None:
+                self.cache_bytes -= len(data)
+            remove_file(path)
+
+def remove_file(path):
+    """删除数据文件（Windows 下文件可能正被下载占用，失败则忽略）"""
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+blob_store = BlobStore(DATA_DIR, BLOB_DISK_LIMIT, BLOB_CACHE_LIMIT)
+
+# =======================
+# 剪贴板历史
+# =======================
+class ClipboardHistory:
+    """
+    固定容量的剪贴板历史环：按条数和总字节数限制，超出时从最旧的记录开始淘汰。
+    每条记录带递增的 seq 作为游标；记录引用的文件/图片数据在淘汰时释放。
+    """
+    
+    def __init__(self, max_items, max_bytes):
+        self.max_items = max(1, max_items)
+        self.max_bytes = max_bytes
+        self.items = deque()  # (记录, 字节数)，seq 连续递增
+        self.total_bytes = 0
+        self.text_bytes = 0  # 其中保存在内存中的文本字节数
+        self.next_seq = 1
+        self.blob_refs = Counter()  # 历史中引用的数据（用于校验下载权限）
+    
+    @staticmethod
+    def item_bytes(item):
+        """记录占用的内容字节数（文本按 UTF-8 计算，文件/图片按数据大小计算）"""
+        return len(item.get("content", "").encode("utf-8")) + item.get("file_size", 0) + item.get("image_size", 0)
+    
+    @staticmethod
+    def item_text_bytes(item, size):
+        return size - item.get("file_size", 0) - item.get("image_size", 0)
+    
+    @property
+    def oldest_seq(self):
+        return self.items[0][0]["seq"] if self.items else self.next_seq
+    
+    @property
+    def latest_seq(self):
+        return self.next_seq - 1
+    
+    def append(self, item):
+        """追加新记录并淘汰超出限制的旧记录（始终保留最新一条），均摊 O(1)"""
+        item["seq"] = self.next_seq
+        self.next_seq += 1
+        size = self.item_bytes(item)
+        self.items.append((item, size))
+        self.total_bytes += size
+        self.text_bytes += self.item_text_bytes(item, size)
+        self._acquire(item.get("blob_id"))
+        
+        while len(self.items) > 1 and (len(self.items) > self.max_items or self.total_bytes > self.max_bytes):
+            old_item, old_size = self.items.popleft()
+            self.total_bytes -= old_size
+            self.text_bytes -= self.item_text_bytes(old_item, old_size)
+            self._release(old_item.get("blob_id"))
+        return item
+    
+    def clear(self):
+        """清空历史并释放全部数据引用（频道回收时调用）"""
+        while self.items:
+            old_item, _ = self.items.popleft()
+            self._release(old_item.get("blob_id"))
+        self.total_bytes = 0
+        self.text_bytes = 0
+    
+    def has_blob(self, blob_id):
+        return self.blob_refs.get(blob_id, 0) > 0
+    
+    def _acquire(self, blob_id):
+        if blob_id:
+            self.blob_refs[blob_id] += 1
+            blob_store.acquire(blob_id)
+    
+    def _release(self, blob_id):
+        if blob_id:
+            self.blob_refs[blob_id] -= 1
+            if self.blob_refs[blob_id] <= 0:
+                del self.blob_refs[blob_id]
+            blob_store.release(blob_id)
+    
+    def get(self, seq):
+        """按 seq 获取记录，已淘汰或不存在返回 None"""
+        index = seq - self.oldest_seq
+        if 0 <= index < len(self.items):
+            return self.items[index][0]
+        return None
+    
+    def since(self, cursor, limit):
+        """返回 seq 大于 cursor 的记录（最多最新的 limit 条，按时间正序）"""
+        start = max(cursor + 1, self.oldest_seq, self.next_seq - limit)
+        return [item for item, _ in islice(self.items, start - self.oldest_seq, None)]
+
+def item_summary(item):
+    """历史记录的元数据（不含文本正文，正文通过 /history/{seq} 按需获取）"""
+    summary = {key: value for key, value in item.items() if key != "content"}
+    if item.get("content_type") == "text":
+        content = item.get("content", "")
+        # 加密文本的密文没有预览意义，由客户端获取正文后解密
+        summary["content_preview"] = "" if item.get("encrypted") else content[:100]
+        summary["content_length"] = len(content)
+    return summary
+
+# =======================
+# 频道
+# =======================
+def empty_store():
+    """频道的初始剪贴板内容（尚无上传）"""
+    return {
+        "content": "",
+        "content_type": "text",  # text, file 或 image
+        "file_name": None,       # 文件名（当content_type=file时）
+        "file_size": 0,          # 文件大小（字节）
+        "archive": None,         # 多个文件/文件夹打包上传时为 "tar"
+        "image_width": 0,        # 图片宽度
+        "image_height": 0,       # 图片高度
+        "image_size": 0,         # 图片大小（字节）
+        "image_format": None,    # 图片编码格式：png / webp / jpeg
+        "blob_id": None,         # 文件/图片数据的 SHA-256，通过 /download/{blob_id} 下载
+        "encrypted": False,      # 客户端端到端加密：文本、文件名和文件/图片数据均为密文，服务端无法解密
+        "seq": 0,                # 历史记录序号（游标）
+        "updated_at": None,
+        "device_id": None,
+        "client_name": None      # 客户端名称
+    }
+
+class ClipboardChannel:
+    """
+    一个独立的剪贴板频道：当前内容、历史、长轮询等待与推送连接都只在频道内生效。
+    频道在首次访问时创建，空闲超过 channel_idle_seconds 后回收。
+    """
+    
+    def __init__(self, name):
+        self.name = name
+        self.store = empty_store()  # 当前（最新一条）内容，每次上传替换为新记录
+        self.history = ClipboardHistory(HISTORY_MAX_ITEMS, HISTORY_MAX_BYTES)
+        self.ws_clients = set()
+        self.waiters = 0  # 挂起中的长轮询请求数
+        # 内容更新事件：挂起的长轮询请求在此等待，每次上传后触发并替换为新事件
+        # （延迟创建，确保绑定到 uvicorn 的事件循环）
+        self._update_event = None
+        self._encoded = {}  # 压缩编码 -> 当前内容序列化后的 JSON 字节（每个版本只序列化/压缩一次）
+        self._etag = None  # 当前内容的强 ETag（未压缩 JSON 的 SHA-256），与序列化缓存一起失效
+        self.last_active = time.monotonic()
+    
+    def set_store(self, item):
+        """替换当前内容，并清空序列化缓存"""
+        self.store = item
+        self._encoded = {}
+        self._etag = None
+    
+    def encoded_store(self, encoding=None):
+        """当前内容的 JSON 字节（可压缩），按编码缓存"""
+        body = self._encoded.get(encoding)
+        if body is None:
+            if encoding is None:
+                body = json.dumps(self.store).encode("utf-8")
+            else:
+                body = compress_bytes(self.encoded_store(), encoding)
+            self._encoded[encoding] = body
+        return body
+    
+    def etag(self, encoding=None):
+        """当前内容的强 ETag：不同压缩编码是不同的表示，附加编码后缀区分"""
+        if self._etag is None:
+            self._etag = hashlib.sha256(self.encoded_store()).hexdigest()[:32]
+        return f'"{self._etag}-{encoding}"' if encoding else f'"{self._etag}"'
+    
+    def matches_etag(self, if_none_match):
+        """If-None-Match 中是否包含当前内容（任一压缩编码的表示均视为同一内容）"""
+        if not if_none_match:
+            return False
+        self.etag()
+        for tag in if_none_match.split(","):
+            tag = tag.strip()
+            if tag == "*":
+                return True
+            if tag.startswith("W/"):
+                tag = tag[2:]
+            if tag.strip('"').split("-")[0] == self._etag:
+                return True
+        return False
+    
+    def touch(self):
+        self.last_active = time.monotonic()
+    
+    def is_idle(self, now):
+        return not self.ws_clients and not self.waiters and now - self.last_active > CHANNEL_IDLE_SECONDS
+    
+    def get_update_event(self):
+        """获取当前的更新事件（不存在则创建）"""
+        if self._update_event is None:
+            self._update_event = asyncio.Event()
+        return self._update_event
+    
+    def notify_update(self):
+        """唤醒所有等待中的长轮询请求"""
+        if self._update_event is not None:
+            self._update_event.set()
+            self._update_event = None
+    
+    async def wait_for_update(self, timeout):
+        """挂起直到有新内容或超时"""
+        self.waiters += 1
+        try:
+            await asyncio.wait_for(self.get_update_event().wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            self.waiters -= 1
+            self.touch()
+    
+    def is_up_to_date(self, last_sync_time):
+        """客户端的 last_sync_time 是否已是最新"""
+        if not last_sync_time or not self.store.get("updated_at"):
+            return False
+        return self.store["updated_at"] <= last_sync_time
+    
+    async def send_to_client(self, websocket, message):
+        """向单个客户端推送，失败或超时则断开该连接"""
+        try:
+            await asyncio.wait_for(websocket.send_text(message), timeout=PUSH_SEND_TIMEOUT)
+        except Exception:
+            self.ws_clients.discard(websocket)
+            try:
+                await websocket.close()
+            except Exception:
+                pass
+    
+    async def broadcast_update(self):
+        """将当前内容推送给频道内所有已连接的客户端（只序列化一次）"""
+        if not self.ws_clients:
+            return
+        body = self.encoded_store()
+        message = body.decode("utf-8")
+        bytes_sent.inc(len(body) * len(self.ws_clients))
+        await asyncio.gather(*(self.send_to_client(ws, message) for ws in list(self.ws_clients)))
+    
+    def schedule_broadcast(self):
+        """后台推送，不阻塞上传请求的响应"""
+        if not self.ws_clients:
+            return
+        task = asyncio.create_task(self.broadcast_update())
+        push_tasks.add(task)
+        task.add_done_callback(push_tasks.discard)
+    
+    def close(self):
+        """回收频道：释放历史中引用的数据"""
+        self.history.clear()
+
+# 频道表（按需创建），以及进行中的广播任务（保留引用防止被回收）
+channels = {}
+push_tasks = set()
+DEFAULT_CHANNEL = "default"
+CHANNEL_NAME_RE = re.compile(r"^[\w.\-]{1,64}$")
+CHANNEL_SWEEP_INTERVAL = 60
+_last_channel_sweep = time.monotonic()
+
+def sweep_idle_channels(force=False):
+    """回收空闲频道（最多每分钟执行一次，频道数达到上限时立即执行）"""
+    global _last_channel_sweep
+    now = time.monotonic()
+    if not force and now - _last_channel_sweep < CHANNEL_SWEEP_INTERVAL:
+        return
+    _last_channel_sweep = now
+    for name in [name for name, channel in channels.items() if channel.is_idle(now)]:
+        channels.pop(name).close()
+        print(f"🧹 回收空闲频道: {name}")
+
+def get_channel(conn: HTTPConnection):
+    """
+    获取请求所属的频道（不存在则创建）
+    频道名来自请求头 X-Channel 或查询参数 channel，缺省为 default
+    """
+    name = unquote(conn.headers.get("x-channel") or conn.query_params.get("channel") or DEFAULT_CHANNEL)
+    if not CHANNEL_NAME_RE.match(name):
+        raise HTTPException(status_code=400, detail="频道名只能包含字母、数字、下划线、点和连字符（最长64）")
+    
+    sweep_idle_channels()
+    channel = channels.get(name)
+    if channel is None:
+        if len(channels) >= MAX_CHANNELS:
+            sweep_idle_channels(force=True)
+            if len(channels) >= MAX_CHANNELS:
+                raise HTTPException(status_code=503, detail="频道数已达上限")
+        channel = channels[name] = ClipboardChannel(name)
+    channel.touch()
+    return channel
+
+CONTENT_TYPES = ("text", "file", "image")
+ARCHIVE_FORMATS = ("tar",)
+IMAGE_FORMATS = ("png", "webp", "jpeg")
+
+def update_clipboard_store(channel, data, blob_id=None, blob_size=0):
+    """用上传的元数据生成新记录，设为频道的当前内容并加入历史，通知频道内等待中的客户端"""
     content_type = data.get("content_type", "text")
+    # content_type 来自客户端，同时作为监控指标的标签，只接受已知类型（避免标签数量无限增长）
+    if content_type not in CONTENT_TYPES:
+        raise HTTPException(status_code=400, detail=f"不支持的 content_type: {content_type!r}")
     
-    clipboard_store["content_type"] = content_type
-    clipboard_store["device_id"] = data.get("device_id")
-    clipboard_store["client_name"] = data.get("client_name")
-    clipboard_store["updated_at"] = datetime.now(timezone.utc).isoformat()
+    item = {
+        "content": "",
+        "content_type": content_type,
+        "file_name": None,
+        "file_size": 0,
+        "archive": None,
+        "image_width": 0,
+        "image_height": 0,
+        "image_size": 0,
+        "image_format": None,
+        "blob_id": blob_id,
+        "encrypted": bool(data.get("encrypted")),
+        "updated_at": datetime.now(timezone.utc).isoformat(),
+        "device_id": data.get("device_id"),
+        "client_name": data.get("client_name")
+    }
     
     if content_type == "image":
         # 图片数据
-        clipboard_store["content"] = ""
-        clipboard_store["file_name"] = None
-        clipboard_store["file_data"] = None
-        clipboard_store["file_size"] = 0
-        clipboard_store["image_data"] = data.get("image_data")
-        clipboard_store["image_width"] = data.get("image_width", 0)
-        clipboard_store["image_height"] = data.get("image_height", 0)
-        clipboard_store["image_size"] = data.get("image_size", 0)
-        print(f"↑ 收到[图片]: {clipboard_store['image_width']}x{clipboard_store['image_height']} ({clipboard_store['image_size']/1024:.1f}KB)")
+        item["image_width"] = data.get("image_width", 0)
+        item["image_height"] = data.get("image_height", 0)
+        item["image_size"] = blob_size
+        item["image_format"] = data.get("image_format") if data.get("image_format") in IMAGE_FORMATS else "png"
+        print(f"↑ 收到[图片]: {item['image_width']}x{item['image_height']} {item['image_format']} ({item['image_size']/1024:.1f}KB)")
     elif content_type == "file":
         # 文件数据
-        clipboard_store["content"] = ""
-        clipboard_store["file_name"] = data.get("file_name")
-        clipboard_store["file_data"] = data.get("file_data")
-        clipboard_store["file_size"] = data.get("file_size", 0)
-        clipboard_store["image_data"] = None
-        clipboard_store["image_width"] = 0
-        clipboard_store["image_height"] = 0
-        clipboard_store["image_size"] = 0
-        print(f"↑ 收到[文件]: {clipboard_store['file_name']} ({clipboard_store['file_size']/1024:.1f}KB)")
+        item["file_name"] = data.get("file_name")
+        item["file_size"] = blob_size
+        # 多个文件/文件夹打包为 tar 上传，接收端解包
+        item["archive"] = data.get("archive") if data.get("archive") in ARCHIVE_FORMATS else None
+        kind = "文件包" if item["archive"] else "文件"
+        print(f"↑ 收到[{kind}]: {item['file_name']} ({item['file_size']/1024:.1f}KB)")
     else:
         # 文本数据
-        clipboard_store["content"] = data.get("content", "")
-        clipboard_store["file_name"] = None
-        clipboard_store["file_data"] = None
-        clipboard_store["file_size"] = 0
-        clipboard_store["image_data"] = None
-        clipboard_store["image_width"] = 0
-        clipboard_store["image_height"] = 0
-        clipboard_store["image_size"] = 0
-        print(f"↑ 收到[文本]({len(clipboard_store['content'])}字): {clipboard_store['content'][:30]!r}")
-    
-    return {"status": "ok", "updated_at": clipboard_store["updated_at"]}
+        item["content"] = data.get("content", "")
+        if item["encrypted"]:
+            print(f"↑ 收到[加密文本]({len(item['content'])}字)")
+        else:
+            print(f"↑ 收到[文本]({len(item['content'])}字): {item['content'][:30]!r}")
+    
+    # 加入历史（引用数据，并淘汰超出容量的旧记录）
+    channel.set_store(channel.history.append(item))
+    payload_bytes.observe(ClipboardHistory.item_bytes(item), content_type=content_type)
+    
+    channel.notify_update()
+    channel.schedule_broadcast()
+    return {"status": "ok", "updated_at": item["updated_at"], "seq": item["seq"], "blob_id": blob_id}
+
+@app.post(f"{URL_PREFIX}/upload")
+async def upload_clipboard(request: Request):
+    """
+    JSON 上传：文本；或以 blob_sha256 引用服务端已有的文件/图片数据（秒传，不存在时返回 404，客户端改用流式上传）
+    文件/图片的 Base64 字段为兼容旧版客户端保留
+    """
+    channel = get_channel(request)
+    # 较大的 JSON（长文本等）客户端会压缩后上传
+    data = await read_json(request)
+    content_type = data.get("content_type", "text")
+    
+    blob_id, blob_size = None, 0
+    if content_type in ("image", "file"):
+        blob_sha256 = data.get("blob_sha256")
+        if blob_sha256:
+            # 只能引用本频道历史中已有的数据：知道其他频道数据的哈希不能获得其内容
+            if not channel_has_blob(channel, blob_sha256):
+                return JSONResponse({"status": "missing", "blob_sha256": blob_sha256}, status_code=404)
+            blob_id, blob_size = blob_sha256, blob_store.size(blob_sha256)
+            blob_store.touch(blob_id)
+        else:
+            legacy_key = "image_data" if content_type == "image" else "file_data"
+            try:
+                blob_id, blob_size = blob_store.put_bytes(base64.b64decode(data.pop(legacy_key, None) or ""))
+            except BlobTooLarge:
+                raise HTTPException(status_code=413, detail="文件超过服务端磁盘数据上限")
+    
+    return update_clipboard_store(channel, data, blob_id, blob_size)
+
+def channel_has_blob(channel, blob_sha256):
+    """频道历史中引用了该数据，且数据仍在磁盘上"""
+    return channel.history.has_blob(blob_sha256) and blob_store.has(blob_sha256)
+
+def header_text(request: Request, name, default=None):
+    """读取请求头（非 ASCII 内容由客户端进行 URL 编码）"""
+    value = request.headers.get(name)
+    return unquote(value) if value is not None else default
+
+def header_int(request: Request, name):
+    """读取非负整数请求头（缺省为 0），格式错误返回 400"""
+    value = request.headers.get(name, "0").strip()
+    if not value.isdigit():
+        raise HTTPException(status_code=400, detail=f"请求头 {name} 应为非负整数")
+    return int(value)
+
+@app.post(f"{URL_PREFIX}/upload/stream")
+async def upload_clipboard_stream(request: Request):
+    """
+    二进制流式上传文件/图片：请求体为原始字节，元数据放在请求头中
+    X-Content-Type: file | image
+    X-Device-Id / X-Client-Name / X-File-Name: URL 编码的文本
+    X-Archive: tar（可选），多个文件/文件夹打包后的数据
+    X-Image-Width / X-Image-Height: 原图尺寸（上传的图片可能已按客户端配置缩小）
+    X-Image-Format: png / webp / jpeg
+    X-Encrypted: 1（可选），数据和文件名已由客户端端到端加密
+    Content-Encoding: gzip / zstd（可选），数据按压缩形式保存，下载时原样发送
+    """
+    channel = get_channel(request)
+    content_type = header_text(request, "x-content-type", "file")
+    if content_type not in ("file", "image"):
+        raise HTTPException(status_code=400, detail="流式上传仅支持 file 或 image")
+    
+    data = {
+        "content_type": content_type,
+        "device_id": header_text(request, "x-device-id"),
+        "client_name": header_text(request, "x-client-name"),
+        "file_name": header_text(request, "x-file-name"),
+        "archive": request.headers.get("x-archive"),
+        "image_width": header_int(request, "x-image-width"),
+        "image_height": header_int(request, "x-image-height"),
+        "image_format": request.headers.get("x-image-format"),
+        "encrypted": request.headers.get("x-encrypted") == "1",
+    }
+    try:
+        blob_id, blob_size = await blob_store.put_stream(request.stream(), request_encoding(request))
+    except DECOMPRESS_ERRORS as e:
+        raise HTTPException(status_code=400, detail=f"压缩数据损坏: {e}")
+    except BlobTooLarge:
+        print(f"⚠️  上传内容超过磁盘数据上限，已拒绝: {data['file_name'] or content_type}")
+        raise HTTPException(status_code=413, detail="文件超过服务端磁盘数据上限")
+    except ClientDisconnect:
+        # 客户端中途取消（如有更新的剪贴板内容），不完整的数据已丢弃
+        print(f"⚠️  客户端中断上传: {data['file_name'] or content_type}")
+        return Response(status_code=400)
+    return update_clipboard_store(channel, data, blob_id, blob_size)
+
+@app.head(f"{URL_PREFIX}/blobs/{{blob_sha256}}")
+async def check_blob(blob_sha256: str, request: Request):
+    """检查本频道是否已有该 SHA-256 的数据（200 已有 / 404 没有）"""
+    if not channel_has_blob(get_channel(request), blob_sha256):
+        raise HTTPException(status_code=404)
+    return Response(headers={"X-Blob-Size": str(blob_store.size(blob_sha256))})
+
+# =======================
+# 分块上传（断点续传）
+# =======================
+SHA256_RE = re.compile(r"^[0-9a-f]{64}$")
+
+class ChunkedUpload:
+    """
+    分块上传会话：以文件内容的 SHA-256 作为 upload_id，连接中断后重新初始化即可从已确认的分块继续
+    每个分块单独校验 SHA-256 并写入临时文件的对应位置，全部收到后校验整体 SHA-256 再登记为数据
+    临时文件的大小在创建会话时即计入磁盘上限（blob_store.reserve），空间不足时抛出 BlobTooLarge
+    """
+    
+    def __init__(self, sha256, size, chunk_size):
+        blob_store.reserve(size)
+        self.sha256 = sha256
+        self.size = size
+        self.chunk_size = chunk_size
+        self.chunk_count = math.ceil(size / chunk_size)
+        self.received = set()
+        # .part 后缀的临时文件在服务端重启时会被清理；不同频道上传相同内容时各自使用独立的临时文件
+        self.path = os.path.join(DATA_DIR, f"{sha256}-{uuid.uuid4().hex}.upload.part")
+        with open(self.path, "wb") as f:
+            f.truncate(size)
+        self.last_active = time.monotonic()
+    
+    def chunk_length(self, index):
+        """第 index 个分块应有的字节数（最后一块可能不足 chunk_size）"""
+        return min(self.chunk_size, self.size - index * self.chunk_size)
+    
+    def write(self, index, data):
+        with open(self.path, "r+b") as f:
+            f.seek(index * self.chunk_size)
+            f.write(data)
+        self.received.add(index)
+        self.last_active = time.monotonic()
+    
+    @property
+    def complete(self):
+        return len(self.received) == self.chunk_count
+    
+    def summary(self):
+        return {
+            "upload_id": self.sha256,
+            "size": self.size,
+            "chunk_size": self.chunk_size,
+            "chunk_count": self.chunk_count,
+            "received": sorted(self.received)
+        }
+    
+    def discard(self):
+        remove_file(self.path)
+        blob_store.unreserve(self.size)
+
+chunked_uploads = {}  # (频道名, upload_id(sha256)) -> ChunkedUpload，会话按频道隔离
+
+def sweep_chunked_uploads():
+    """清理长时间没有新分块的上传会话"""
+    now = time.monotonic()
+    for key, upload in list(chunked_uploads.items()):
+        if now - upload.last_active > UPLOAD_EXPIRE_SECONDS:
+            upload.discard()
+            del chunked_uploads[key]
+
+def get_chunked_upload(channel, upload_id):
+    upload = chunked_uploads.get((channel.name, upload_id))
+    if upload is None:
+        raise HTTPException(status_code=404, detail="上传会话不存在或已过期，请重新初始化")
+    return upload
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+@app.post(f"{URL_PREFIX}/upload/chunked")
+async def init_chunked_upload(request: Request):
+    """
+    初始化（或恢复）分块上传：请求体 {"blob_sha256": 文件的 SHA-256, "size": 字节数}
+    返回分块大小和服务端已收到的分块序号，客户端只需上传缺少的分块；本频道已有该数据时所有分块视为已收到
+    """
+    channel = get_channel(request)
+    data = await read_json(request)
+    sha256 = str(data.get("blob_sha256", "")).lower()
+    size = data.get("size")
+    if not SHA256_RE.match(sha256) or not isinstance(size, int) or size < 0:
+        raise HTTPException(status_code=400, detail="需要 blob_sha256 和 size")
+    if size > BLOB_DISK_LIMIT:
+        raise HTTPException(status_code=413, detail="文件超过服务端磁盘数据上限")
+    sweep_chunked_uploads()
+    
+    if channel_has_blob(channel, sha256):
+        chunk_count = math.ceil(size / UPLOAD_CHUNK_SIZE)
+        return {"upload_id": sha256, "size": size, "chunk_size": UPLOAD_CHUNK_SIZE,
+                "chunk_count": chunk_count, "received": list(range(chunk_count))}
+    
+    upload = chunked_uploads.get((channel.name, sha256))
+    if upload is None or upload.size != size:
+        if upload is not None:
+            upload.discard()
+            del chunked_uploads[(channel.name, sha256)]
+        if sum(1 for name, _ in chunked_uploads if name == channel.name) >= MAX_CHUNKED_UPLOADS:
+            raise HTTPException(status_code=429, detail="本频道未完成的分块上传过多，请稍后重试")
+        try:
+            upload = chunked_uploads[(channel.name, sha256)] = ChunkedUpload(sha256, size, UPLOAD_CHUNK_SIZE)
+        except BlobTooLarge:
+            raise HTTPException(status_code=413, detail="服务端磁盘空间不足（已被当前数据和其他上传占用）")
+    elif upload.received:
+        print(f"⏯️  恢复分块上传: {sha256[:12]}（已收到 {len(upload.received)}/{upload.chunk_count} 块）")
+    upload.last_active = time.monotonic()
+    return upload.summary()
+
+@app.get(f"{URL_PREFIX}/upload/chunked/{{upload_id}}")
+async def chunked_upload_status(upload_id: str, request: Request):
+    """查询分块上传进度（格式同初始化）"""
+    return get_chunked_upload(get_channel(request), upload_id).summary()
+
+@app.put(f"{URL_PREFIX}/upload/chunked/{{upload_id}}/{{index}}")
+async def put_upload_chunk(upload_id: str, index: int, request: Request):
+    """
+    上传第 index 个分块：请求体为分块原始字节（可按 Content-Encoding 压缩）
+    X-Chunk-Sha256: 分块原始字节的 SHA-256，校验失败返回 400，客户端重传该分块即可
+    """
+    upload = get_chunked_upload(get_channel(request), upload_id)
+    if not 0 <= index < upload.chunk_count:
+        raise HTTPException(status_code=400, detail="分块序号超出范围")
+    # 压缩前后都不会超过分块大小（客户端只在压缩后更小时才压缩），超出时停止接收
+    chunk_length = upload.chunk_length(index)
+    body = await read_body(request, chunk_length)
+    encoding = request_encoding(request)
+    if encoding:
+        body = decompress_bytes(body, encoding, chunk_length)
+    if len(body) != chunk_length:
+        raise HTTPException(status_code=400, detail="分块大小不正确")
+    if hashlib.sha256(body).hexdigest() != request.headers.get("x-chunk-sha256", "").lower():
+        raise HTTPException(status_code=400, detail="分块校验失败")
+    upload.write(index, body)
+    return {"index": index, "received": len(upload.received), "chunk_count": upload.chunk_count}
+
+@app.post(f"{URL_PREFIX}/upload/chunked/{{upload_id}}/commit")
+async def commit_chunked_upload(upload_id: str, request: Request):
+    """
+    完成分块上传：校验整体 SHA-256 后登记数据，并以请求体中的元数据（格式同 /upload）更新剪贴板
+    仍有缺少的分块时返回 409 和已收到的分块序号
+    """
+    channel = get_channel(request)
+    data = await read_json(request)
+    if data.get("content_type") not in ("file", "image"):
+        raise HTTPException(status_code=400, detail="分块上传仅支持 file 或 image")
+    
+    if not channel_has_blob(channel, upload_id):
+        # 其他频道已有相同数据时同样需要完整上传并校验（证明持有内容）
+        upload = get_chunked_upload(channel, upload_id)
+        if not upload.complete:
+            return JSONResponse({"status": "incomplete", **upload.summary()}, status_code=409)
+        # 先移出会话，避免重复提交时并发校验同一个文件
+        del chunked_uploads[(channel.name, upload_id)]
+        if await asyncio.to_thread(file_sha256, upload.path) != upload.sha256:
+            upload.discard()
+            raise HTTPException(status_code=400, detail="文件校验失败，请重新上传")
+        blob_store.unreserve(upload.size)
+        blob_store.put_file(upload.path, upload.sha256, upload.size)
+    
+    blob_store.touch(upload_id)
+    return update_clipboard_store(channel, data, upload_id, blob_store.size(upload_id))
+
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+def parse_range(header, size):
+    """
+    解析 Range 请求头中的单个字节范围（bytes=start-end / bytes=start- / bytes=-suffix），返回 (start, end)（包含 end）
+    没有 Range 或格式不支持（如多个范围）时返回 None，按完整内容响应；范围超出内容时返回 416
+    """
+    match = RANGE_RE.match(header.strip()) if header else None
+    if not match or match.groups() == ("", ""):
+        return None
+    first, last = match.groups()
+    if first:
+        start, end = int(first), min(int(last), size - 1) if last else size - 1
+        if last and int(last) < start:
+            return None
+    else:
+        start, end = max(0, size - int(last)), size - 1
+    if start >= size or end < start:
+        raise HTTPException(status_code=416, headers={"Content-Range": f"bytes */{size}"})
+    return start, end
+
+def iter_range(chunks, start, end):
+    """从数据流中截取 [start, end] 字节（之前的内容读取后丢弃）"""
+    position = 0
+    for chunk in chunks:
+        if position + len(chunk) > start:
+            piece = chunk[max(0, start - position):end + 1 - position]
+            if piece:
+                yield piece
+        position += len(chunk)
+        if position > end:
+            break
+
+@app.get(f"{URL_PREFIX}/download/{{blob_id}}")
+async def download_blob(blob_id: str, request: Request):
+    """
+    下载文件/图片的原始数据（热数据从内存返回，其余从磁盘分块流式返回），仅限本频道历史中的数据
+    支持单个 Range（返回 206），压缩保存的数据按发送的字节计算范围
+    """
+    channel = get_channel(request)
+    if not channel.history.has_blob(blob_id) or not blob_store.has(blob_id):
+        raise HTTPException(status_code=404, detail="内容不存在或已过期")
+    # 压缩保存的数据直接发送给支持该编码的客户端；不支持时流式解压
+    info = blob_store.info(blob_id)
+    headers = {"Vary": "Accept-Encoding"}
+    if info.encoding and accepted_encoding(request, (info.encoding,)) is None:
+        headers["Accept-Ranges"] = "bytes"
+        chunks = blob_store.iter_decoded(blob_id)
+        byte_range = parse_range(request.headers.get("range"), info.size)
+        if byte_range is None:
+            headers["Content-Length"] = str(info.size)
+            return StreamingResponse(chunks, media_type="application/octet-stream", headers=headers)
+        start, end = byte_range
+        headers["Content-Length"] = str(end - start + 1)
+        headers["Content-Range"] = f"bytes {start}-{end}/{info.size}"
+        return StreamingResponse(iter_range(chunks, start, end), status_code=206,
+                                 media_type="application/octet-stream", headers=headers)
+    if info.encoding:
+        headers["Content-Encoding"] = info.encoding
+    data = blob_store.read(blob_id)
+    if data is not None:
+        headers["Accept-Ranges"] = "bytes"
+        byte_range = parse_range(request.headers.get("range"), len(data))
+        if byte_range is None:
+            return Response(data, media_type="application/octet-stream", headers=headers)
+        start, end = byte_range
+        headers["Content-Range"] = f"bytes {start}-{end}/{len(data)}"
+        return Response(data[start:end + 1], status_code=206, media_type="application/octet-stream", headers=headers)
+    return FileResponse(blob_store.path(blob_id), media_type="application/octet-stream", headers=headers)
+
+def encoded_json_response(channel, request: Request):
+    """返回频道当前内容的 JSON，较大时按客户端支持的编码压缩（使用缓存的字节）"""
+    encoding = None
+    if len(channel.encoded_store()) >= COMPRESS_MIN_BYTES:
+        encoding = accepted_encoding(request)
+    headers = {"Vary": "Accept-Encoding", "ETag": channel.etag(encoding)}
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return Response(channel.encoded_store(encoding), media_type="application/json", headers=headers)
 
 @app.get(f"{URL_PREFIX}/fetch")
-async def fetch_clipboard(last_sync_time: str = None):
+async def fetch_clipboard(request: Request, last_sync_time: str = None, wait: float = 0):
     """
     拉取剪贴板内容
-    :param last_sync_time: 客户端最后同步时间，如果服务端没有更新则不返回数据
+    If-None-Match: 客户端上次收到的 ETag，内容没有变化时返回 304（无响应体）
+    无更新时通过 X-Poll-Interval 响应头（304）或 poll_interval 字段（no_update）下发建议的最短轮询间隔
+    :param last_sync_time: 客户端最后同步时间，如果服务端没有更新则不返回数据（兼容旧版客户端）
+    :param wait: 长轮询等待秒数，>0 时无更新则挂起请求直到有新内容或超时
     """
+    channel = get_channel(request)
+    if_none_match = request.headers.get("if-none-match")
+    
+    # 长轮询：内容没有更新时挂起，直到上传触发更新事件或超时
+    if wait > 0 and (channel.matches_etag(if_none_match) or channel.is_up_to_date(last_sync_time)):
+        await channel.wait_for_update(min(wait, LONG_POLL_MAX_SECONDS))
+    
+    if channel.matches_etag(if_none_match):
+        fetch_results.inc(result="not_modified")
+        headers = {"ETag": channel.etag(), "Vary": "Accept-Encoding"}
+        if POLL_INTERVAL_HINT > 0:
+            headers["X-Poll-Interval"] = f"{POLL_INTERVAL_HINT:g}"
+        return Response(status_code=304, headers=headers)
+    
     # 如果客户端提供了last_sync_time，且服务端内容没有更新，则返回no_update状态
-    if last_sync_time and clipboard_store.get("updated_at"):
-        if clipboard_store["updated_at"] <= last_sync_time:
-            return {
-                "status": "no_update",
-                "updated_at": clipboard_store["updated_at"]
-            }
+    if channel.is_up_to_date(last_sync_time):
+        fetch_results.inc(result="no_update")
+        result = {
+            "status": "no_update",
+            "updated_at": channel.store["updated_at"],
+            "long_poll": wait > 0
+        }
+        if POLL_INTERVAL_HINT > 0:
+            result["poll_interval"] = POLL_INTERVAL_HINT
+        return result
     
-    # 有更新或首次请求，返回完整数据
-    return clipboard_store
+    # 有更新或首次请求，返回完整数据（每个版本只序列化、压缩一次）
+    fetch_results.inc(result="full")
+    return encoded_json_response(channel, request)
+
+@app.get(f"{URL_PREFIX}/history")
+async def clipboard_history(request: Request, since: int = 0, limit: int = 50):
+    """
+    拉取历史记录元数据（文本只含预览，正文和文件/图片数据按需获取）
+    :param since: 游标，只返回 seq 大于该值的记录；传入上次响应的 cursor 即可增量获取
+    :param limit: 最多返回最新的多少条
+    """
+    history = get_channel(request).history
+    items = history.since(since, max(0, limit))
+    return {
+        "cursor": history.latest_seq,
+        # 游标之后的记录已有部分被淘汰（客户端离线太久）
+        "truncated": since + 1 < history.oldest_seq,
+        "items": [item_summary(item) for item in items]
+    }
+
+@app.get(f"{URL_PREFIX}/history/{{seq}}")
+async def clipboard_history_item(seq: int, request: Request):
+    """获取一条历史记录的完整内容（格式同 /fetch）"""
+    item = get_channel(request).history.get(seq)
+    if item is None:
+        raise HTTPException(status_code=404, detail="历史记录不存在或已被淘汰")
+    return item
+
+@app.websocket(f"{URL_PREFIX}/ws")
+async def clipboard_ws(websocket: WebSocket, last_sync_time: str = None):
+    """
+    推送通道：频道内每次上传后服务端主动推送完整内容（格式同 /fetch）
+    :param last_sync_time: 客户端最后同步时间，连接建立时若有更新会立即补发
+    """
+    try:
+        channel = get_channel(websocket)
+    except HTTPException:
+        await websocket.close(code=1008)
+        return
+    await websocket.accept()
+    channel.ws_clients.add(websocket)
+    print(f"🔔 推送客户端已连接 [{channel.name}]（在线 {len(channel.ws_clients)}）")
+    try:
+        if channel.store.get("updated_at") and not channel.is_up_to_date(last_sync_time):
+            await websocket.send_text(json.dumps(channel.store))
+        # 客户端无需发送消息，这里仅用于感知断开
+        while True:
+            await websocket.receive_text()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        channel.ws_clients.discard(websocket)
+        channel.touch()
+        print(f"🔕 推送客户端已断开 [{channel.name}]（在线 {len(channel.ws_clients)}）")
 
 @app.get(f"{URL_PREFIX}/status")
 async def status():
-    return {"running": True}
+    return {
+        "running": True,
+        "encodings": list(SUPPORTED_ENCODINGS),
+        "channels": len(channels),
+        "push_clients": sum(len(channel.ws_clients) for channel in channels.values())
+    }
+
+MetricGauge("syncclipboard_channels", "当前频道数", lambda: len(channels))
+MetricGauge("syncclipboard_push_clients", "在线的 WebSocket 推送客户端数",
+            lambda: sum(len(channel.ws_clients) for channel in channels.values()))
+MetricGauge("syncclipboard_long_poll_waiters", "挂起中的长轮询请求数",
+            lambda: sum(channel.waiters for channel in channels.values()))
+MetricGauge("syncclipboard_history_text_bytes", "历史记录中保存在内存的文本字节数",
+            lambda: sum(channel.history.text_bytes for channel in channels.values()))
+MetricGauge("syncclipboard_history_bytes", "历史记录引用的内容总字节数（含磁盘上的文件/图片）",
+            lambda: sum(channel.history.total_bytes for channel in channels.values()))
+MetricGauge("syncclipboard_blob_cache_bytes", "内存热数据缓存字节数", lambda: blob_store.cache_bytes)
+MetricGauge("syncclipboard_blob_disk_bytes", "磁盘数据字节数", lambda: blob_store.disk_bytes)
+MetricGauge("syncclipboard_chunked_uploads", "未完成的分块上传数", lambda: len(chunked_uploads))
+MetricGauge("syncclipboard_chunked_upload_bytes", "未完成的分块上传预留的磁盘字节数", lambda: blob_store.reserved_bytes)
+
+@app.get(f"{URL_PREFIX}/metrics")
+async def metrics():
+    """Prometheus 格式的监控指标"""
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return PlainTextResponse("\n".join(lines) + "\n", media_type="text/plain; version=0.0.4")
 
 def start_server():
     uvicorn.run(app, host=HOST, port=PORT, access_log=False)
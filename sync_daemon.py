@@ -0,0 +1,74 @@
+"""
+SyncClipboard 无界面守护进程：不依赖 PyQt5，可在服务器、容器或没有桌面的环境中运行
+剪贴板后端：
+- text: 系统剪贴板（pyperclip，只同步文本，需要 xclip/xsel/wl-clipboard 等剪贴板程序）
+- memory: 进程内剪贴板，只接收并记录其他设备的内容（文件下载到临时目录）
+- auto: 系统剪贴板可用时使用 text，否则使用 memory
+"""
+import argparse
+import signal
+import sys
+import threading
+
+from sync_engine import ClientConfig, MemoryClipboard, SyncEngine, TextClipboard, get_config_path
+
+def create_clipboard(kind):
+    """按命令行参数创建剪贴板后端"""
+    if kind in ("auto", "text"):
+        try:
+            return TextClipboard()
+        except Exception as e:
+            if kind == "text":
+                raise
+            print(f"⚠️  系统剪贴板不可用（{e}），使用内存剪贴板（只接收）")
+    return MemoryClipboard()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="SyncClipboard 无界面同步守护进程")
+    parser.add_argument("--config", default=None, help="配置文件路径（默认按托盘客户端相同的规则查找 config.ini）")
+    parser.add_argument("--clipboard", choices=("auto", "text", "memory"), default="auto", help="剪贴板后端")
+    parser.add_argument("--no-upload", action="store_true", help="不上传本机剪贴板")
+    parser.add_argument("--no-download", action="store_true", help="不接收其他设备的内容")
+    args = parser.parse_args(argv)
+    
+    config_file_path = args.config or get_config_path()
+    config = ClientConfig(config_file_path)
+    print(f"📝 配置文件路径: {config_file_path}")
+    
+    clipboard = create_clipboard(args.clipboard)
+    try:
+        engine = SyncEngine(config, clipboard)
+    except RuntimeError as e:
+        print(f"❌ {e}")
+        return 1
+    engine.state.allow_upload = not args.no_upload and not isinstance(clipboard, MemoryClipboard)
+    engine.state.allow_download = not args.no_download
+    
+    stop_event = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda signum, frame: stop_event.set())
+    
+    engine.start()
+    
+    # 诊断信息
+    print(f"🧩 {config.app_name} v{config.app_version} 已启动（无界面模式）")
+    print(f"🏷️  客户端名称: {config.client_name}")
+    print(f"📱 设备ID: {config.device_id}")
+    print(f"🔗 服务端地址: {config.server_url}")
+    print(f"📺 频道: {config.channel}")
+    print(f"🔁 拉取模式: {config.sync_mode_text()}")
+    print(f"📋 剪贴板: {'内存（只接收）' if isinstance(clipboard, MemoryClipboard) else '系统剪贴板（文本）'}")
+    print(f"📤 上传: {'已启用' if engine.state.allow_upload else '已禁用'} | 📥 下载: {'已启用' if engine.state.allow_download else '已禁用'}")
+    if config.encryption_key:
+        print(f"🔐 端到端加密: 已启用（服务端只保存密文）")
+    print(f"💡 提示: 使用 Ctrl+C 退出")
+    
+    while not stop_event.wait(1):
+        pass
+    
+    print("👋 正在退出...")
+    engine.stop()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,2251 @@
+"""
+SyncClipboard 同步引擎（不依赖 PyQt5）
+剪贴板读写和提示通过可替换的后端完成：托盘客户端使用 Qt 剪贴板与托盘通知，
+无界面守护进程使用 pyperclip 或内存剪贴板，测试和基准测试可直接驱动内存剪贴板
+网络部分运行在一个 asyncio 事件循环中（托盘客户端为与 Qt 集成的事件循环，见 qasync），
+拉取、上传、推送和重试并发进行，停止时取消即可立即结束
+"""
+import asyncio
+import base64
+import configparser
+import gzip
+import hashlib
+import hmac
+import importlib.util
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import stat
+import struct
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+import uuid
+import zlib
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import quote, urlencode
+
+class LazyModule:
+    """
+    首次访问属性时才导入的模块：导入开销较大的依赖推迟到引擎启动时（在线程中导入，不阻塞事件循环）
+    loader 是包含普通 import 语句的函数（打包工具 Nuitka 能识别函数内的 import 并打包该模块，无法识别按名称动态导入）
+    """
+    
+    def __init__(self, name, loader, optional=False):
+        self._name = name
+        self._loader = loader
+        self._optional = optional
+        self._module = None
+        self._missing = False
+    
+    def _load(self):
+        if self._module is None and not self._missing:
+            try:
+                self._module = self._loader()
+            except ImportError:
+                if not self._optional:
+                    raise
+                self._missing = True
+        return self._module
+    
+    def __bool__(self):
+        """可选依赖是否可用（未安装时为 False）"""
+        return self._load() is not None
+    
+    def __getattr__(self, attr):
+        module = self._load()
+        if module is None:
+            raise ImportError(f"未安装 {self._name}")
+        return getattr(module, attr)
+
+def _import_httpx():
+    import httpx
+    return httpx
+
+def _import_zstandard():
+    import zstandard
+    return zstandard
+
+httpx = LazyModule("httpx", _import_httpx)  # 导入约占客户端启动耗时的一半
+zstandard = LazyModule("zstandard", _import_zstandard, optional=True)  # 可选依赖：安装后与服务端协商使用 zstd 压缩
+
+SYNC_PROTECTION_SECONDS = 2  # 同步保护时间（秒）
+TRANSFER_RETRIES = 5  # 大文件上传/下载中断后的最大重试次数
+PROGRESS_MIN_BYTES = 1024 * 1024  # 超过该大小的文件上传时显示进度
+
+# =======================
+# 读取配置文件
+# =======================
+def get_config_path():
+    """获取配置文件路径（兼容打包后的应用）"""
+    # 优先级1: 可执行文件所在目录（打包后）
+    if getattr(sys, 'frozen', False):
+        # Nuitka 打包后
+        exe_dir = os.path.dirname(sys.executable)
+        config_path = os.path.join(exe_dir, "config.ini")
+        if os.path.exists(config_path):
+            return config_path
+    
+    # 优先级2: 当前工作目录
+    if os.path.exists("config.ini"):
+        return "config.ini"
+    
+    # 优先级3: 脚本所在目录
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    config_path = os.path.join(script_dir, "config.ini")
+    if os.path.exists(config_path):
+        return config_path
+    
+    # 未找到配置文件，返回默认路径
+    return "config.ini"
+
+class ClientConfig:
+    """客户端配置：从 config.ini 读取，缺少的配置项使用默认值（不传路径时全部为默认值，可直接修改属性）"""
+    
+    def __init__(self, path=None):
+        config = configparser.ConfigParser()
+        if path:
+            config.read(path, encoding="utf-8")
+        self.path = path
+        
+        # 全局配置
+        self.app_name = config.get("global", "app_name", fallback="SyncClipboard")
+        self.app_version = config.get("global", "app_version", fallback="1.0.0")
+        self.app_icon = config.get("global", "app_icon", fallback="")
+        
+        # 客户端配置
+        self.client_name = config.get("client", "client_name", fallback=platform.node()).strip('"\'')
+        url_prefix = config.get("server", "url_prefix", fallback="")
+        self.server_url = f"{config.get('client', 'server_url', fallback='http://127.0.0.1:8000')}{url_prefix}"
+        # 频道名：同一频道的客户端共享剪贴板，不同频道互不影响
+        self.channel = config.get("client", "channel", fallback="default").strip() or "default"
+        self.sync_interval = config.getfloat("client", "sync_interval", fallback=1.0)
+        # 空闲时轮询间隔上限（秒）：持续无更新时从 sync_interval 逐步加倍到该值，有活动后恢复
+        self.sync_interval_max = max(config.getfloat("client", "sync_interval_max", fallback=15), self.sync_interval)
+        # 长轮询等待时间（秒），0 表示关闭长轮询，按 sync_interval 定时拉取
+        self.long_poll_timeout = config.getfloat("client", "long_poll_timeout", fallback=0)
+        # 是否启用 WebSocket 推送通道（连接成功后暂停 HTTP 轮询，断线自动回退）
+        self.enable_push = config.getboolean("client", "enable_push", fallback=True)
+        # 剪贴板变化检测方式：event 监听系统剪贴板通知，poll 每0.5秒轮询，auto 在通知不可靠的平台（macOS、Wayland）使用轮询
+        self.clipboard_watch = config.get("client", "clipboard_watch", fallback="auto").strip().lower()
+        self.enable_sound = config.getboolean("client", "enable_sound", fallback=True)
+        self.enable_popup = config.getboolean("client", "enable_popup", fallback=True)
+        
+        # 文件同步配置：None 不同步文件，0 无限制，其他为字节数
+        max_file_size_str = config.get("client", "max_file_size", fallback="false").strip().lower()
+        if max_file_size_str == "false":
+            self.max_file_size = None
+        elif max_file_size_str == "0":
+            self.max_file_size = 0
+        else:
+            try:
+                self.max_file_size = float(max_file_size_str) * 1024 * 1024
+            except ValueError:
+                self.max_file_size = None
+                print(f"⚠️  配置项 max_file_size 格式错误: {max_file_size_str}，将不同步文件")
+        
+        # 图片上传格式：png（无损）/ webp / jpeg，有损格式的质量（1-100），以及最长边上限（像素，0 表示不缩小）
+        self.image_format = config.get("client", "image_format", fallback="png").strip().lower()
+        self.image_quality = config.getint("client", "image_quality", fallback=85)
+        self.image_max_dimension = config.getint("client", "image_max_dimension", fallback=0)
+        if self.image_format not in ("png", "webp", "jpeg"):
+            print(f"⚠️  配置项 image_format 格式错误: {self.image_format}，将使用 png")
+            self.image_format = "png"
+        
+        # 超过该大小的文件使用分块上传（断点续传）
+        self.chunked_upload_size = config.getfloat("client", "chunked_upload_mb", fallback=8) * 1024 * 1024
+        # 延迟下载：收到图片/文件时只把元数据放入剪贴板，真正粘贴时才从服务端下载
+        self.lazy_download = config.getboolean("client", "lazy_download", fallback=False)
+        # 端到端加密口令：为空时不加密（口令只保存在客户端，不会发送给服务端）
+        self.encryption_key = config.get("client", "encryption_key", fallback="").strip()
+        
+        self.device_id = f"{platform.node()}-{uuid.uuid4().hex[:6]}"
+    
+    def sync_mode_text(self):
+        """当前拉取模式的描述文字"""
+        if self.long_poll_timeout > 0:
+            mode = f"长轮询 {self.long_poll_timeout:g}s"
+        elif self.sync_interval_max > self.sync_interval:
+            mode = f"同步间隔 {self.sync_interval:g}-{self.sync_interval_max:g}s（空闲时逐步放慢）"
+        else:
+            mode = f"同步间隔 {self.sync_interval}s"
+        if self.enable_push:
+            return f"WebSocket 推送，回退{mode}"
+        return mode
+    
+    def file_sync_text(self):
+        """文件同步配置的描述文字"""
+        if self.max_file_size is None:
+            return "已禁用"
+        if self.max_file_size == 0:
+            return "已启用（无大小限制）"
+        return f"已启用（限制 {self.max_file_size/(1024*1024):.1f}MB）"
+
+# =======================
+# 辅助函数
+# =======================
+def get_timestamp():
+    """获取当前时间戳字符串（精确到毫秒）"""
+    return datetime.now().strftime("%H:%M:%S.%f")[:-3]
+
+def retry_delay(attempt):
+    """第 attempt 次重试前的等待秒数（指数退避）"""
+    return min(2 ** attempt, 30)
+
+# =======================
+# 文件处理辅助函数
+# =======================
+def file_sha256(file_path, chunk_size=1024 * 1024):
+    """分块计算文件的SHA-256（不整体读入内存）"""
+    with open(file_path, 'rb') as f:
+        return stream_sha256(f, chunk_size)
+
+def stream_sha256(f, chunk_size=1024 * 1024):
+    """分块计算文件对象（从当前位置到末尾）的SHA-256"""
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: f.read(chunk_size), b''):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+def unique_file_path(file_name, target_dir=None):
+    """目标目录下不重名的文件路径（重名时自动添加序号）"""
+    if target_dir is None:
+        target_dir = tempfile.gettempdir()
+    
+    file_path = os.path.join(target_dir, file_name)
+    
+    # 如果文件已存在，添加序号
+    if os.path.exists(file_path):
+        name, ext = os.path.splitext(file_name)
+        counter = 1
+        while os.path.exists(file_path):
+            file_path = os.path.join(target_dir, f"{name}_{counter}{ext}")
+            counter += 1
+    
+    return file_path
+
+def base64_to_file_stream(base64_data, f, chunk_size=4 * 1024 * 1024):
+    """将Base64数据分段解码写入文件（chunk_size 为4的倍数，不一次性解码整个内容）"""
+    for i in range(0, len(base64_data), chunk_size):
+        f.write(base64.b64decode(base64_data[i:i + chunk_size]))
+
+def base64_to_file(base64_data, file_path):
+    """将Base64数据分段解码写入新文件"""
+    with open(file_path, 'wb') as f:
+        base64_to_file_stream(base64_data, f)
+
+def read_file_bytes(file_path):
+    """读取整个文件"""
+    with open(file_path, 'rb') as f:
+        return f.read()
+
+def remove_file(file_path):
+    """删除文件，失败则忽略"""
+    try:
+        os.remove(file_path)
+    except OSError:
+        pass
+
+# =======================
+# 压缩辅助函数
+# =======================
+COMPRESS_MIN_BYTES = 1024  # 小于该大小的数据不压缩
+# 本身已是压缩格式的文件，不再重复压缩
+COMPRESSED_EXTENSIONS = {
+    ".zip", ".gz", ".tgz", ".bz2", ".xz", ".zst", ".7z", ".rar", ".jar", ".apk", ".dmg",
+    ".png", ".jpg", ".jpeg", ".gif", ".webp", ".heic", ".mp3", ".aac", ".m4a", ".ogg", ".flac",
+    ".mp4", ".mov", ".mkv", ".avi", ".webm", ".docx", ".xlsx", ".pptx", ".odt", ".epub", ".woff2",
+}
+
+def compress_bytes(data, encoding):
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    return gzip.compress(data, compresslevel=6)
+
+def make_compressor(encoding):
+    """创建流式压缩器（gzip / zstd）"""
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=3).compressobj()
+    return zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+def is_compressible_file(file_path, sample_size=64 * 1024):
+    """根据扩展名和开头一段数据的压缩率，判断文件是否值得压缩"""
+    if os.path.splitext(file_path)[1].lower() in COMPRESSED_EXTENSIONS:
+        return False
+    with open(file_path, 'rb') as f:
+        sample = f.read(sample_size)
+    if len(sample) < COMPRESS_MIN_BYTES:
+        return False
+    return len(zlib.compress(sample, 1)) < len(sample) * 0.9
+
+def iter_compressed(chunks, encoding):
+    """对数据块流进行流式压缩"""
+    compressor = make_compressor(encoding)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+def iter_file(file_path, chunk_size=256 * 1024, progress=None):
+    """分块读取文件（不整体读入内存），progress 回调已读取的字节数"""
+    done = 0
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            yield chunk
+            done += len(chunk)
+            if progress:
+                progress(done)
+
+def iter_compressed_file(file_path, encoding, chunk_size=256 * 1024, progress=None):
+    """分块读取文件并流式压缩（不整体读入内存），progress 回调已读取的原始字节数"""
+    return iter_compressed(iter_file(file_path, chunk_size, progress), encoding)
+
+class ProgressFile:
+    """
+    上传用的文件包装：按块迭代发送（见 iter_in_thread），内存占用与文件大小无关
+    len() 为请求体大小（用于 Content-Length），每次读取后回调已发送的字节数
+    """
+    CHUNK_SIZE = 256 * 1024
+    
+    def __init__(self, f, total, progress):
+        self.f = f
+        self.total = total
+        self.progress = progress
+        self.done = 0
+    
+    def __len__(self):
+        return self.total
+    
+    def read(self, size=-1):
+        chunk = self.f.read(size)
+        self.done += len(chunk)
+        self.progress(self.done)
+        return chunk
+    
+    def __iter__(self):
+        return iter(lambda: self.read(self.CHUNK_SIZE), b"")
+
+# =======================
+# 多文件/文件夹打包
+# =======================
+ARCHIVE_FORMAT = "tar"
+
+class ArchiveTooLarge(Exception):
+    """打包内容超过 max_file_size"""
+
+def collect_archive_entries(paths, max_size=0):
+    """
+    遍历要打包的文件和文件夹，返回 ([(路径, 包内名称, 字节数)], 总字节数)，文件夹的字节数为 None
+    边遍历边累计大小，超过 max_size（>0 时）立即停止并抛出 ArchiveTooLarge；符号链接和无法读取的文件被跳过
+    """
+    entries = []
+    total = 0
+    
+    def add(path, arcname):
+        nonlocal total
+        if os.path.islink(path) or not os.access(path, os.R_OK):
+            print(f"⚠️  跳过符号链接或无法读取的文件: {path}")
+            return
+        if os.path.isdir(path):
+            entries.append((path, arcname, None))
+            return
+        size = os.path.getsize(path)
+        total += size
+        if max_size and total > max_size:
+            raise ArchiveTooLarge(total)
+        entries.append((path, arcname, size))
+    
+    for top in paths:
+        top = os.path.abspath(top)
+        base = os.path.dirname(top)
+        add(top, os.path.basename(top))
+        if os.path.isdir(top) and not os.path.islink(top):
+            for root, dirs, files in os.walk(top):
+                dirs.sort()
+                for name in dirs + sorted(files):
+                    path = os.path.join(root, name)
+                    add(path, os.path.relpath(path, base).replace(os.sep, "/"))
+    return entries, total
+
+def iter_tar_stream(entries, chunk_size=256 * 1024, progress=None):
+    """
+    边读文件边生成 tar 数据流（不在磁盘上生成临时归档），progress 回调已读取的文件字节数
+    每个文件只写入遍历时记录的字节数，打包期间文件变化也不会超出已检查过的大小
+    """
+    done = 0
+    for path, arcname, size in entries:
+        st = os.stat(path)
+        info = tarfile.TarInfo(arcname)
+        info.mtime = int(st.st_mtime)
+        info.mode = stat.S_IMODE(st.st_mode)
+        if size is None:
+            info.type = tarfile.DIRTYPE
+            yield info.tobuf()
+            continue
+        info.size = size
+        yield info.tobuf()
+        remaining = size
+        with open(path, 'rb') as f:
+            while remaining > 0:
+                chunk = f.read(min(chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                done += len(chunk)
+                yield chunk
+                if progress:
+                    progress(done)
+        # 文件在打包期间变小时用 0 补齐，保证归档结构完整
+        while remaining > 0:
+            pad = min(chunk_size, remaining)
+            remaining -= pad
+            yield b"\0" * pad
+        yield b"\0" * (-size % tarfile.BLOCKSIZE)
+    # 归档结束标记：两个空块
+    yield b"\0" * (tarfile.BLOCKSIZE * 2)
+
+def archive_name(paths):
+    """打包后的显示名称"""
+    first = os.path.basename(os.path.abspath(paths[0]))
+    return f"{first}.tar" if len(paths) == 1 else f"{first}等{len(paths)}项.tar"
+
+def extract_archive(archive_path, target_dir):
+    """
+    顺序读取并解包 tar 文件（流式模式，不随机访问、不整体读入内存），返回顶层文件/文件夹的路径
+    只解出普通文件和文件夹，拒绝绝对路径和指向目标目录之外的条目
+    """
+    target_dir = os.path.abspath(target_dir)
+    top_level = []
+    with tarfile.open(archive_path, "r|") as tar:
+        for member in tar:
+            path = os.path.abspath(os.path.join(target_dir, member.name))
+            if os.path.isabs(member.name) or os.path.commonpath([target_dir, path]) != target_dir or path == target_dir:
+                print(f"⚠️  跳过不安全的路径: {member.name}")
+                continue
+            if member.isdir():
+                os.makedirs(path, exist_ok=True)
+            elif member.isfile():
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with tar.extractfile(member) as src, open(path, 'wb') as dst:
+                    shutil.copyfileobj(src, dst, 1024 * 1024)
+                os.utime(path, (member.mtime, member.mtime))
+            else:
+                continue
+            top = os.path.join(target_dir, os.path.relpath(path, target_dir).split(os.sep)[0])
+            if top not in top_level:
+                top_level.append(top)
+    return top_level
+
+def remove_download(path):
+    """删除下载的文件或解包出的文件夹"""
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        os.remove(path)
+
+def blob_part_path(blob_id):
+    """下载中的临时文件路径（按 blob_id 命名，中断后重新下载同一内容时可续传）"""
+    return os.path.join(tempfile.gettempdir(), f"syncclipboard_{blob_id}.part")
+
+
+# =======================
+# 端到端加密
+# =======================
+# 密文格式：魔数(4) + 盐(16) + 若干分块；每块为 AES-256-GCM 加密的最多 64KB 明文 + 16 字节认证标签
+# 每份内容使用由共享密钥和盐派生的独立密钥，分块 nonce 为 (序号, 是否最后一块)，分块被截断、重排或篡改都会解密失败
+ENCRYPTION_MAGIC = b"SCE1"
+ENCRYPTION_SALT_SIZE = 16
+ENCRYPTION_HEADER_SIZE = len(ENCRYPTION_MAGIC) + ENCRYPTION_SALT_SIZE
+ENCRYPTION_CHUNK_SIZE = 64 * 1024
+ENCRYPTION_TAG_SIZE = 16
+
+class DecryptionError(Exception):
+    """内容无法解密（未配置密钥、密钥不一致或数据被篡改）"""
+
+class ChunkCipher:
+    """一份内容（一个盐）的分块加解密"""
+    
+    def __init__(self, aead, header):
+        self.aead = aead
+        self.header = header
+    
+    def seal(self, index, chunk, final):
+        return self.aead.encrypt(struct.pack(">QI", index, final), chunk, self.header)
+    
+    def open(self, index, chunk, final):
+        try:
+            return self.aead.decrypt(struct.pack(">QI", index, final), chunk, self.header)
+        except Exception:
+            raise DecryptionError("内容校验失败（密钥不一致或数据已损坏）")
+
+class StreamEncryptor:
+    """流式加密：update 接收任意大小的明文，返回可以立即发送的密文，内存中最多保留一个分块"""
+    
+    def __init__(self, chunk_cipher):
+        self.chunk_cipher = chunk_cipher
+        self.buffer = b""
+        self.index = 0
+        self.header_sent = False
+    
+    def _start(self):
+        if self.header_sent:
+            return []
+        self.header_sent = True
+        return [self.chunk_cipher.header]
+    
+    def update(self, data):
+        out = self._start()
+        buffer = self.buffer + data if self.buffer else bytes(data)
+        offset = 0
+        # 保留至少一个字节到下一次，最后一块在 finalize 时加上结束标记
+        while len(buffer) - offset > ENCRYPTION_CHUNK_SIZE:
+            out.append(self.chunk_cipher.seal(self.index, buffer[offset:offset + ENCRYPTION_CHUNK_SIZE], False))
+            self.index += 1
+            offset += ENCRYPTION_CHUNK_SIZE
+        self.buffer = buffer[offset:]
+        return b"".join(out)
+    
+    def finalize(self):
+        out = self._start()
+        out.append(self.chunk_cipher.seal(self.index, self.buffer, True))
+        self.buffer = b""
+        return b"".join(out)
+
+class StreamDecryptor:
+    """流式解密：update 接收任意大小的密文，返回已校验的明文；finalize 校验最后一块（数据被截断时失败）"""
+    
+    def __init__(self, cipher):
+        self.cipher = cipher
+        self.chunk_cipher = None
+        self.buffer = b""
+        self.index = 0
+    
+    def update(self, data):
+        buffer = self.buffer + data if self.buffer else bytes(data)
+        offset = 0
+        if self.chunk_cipher is None:
+            if len(buffer) < ENCRYPTION_HEADER_SIZE:
+                self.buffer = buffer
+                return b""
+            self.chunk_cipher = self.cipher.chunk_cipher(buffer[:ENCRYPTION_HEADER_SIZE])
+            offset = ENCRYPTION_HEADER_SIZE
+        out = []
+        block = ENCRYPTION_CHUNK_SIZE + ENCRYPTION_TAG_SIZE
+        while len(buffer) - offset > block:
+            out.append(self.chunk_cipher.open(self.index, buffer[offset:offset + block], False))
+            self.index += 1
+            offset += block
+        self.buffer = buffer[offset:]
+        return b"".join(out)
+    
+    def finalize(self):
+        if self.chunk_cipher is None:
+            raise DecryptionError("密文不完整")
+        data = self.chunk_cipher.open(self.index, self.buffer, True)
+        self.buffer = b""
+        return data
+
+class EncryptedReader:
+    """
+    明文文件的密文只读视图：按需加密读取位置所在的分块，支持 seek/read
+    可直接用于流式上传和按偏移读取的分块上传，内存中只保留一个分块
+    """
+    
+    def __init__(self, f, size, chunk_cipher):
+        self.f = f
+        self.plain_size = size
+        self.chunk_cipher = chunk_cipher
+        self.chunk_count = max(1, -(-size // ENCRYPTION_CHUNK_SIZE))
+        self.size = encrypted_size(size)
+        self.position = 0
+        self.cached = (None, b"")
+    
+    def __len__(self):
+        return self.size - self.position
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
+    
+    def close(self):
+        self.f.close()
+    
+    def tell(self):
+        return self.position
+    
+    def seek(self, offset, whence=0):
+        base = {0: 0, 1: self.position, 2: self.size}[whence]
+        self.position = min(max(0, base + offset), self.size)
+        return self.position
+    
+    def _chunk(self, index):
+        if self.cached[0] != index:
+            self.f.seek(index * ENCRYPTION_CHUNK_SIZE)
+            plain = self.f.read(ENCRYPTION_CHUNK_SIZE)
+            self.cached = (index, self.chunk_cipher.seal(index, plain, index == self.chunk_count - 1))
+        return self.cached[1]
+    
+    def read(self, size=-1):
+        end = self.size if size is None or size < 0 else min(self.size, self.position + size)
+        out = []
+        while self.position < end:
+            if self.position < ENCRYPTION_HEADER_SIZE:
+                data = self.chunk_cipher.header[self.position:end]
+            else:
+                block = ENCRYPTION_CHUNK_SIZE + ENCRYPTION_TAG_SIZE
+                index, offset = divmod(self.position - ENCRYPTION_HEADER_SIZE, block)
+                data = self._chunk(index)[offset:offset + end - self.position]
+            out.append(data)
+            self.position += len(data)
+        return b"".join(out)
+
+def encrypted_size(size):
+    """明文大小对应的密文大小"""
+    return ENCRYPTION_HEADER_SIZE + size + max(1, -(-size // ENCRYPTION_CHUNK_SIZE)) * ENCRYPTION_TAG_SIZE
+
+class ContentCipher:
+    """
+    端到端加密（需要安装 cryptography）：同一频道的客户端使用相同口令派生出相同密钥，服务端只保存密文
+    文件/图片的盐由密钥和明文 SHA-256 派生（相同内容得到相同密文，保留秒传），文本每次使用随机盐
+    """
+    
+    def __init__(self, passphrase, channel):
+        from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+        self.aesgcm = AESGCM
+        # scrypt 派生主密钥（约 16MB 内存、几十毫秒），以频道名作为盐：不同频道使用相同口令也得到不同密钥
+        self.master_key = hashlib.scrypt(passphrase.encode("utf-8"), salt=f"SyncClipboard/{channel}".encode("utf-8"),
+                                         n=2 ** 14, r=8, p=1, dklen=32)
+    
+    def content_salt(self, plain_sha256):
+        """由明文 SHA-256（十六进制）派生的盐"""
+        return hmac.new(self.master_key, b"salt:" + plain_sha256.encode(), hashlib.sha256).digest()[:ENCRYPTION_SALT_SIZE]
+    
+    def chunk_cipher(self, header):
+        if header[:len(ENCRYPTION_MAGIC)] != ENCRYPTION_MAGIC:
+            raise DecryptionError("不是加密内容")
+        key = hmac.new(self.master_key, b"key:" + header[len(ENCRYPTION_MAGIC):], hashlib.sha256).digest()
+        return ChunkCipher(self.aesgcm(key), bytes(header))
+    
+    def new_chunk_cipher(self, salt=None):
+        return self.chunk_cipher(ENCRYPTION_MAGIC + (salt or os.urandom(ENCRYPTION_SALT_SIZE)))
+    
+    def encryptor(self, salt=None):
+        return StreamEncryptor(self.new_chunk_cipher(salt))
+    
+    def decryptor(self):
+        return StreamDecryptor(self)
+    
+    def open_encrypted(self, f, size, salt):
+        """明文文件对象的密文视图（见 EncryptedReader）"""
+        return EncryptedReader(f, size, self.new_chunk_cipher(salt))
+    
+    def iter_encrypt(self, chunks, salt=None):
+        """流式加密生成器（用于打包上传等无法预先知道大小的数据）"""
+        encryptor = self.encryptor(salt)
+        for chunk in chunks:
+            data = encryptor.update(chunk)
+            if data:
+                yield data
+        yield encryptor.finalize()
+    
+    def encrypt_bytes(self, data, salt=None):
+        encryptor = self.encryptor(salt)
+        return encryptor.update(data) + encryptor.finalize()
+    
+    def decrypt_bytes(self, data):
+        decryptor = self.decryptor()
+        return decryptor.update(data) + decryptor.finalize()
+    
+    def encrypt_text(self, text):
+        """加密文本，返回 URL 安全的 Base64（可放入 JSON 和请求头）"""
+        return base64.urlsafe_b64encode(self.encrypt_bytes(text.encode("utf-8"))).decode("ascii")
+    
+    def decrypt_text(self, text):
+        try:
+            data = base64.urlsafe_b64decode(text.encode("ascii"))
+        except (ValueError, UnicodeEncodeError):
+            raise DecryptionError("不是加密内容")
+        return self.decrypt_bytes(data).decode("utf-8")
+    
+    def decrypt_file(self, src_path, dst_path, chunk_size=1024 * 1024):
+        """流式解密文件（内存占用与文件大小无关），失败时删除不完整的输出"""
+        decryptor = self.decryptor()
+        try:
+            with open(src_path, "rb") as src, open(dst_path, "wb") as dst:
+                while True:
+                    chunk = src.read(chunk_size)
+                    if not chunk:
+                        break
+                    dst.write(decryptor.update(chunk))
+                dst.write(decryptor.finalize())
+        except BaseException:
+            remove_file(dst_path)
+            raise
+
+# =======================
+# 事件循环辅助
+# =======================
+class AsyncSignal:
+    """
+    可在任意线程触发、在事件循环中等待的信号（用法同 threading.Event，但等待不占用线程）
+    剪贴板变化、上传任务入队、轮询唤醒等都通过它通知引擎的协程
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flag = False
+        self._waiters = set()  # (事件循环, 等待中的 Future)
+    
+    def is_set(self):
+        return self._flag
+    
+    def set(self):
+        with self._lock:
+            self._flag = True
+            waiters, self._waiters = self._waiters, set()
+        for loop, future in waiters:
+            try:
+                loop.call_soon_threadsafe(_resolve_waiter, future)
+            except RuntimeError:
+                # 事件循环已关闭
+                pass
+    
+    def clear(self):
+        with self._lock:
+            self._flag = False
+    
+    async def wait(self, timeout=None):
+        """等待信号，返回是否已触发（超时返回 False）"""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._flag:
+                return True
+            waiter = (loop, loop.create_future())
+            self._waiters.add(waiter)
+        try:
+            await asyncio.wait_for(waiter[1], timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            with self._lock:
+                self._waiters.discard(waiter)
+
+def _resolve_waiter(future):
+    if not future.done():
+        future.set_result(None)
+
+async def iter_in_thread(chunks):
+    """
+    将同步的数据块迭代器（读文件、压缩、加密、打包）转为异步迭代器，用作流式上传的请求体
+    每块在线程池中生成，不阻塞事件循环；生成时抛出的异常（如 UploadCancelled）会中止请求
+    """
+    iterator = iter(chunks)
+    while True:
+        chunk = await asyncio.to_thread(next, iterator, None)
+        if chunk is None:
+            return
+        yield chunk
+
+# =======================
+# 剪贴板与通知后端
+# =======================
+class ClipboardImage:
+    """
+    剪贴板中的图片：引擎只使用尺寸、指纹和编码结果，不关心底层图片对象
+    默认实现直接保存已编码的图片字节（内存剪贴板使用）
+    """
+    
+    def __init__(self, data, width=0, height=0, image_format="png"):
+        self.data = data
+        self.width = width
+        self.height = height
+        self.image_format = image_format
+    
+    def fingerprint(self):
+        """用于判断剪贴板图片是否变化的指纹"""
+        return hashlib.sha256(self.data).digest()
+    
+    def encode(self, image_format="png", quality=-1, max_dimension=0):
+        """按配置转码，返回 (编码后的字节, 格式)，编码失败时字节为 None（在图片编码线程池中执行）"""
+        return self.data, self.image_format
+
+class ClipboardBackend:
+    """
+    剪贴板后端接口：引擎只通过这些方法读写剪贴板
+    set_* 在内容写入剪贴板后返回；默认实现不支持文件、图片和延迟下载
+    """
+    supports_lazy = False  # 是否支持延迟下载（粘贴时才获取数据）
+    
+    def get_text(self):
+        return ""
+    
+    def set_text(self, text):
+        pass
+    
+    def get_files(self):
+        """剪贴板中的文件和文件夹路径列表"""
+        return []
+    
+    def set_files(self, paths):
+        pass
+    
+    def get_image(self):
+        """剪贴板中的图片（ClipboardImage），没有图片时返回 None"""
+        return None
+    
+    def decode_image(self, image_data):
+        """解码收到的图片字节（在线程池中执行），返回交给 set_image 的图片，无法解码时返回 None"""
+        return image_data
+    
+    def set_image(self, image):
+        """将 decode_image 解码后的图片放入剪贴板，返回图片的 (宽, 高)"""
+        return None
+    
+    def set_lazy(self, data, materialize):
+        """
+        放入延迟下载的内容：data 为服务端条目元数据，
+        materialize() 在粘贴时调用，开始下载并返回引擎的后台任务（asyncio.Task），
+        任务结果为图片字节或文件路径列表（失败为 None）
+        """
+    
+    def is_lazy(self):
+        """剪贴板中是否为尚未下载的延迟内容（检测剪贴板时不能读取它的数据，否则会触发下载）"""
+        return False
+    
+    def clear(self):
+        pass
+    
+    async def call(self, func, *args):
+        """
+        执行读写剪贴板的 func(*args)（引擎访问剪贴板都经过这里）
+        默认在线程池中执行，不阻塞事件循环（pyperclip 可能调用外部程序）
+        """
+        return await asyncio.to_thread(func, *args)
+    
+    async def wait_for_change(self):
+        """等待下一次检测：默认每0.5秒轮询"""
+        await asyncio.sleep(0.5)
+    
+    def wake(self):
+        """让等待中的 wait_for_change 立即返回（如重新开启上传时），可在任意线程调用"""
+
+class TextClipboard(ClipboardBackend):
+    """只同步文本的系统剪贴板（pyperclip），适用于没有 Qt 的环境"""
+    
+    def __init__(self):
+        import pyperclip
+        self.pyperclip = pyperclip
+        # 没有可用的剪贴板程序时在这里抛出异常，便于调用方回退
+        self.pyperclip.paste()
+    
+    def get_text(self):
+        return self.pyperclip.paste()
+    
+    def set_text(self, text):
+        self.pyperclip.copy(text)
+    
+    def clear(self):
+        self.pyperclip.copy("")
+
+class MemoryClipboard(ClipboardBackend):
+    """
+    进程内的剪贴板：用于无剪贴板的服务器/容器（只接收并记录内容）以及测试和基准测试
+    copy_* 模拟用户复制（可在任意线程调用），set_* 为引擎写入，二者都会唤醒监听任务
+    """
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.changed = AsyncSignal()
+        self.text = ""
+        self.files = []
+        self.image = None
+    
+    def _replace(self, text="", files=None, image=None):
+        with self.lock:
+            self.text, self.files, self.image = text, list(files or []), image
+        self.changed.set()
+    
+    def copy_text(self, text):
+        self._replace(text=text)
+    
+    def copy_files(self, paths):
+        self._replace(files=paths)
+    
+    def copy_image(self, image_data, width=0, height=0, image_format="png"):
+        self._replace(image=ClipboardImage(image_data, width, height, image_format))
+    
+    def get_text(self):
+        return self.text
+    
+    def set_text(self, text):
+        self.copy_text(text)
+    
+    def get_files(self):
+        return [path for path in self.files if os.path.exists(path)]
+    
+    def set_files(self, paths):
+        self.copy_files(paths)
+    
+    def get_image(self):
+        return self.image
+    
+    def set_image(self, image_data):
+        self.copy_image(image_data)
+        return (0, 0)
+    
+    def clear(self):
+        self._replace()
+    
+    async def call(self, func, *args):
+        # 读写内存很快，直接在事件循环中执行
+        return func(*args)
+    
+    async def wait_for_change(self, timeout=0.5):
+        await self.changed.wait(timeout)
+        self.changed.clear()
+    
+    def wake(self):
+        self.changed.set()
+
+class Notifier:
+    """通知后端接口：默认不显示任何提示（日志已输出到控制台）"""
+    
+    def notify(self, title, message, warning=False, duration=2000):
+        pass
+    
+    def progress(self, text):
+        """显示传输进度，空文本表示结束"""
+    
+    def play_sound(self):
+        pass
+
+# =======================
+# 上传队列与轮询调度
+# =======================
+class UploadCancelled(Exception):
+    """上传任务已被更新的剪贴板内容取代"""
+
+class UploadQueue:
+    """
+    后台上传队列（最新优先）：只保留一个待上传任务，新内容入队时替换尚未开始的旧任务，
+    并取消进行中的旧上传（见 SyncEngine.upload_worker）；监听任务只负责入队，不会被网络阻塞
+    """
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = None    # 待上传的任务参数
+        self.generation = 0    # 最新任务的序号
+        self.ready = AsyncSignal()  # 有新任务入队（上传进行中入队表示该上传已被取代）
+    
+    def put(self, **job):
+        with self.lock:
+            if self.pending is not None:
+                print(f"⏭️  已被新内容取代，跳过排队中的上传: {self.pending['content_type']}")
+                # 被取代的任务中尚未开始的图片转码直接取消
+                for value in self.pending.values():
+                    if isinstance(value, Future):
+                        value.cancel()
+            self.generation += 1
+            self.pending = dict(job, generation=self.generation)
+            self.ready.set()
+    
+    def take(self):
+        """取出待上传任务，没有任务时返回 None"""
+        with self.lock:
+            job, self.pending = self.pending, None
+            self.ready.clear()
+            return job
+    
+    async def get(self):
+        """等待并取出下一个待上传任务"""
+        while True:
+            job = self.take()
+            if job is not None:
+                return job
+            await self.ready.wait()
+    
+    def check_cancelled(self, generation):
+        if generation is not None and generation != self.generation:
+            raise UploadCancelled()
+
+class PollScheduler:
+    """
+    自适应轮询间隔：
+    - 有活动（收到新内容或本机上传）后的一段时间内按 sync_interval 拉取，之后每次无更新间隔加倍，直到 sync_interval_max
+    - 拉取失败时按 retry_delay 指数退避
+    - 服务端下发的 poll_interval 作为间隔下限
+    - 每次等待加入随机抖动，避免服务端重启后所有客户端同时请求
+    """
+    ACTIVE_SECONDS = 60  # 活动后保持快速轮询的时间
+    JITTER = 0.2  # 抖动比例（±20%）
+    
+    def __init__(self, interval, max_interval):
+        self.interval = interval
+        self.max_interval = max_interval
+        self.last_activity = time.monotonic()
+        self.idle_polls = 0
+        self.failures = 0
+        self.server_hint = 0
+        self._wakeup = AsyncSignal()
+    
+    def activity(self):
+        """记录一次活动：恢复快速轮询，并唤醒正在等待的拉取"""
+        self.last_activity = time.monotonic()
+        self.idle_polls = 0
+        self.wake()
+    
+    def wake(self):
+        """提前结束正在进行的等待"""
+        self._wakeup.set()
+    
+    def record(self, data):
+        """根据一次拉取结果（SyncEngine.fetch_clipboard 的返回值）更新状态"""
+        if data is None:
+            self.failures += 1
+            return
+        self.failures = 0
+        try:
+            self.server_hint = max(float(data.get("poll_interval") or 0), 0)
+        except (TypeError, ValueError):
+            self.server_hint = 0
+        if data.get("status") != "no_update":
+            self.activity()
+        elif time.monotonic() - self.last_activity >= self.ACTIVE_SECONDS:
+            self.idle_polls += 1
+    
+    def next_delay(self):
+        """下一次拉取前的等待秒数（含抖动）"""
+        if self.failures:
+            delay = retry_delay(self.failures - 1)
+        else:
+            delay = min(self.interval * 2 ** min(self.idle_polls, 16), self.max_interval)
+            delay = max(delay, self.server_hint)
+        return delay * random.uniform(1 - self.JITTER, 1 + self.JITTER)
+    
+    async def sleep(self):
+        """等待到下一次拉取，期间有活动则提前结束"""
+        if await self._wakeup.wait(self.next_delay()):
+            self._wakeup.clear()
+
+# =======================
+# 同步引擎
+# =======================
+def make_http_client(channel):
+    """创建启用 Keep-Alive 的异步 HTTP 客户端（同一事件循环中的请求共用连接池，不自动重试，避免重复上传）"""
+    return httpx.AsyncClient(
+        # 配置连接池：最大连接数和keep-alive
+        limits=httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=30),
+        headers={'X-Channel': quote(channel)}
+    )
+
+def _import_websocket_connect():
+    from websockets.asyncio.client import connect
+    return connect
+
+class SyncState:
+    """同步引擎的运行状态"""
+    
+    def __init__(self):
+        self.last_sync_time = None  # 最后一次从服务器同步的时间（服务器的updated_at）
+        self.last_fetch_etag = None  # 最后一次拉取到的内容 ETag（服务端内容未变化时返回 304）
+        self.last_sync_download_time = 0  # 最后一次实际下载内容的本地时间戳（用于保护期）
+        self.last_downloaded_file = None  # 最后一次下载的文件路径（用于清理）
+        self.part_paths = set()  # 本引擎创建的下载临时文件（停止时只清理这些，不影响共用临时目录的其他实例）
+        self.push_connected = False  # WebSocket 推送通道是否在线
+        self.server_encodings = None  # 服务端支持的压缩编码（首次上传时从 /status 获取）
+        self.allow_upload = True  # 允许上传数据
+        self.allow_download = True  # 允许下载数据
+        self.stopped = False  # 已停止
+
+class SyncEngine:
+    """
+    剪贴板同步引擎：监听本地剪贴板并上传，从服务端拉取/接收推送并写入本地剪贴板
+    所有网络操作都是协程，运行在同一个事件循环中；start() 启动后台任务，aclose()/stop() 取消并停止
+    各方法也可以单独调用（如基准测试直接上传、拉取，同步代码中见 run_sync）
+    """
+    
+    def __init__(self, config, clipboard=None, notifier=None):
+        self.config = config
+        self.clipboard = clipboard or MemoryClipboard()
+        self.notifier = notifier or Notifier()
+        self.state = SyncState()
+        self.server_url = config.server_url
+        if config.encryption_key and importlib.util.find_spec("cryptography") is None:
+            raise RuntimeError("已配置 encryption_key，但未安装 cryptography（pip install cryptography）")
+        self._cipher = None  # 端到端加密（见 cipher 属性）
+        self._cipher_lock = threading.Lock()
+        self._client = None  # HTTP 客户端在启动时（或第一次请求时）创建（见 client 属性）
+        self.upload_queue = UploadQueue()
+        self.poll_scheduler = PollScheduler(config.sync_interval, config.sync_interval_max)
+        self.image_encode_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="image-encode")
+        self.remote_apply_lock = asyncio.Lock()  # 串行处理推送与轮询收到的内容
+        self.download_record_lock = asyncio.Lock()  # 替换下载文件记录（延迟下载在粘贴时进行，可能与处理新内容同时发生）
+        self.clipboard_lock = threading.Lock()  # 写入远端内容与检测本地变化互斥，避免把刚收到的内容当作本机复制上传
+        self.resync_event = AsyncSignal()  # 推送在线时请求轮询任务补拉一次
+        self.first_fetch_event = AsyncSignal()  # 启动后第一次拉取完成（无论成功与否）
+        self.loop = None  # 引擎运行的事件循环（见 ensure_loop）
+        self.loop_thread = None  # 没有外部事件循环时运行事件循环的网络线程
+        self.tasks = set()  # 后台任务，停止时全部取消
+    
+    @property
+    def client(self):
+        """HTTP 客户端：首次使用时才导入 httpx 并创建连接池（后台运行时在启动阶段于线程中创建，见 run）"""
+        if self._client is None:
+            self._client = make_http_client(self.config.channel)
+        return self._client
+    
+    @property
+    def cipher(self):
+        """端到端加密：未配置 encryption_key 时为 None；密钥派生较慢，启动时（或首次加解密时）才进行"""
+        if self._cipher is None and self.config.encryption_key:
+            with self._cipher_lock:
+                if self._cipher is None:
+                    self._cipher = ContentCipher(self.config.encryption_key, self.config.channel)
+        return self._cipher
+    
+    # ----- 生命周期 -----
+    def ensure_loop(self):
+        """
+        引擎运行的事件循环：首次在事件循环中调用时使用该循环（托盘客户端与 Qt 集成的事件循环），
+        否则创建新的事件循环，在网络线程中运行（守护进程、基准测试）
+        """
+        if self.loop is None:
+            try:
+                self.loop = asyncio.get_running_loop()
+            except RuntimeError:
+                self.loop = asyncio.new_event_loop()
+                self.loop_thread = threading.Thread(target=self._run_loop, name="sync-engine", daemon=True)
+                self.loop_thread.start()
+        return self.loop
+    
+    def _run_loop(self):
+        """网络线程：运行事件循环直到 stop()，然后结束残留的任务（如 WebSocket 连接的心跳）并关闭循环"""
+        loop = self.loop
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_forever()
+            tasks = asyncio.all_tasks(loop)
+            for task in tasks:
+                task.cancel()
+            loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            loop.run_until_complete(loop.shutdown_asyncgens())
+        finally:
+            loop.close()
+    
+    def in_loop_thread(self):
+        """当前是否在引擎的事件循环中"""
+        try:
+            return asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            return False
+    
+    async def _tracked(self, coro):
+        task = asyncio.current_task()
+        self.tasks.add(task)
+        try:
+            return await coro
+        finally:
+            self.tasks.discard(task)
+    
+    def spawn(self, coro):
+        """
+        在引擎的事件循环中运行后台协程（停止时一并取消），可在任意线程调用
+        在事件循环中调用时返回 asyncio.Task，在其他线程中调用时返回 concurrent.futures.Future
+        """
+        loop = self.ensure_loop()
+        if self.in_loop_thread():
+            task = loop.create_task(self._tracked(coro))
+            self.tasks.add(task)
+            return task
+        return asyncio.run_coroutine_threadsafe(self._tracked(coro), loop)
+    
+    def run_sync(self, coro, timeout=None):
+        """在引擎的事件循环中运行协程并等待结果（供守护进程、基准测试等同步代码使用，不能在事件循环中调用）"""
+        if self.in_loop_thread():
+            coro.close()
+            raise RuntimeError("run_sync 不能在引擎的事件循环中调用，请使用 await")
+        return self.spawn(coro).result(timeout)
+    
+    def start(self):
+        """启动监听、上传、拉取（和推送）任务（见 ensure_loop），立即返回"""
+        self.spawn(self.run())
+    
+    async def run(self):
+        """并发运行监听、上传、拉取（和推送）任务，直到被取消"""
+        # 导入 httpx、创建连接池和派生加密密钥（scrypt）较慢，在线程中进行，不阻塞事件循环（界面）
+        if self._client is None:
+            self._client = await asyncio.to_thread(make_http_client, self.config.channel)
+        await asyncio.to_thread(lambda: self.cipher)
+        
+        roles = [self.clipboard_watcher(), self.upload_worker(), self.sync_from_server()]
+        if self.config.enable_push:
+            roles.append(self.push_receiver())
+        tasks = [asyncio.ensure_future(role) for role in roles]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            # 任一任务意外退出或被取消时结束其他任务
+            for task in tasks:
+                task.cancel()
+    
+    async def aclose(self):
+        """
+        停止引擎：取消所有后台任务（进行中的请求、等待和重试立即结束），关闭连接，并清理下载的临时文件
+        """
+        self.state.stopped = True
+        current = asyncio.current_task()
+        tasks = [task for task in self.tasks if task is not current]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if self._client is not None:
+            await self._client.aclose()
+        self.cleanup()
+    
+    def stop(self, timeout=2):
+        """
+        停止引擎（aclose 的同步版本，可在任意线程调用）
+        - 引擎运行在网络线程中：等待 aclose 完成（最多 timeout 秒）后结束网络线程
+        - 在引擎的事件循环中调用：取消后台任务并清理后立即返回（协程中应使用 await aclose()）
+        - 事件循环未运行：只清理临时文件
+        """
+        loop = self.loop
+        if loop is None or not loop.is_running():
+            self.state.stopped = True
+            self.cleanup()
+            return
+        if self.in_loop_thread():
+            self.state.stopped = True
+            for task in list(self.tasks):
+                task.cancel()
+            self.cleanup()
+            return
+        
+        try:
+            asyncio.run_coroutine_threadsafe(self._tracked(self.aclose()), loop).result(timeout)
+        except Exception as e:
+            print(f"⚠️  停止同步引擎失败: {type(e).__name__} {e}")
+        if self.loop_thread is not None:
+            loop.call_soon_threadsafe(loop.stop)
+            self.loop_thread.join(timeout)
+    
+    def cleanup(self):
+        """清理下载的临时文件（停止时调用）"""
+        # 未下载的延迟内容在退出后无法提供，清空剪贴板，避免剪贴板管理器接管时触发下载
+        if self.clipboard.is_lazy():
+            self.clipboard.clear()
+        
+        # 清理最后一次下载的临时文件
+        last_downloaded_file = self.state.last_downloaded_file
+        if last_downloaded_file and os.path.exists(last_downloaded_file):
+            try:
+                remove_download(last_downloaded_file)
+                print(f"🗑️  已清理临时文件: {os.path.basename(last_downloaded_file)}")
+            except Exception as e:
+                print(f"⚠️  清理文件失败: {e}")
+            self.state.last_downloaded_file = None
+        
+        # 清理本引擎未完成的下载
+        for part_path in list(self.state.part_paths):
+            self.discard_part(part_path)
+        self.image_encode_pool.shutdown(wait=False)
+    
+    def set_allow_upload(self, allowed):
+        self.state.allow_upload = allowed
+        # 重新开启上传时立即检测一次剪贴板
+        self.clipboard.wake()
+    
+    def set_allow_download(self, allowed):
+        self.state.allow_download = allowed
+        if allowed:
+            # 关闭期间的推送已被忽略，重新开启后补拉一次最新内容
+            self.resync_event.set()
+    
+    # ----- 提示 -----
+    def notify(self, title, message, warning=False, duration=2000):
+        if self.config.enable_popup:
+            self.notifier.notify(title, message, warning, duration)
+    
+    def play_sound(self):
+        if self.config.enable_sound:
+            try:
+                self.notifier.play_sound()
+            except Exception as e:
+                print("⚠️ 提示音播放失败:", e)
+    
+    # ----- 上传 -----
+    async def get_upload_encoding(self):
+        """上传使用的压缩编码：本机与服务端都支持 zstd 时优先使用，否则 gzip；服务端不支持压缩时返回 None"""
+        if self.state.server_encodings is None:
+            try:
+                r = await self.client.get(f"{self.server_url}/status", timeout=3)
+                self.state.server_encodings = r.json().get("encodings", [])
+            except Exception:
+                # 获取失败时本次不压缩，下次再试
+                return None
+        server_encodings = self.state.server_encodings
+        # 仅在本机也能解码 zstd 响应时使用（否则其他同版本客户端下载时需要服务端解压）
+        if zstandard and "zstd" in self.client.headers.get("Accept-Encoding", "") and "zstd" in server_encodings:
+            return "zstd"
+        return "gzip" if "gzip" in server_encodings else None
+    
+    def stream_upload_headers(self, content_type, file_name=None, image_width=0, image_height=0):
+        """流式上传的元数据请求头（非 ASCII 文本进行 URL 编码）"""
+        headers = {
+            "Content-Type": "application/octet-stream",
+            "X-Content-Type": content_type,
+            "X-Device-Id": quote(self.config.device_id),
+            "X-Client-Name": quote(self.config.client_name),
+        }
+        if file_name:
+            headers["X-File-Name"] = quote(file_name)
+        if self.cipher:
+            headers["X-Encrypted"] = "1"
+        if content_type == "image":
+            headers["X-Image-Width"] = str(image_width)
+            headers["X-Image-Height"] = str(image_height)
+        return headers
+    
+    async def post_json(self, path, payload, timeout):
+        """POST JSON 到服务端，较大的请求体（如长文本）压缩后发送"""
+        body = json.dumps(payload).encode('utf-8')
+        headers = {"Content-Type": "application/json"}
+        if len(body) >= COMPRESS_MIN_BYTES:
+            encoding = await self.get_upload_encoding()
+            if encoding:
+                body = await asyncio.to_thread(compress_bytes, body, encoding)
+                headers["Content-Encoding"] = encoding
+        return await self.client.post(f"{self.server_url}{path}", content=body, headers=headers, timeout=timeout)
+    
+    async def upload_by_hash(self, content_type, blob_sha256, **meta):
+        """秒传：服务端已有相同内容（SHA-256）时只提交元数据，返回响应；服务端没有该数据时返回 None"""
+        try:
+            response = await self.client.post(f"{self.server_url}/upload", json={
+                "device_id": self.config.device_id,
+                "client_name": self.config.client_name,
+                "content_type": content_type,
+                "blob_sha256": blob_sha256,
+                "encrypted": self.cipher is not None,
+                **meta
+            }, timeout=3)
+            if response.status_code == 200:
+                print(f"⚡ 服务端已有相同内容，跳过数据上传: {blob_sha256[:12]}")
+                return response
+        except Exception as e:
+            print(f"⚠️  秒传检查失败: {e}")
+        return None
+    
+    async def send_with_retry(self, send, description):
+        """
+        发送上传请求 await send()（每次调用重新生成请求体）：连接中断时按指数退避重试
+        返回响应；重试次数用完时返回 None（UploadCancelled 和任务取消直接抛出）
+        """
+        for attempt in range(TRANSFER_RETRIES):
+            try:
+                return await send()
+            except httpx.RequestError as e:
+                if attempt + 1 < TRANSFER_RETRIES:
+                    print(f"⚠️  上传中断，{retry_delay(attempt)}秒后重试: {description}: {e}")
+                    await asyncio.sleep(retry_delay(attempt))
+                else:
+                    print(f"❌ 上传失败: {description}: {e}")
+        return None
+    
+    @staticmethod
+    def upload_succeeded(response, description):
+        """上传响应是否成功，失败时输出服务端返回的原因"""
+        if response is None:
+            return False
+        if response.status_code == 200:
+            return True
+        try:
+            detail = response.json().get("detail")
+        except ValueError:
+            detail = None
+        print(f"❌ 上传失败: {description}（HTTP {response.status_code}{f'：{detail}' if detail else ''}）")
+        return False
+    
+    async def upload_worker(self):
+        """上传任务：依次处理队列中最新的剪贴板内容，上传期间有新内容入队时取消进行中的上传"""
+        queue = self.upload_queue
+        while True:
+            job = await queue.get()
+            # 本机正在使用剪贴板，恢复快速轮询
+            self.poll_scheduler.activity()
+            upload = asyncio.ensure_future(self.upload_clipboard(**job))
+            superseded = asyncio.ensure_future(queue.ready.wait())
+            try:
+                await asyncio.wait([upload, superseded], return_when=asyncio.FIRST_COMPLETED)
+                if not upload.done():
+                    file_path = job.get("file_path")
+                    print(f"⏹️  已有更新的剪贴板内容，取消上传: {os.path.basename(file_path) if file_path else job['content_type']}")
+                    upload.cancel()
+                    await asyncio.wait([upload])
+            finally:
+                upload.cancel()
+                superseded.cancel()
+    
+    def make_upload_progress(self, file_name, total, generation=None):
+        """生成上传进度回调：百分比变化时更新进度提示（小文件不显示）；上传已被更新的内容取代时抛出 UploadCancelled 中止发送"""
+        last_percent = None
+        
+        def progress(done):
+            nonlocal last_percent
+            self.upload_queue.check_cancelled(generation)
+            if total < PROGRESS_MIN_BYTES:
+                return
+            percent = min(100, done * 100 // total)
+            if percent != last_percent:
+                last_percent = percent
+                self.notifier.progress(f"📤 上传中: {file_name} {percent}%")
+        
+        return progress
+    
+    async def upload_file_chunked(self, file_path, blob_sha256, file_size, progress=None, salt=None, **meta):
+        """
+        分块上传大文件：每个分块带 SHA-256 校验，失败后重新初始化，从服务端已确认的分块继续上传
+        内存中只保留当前分块，progress 回调服务端已确认的字节数
+        启用加密时上传的是密文（blob_sha256、file_size 为密文的哈希和大小，salt 见 open_upload_file）
+        返回提交响应，重试次数用完仍失败时返回 None
+        """
+        file_name = os.path.basename(file_path)
+        # 可压缩的文件逐块压缩发送，服务端解压校验后保存（密文无法压缩）
+        compressible = not self.cipher and await asyncio.to_thread(is_compressible_file, file_path)
+        encoding = await self.get_upload_encoding() if compressible else None
+        
+        def read_chunk(f, index, chunk_size):
+            """读取（加密、压缩）一个分块，返回 (请求体, 请求头)"""
+            f.seek(index * chunk_size)
+            chunk = f.read(chunk_size)
+            headers = {
+                "Content-Type": "application/octet-stream",
+                "X-Chunk-Sha256": hashlib.sha256(chunk).hexdigest()
+            }
+            # 服务端按分块大小限制请求体，压缩后不更小的分块（已压缩的数据）原样上传
+            compressed = compress_bytes(chunk, encoding) if encoding else None
+            if compressed is not None and len(compressed) < len(chunk):
+                chunk = compressed
+                headers["Content-Encoding"] = encoding
+            return chunk, headers
+        
+        for attempt in range(TRANSFER_RETRIES):
+            try:
+                r = await self.client.post(f"{self.server_url}/upload/chunked",
+                                           json={"blob_sha256": blob_sha256, "size": file_size}, timeout=10)
+                # 服务端磁盘空间不足（413）或本频道同时上传过多（429）等
+                if not self.upload_succeeded(r, f"分块上传初始化 {file_name}"):
+                    return None
+                upload = r.json()
+                upload_id, chunk_size = upload["upload_id"], upload["chunk_size"]
+                received = set(upload["received"])
+                if received:
+                    print(f"⏯️  断点续传: {file_name}（已上传 {len(received)}/{upload['chunk_count']} 块）")
+                done = min(file_size, len(received) * chunk_size)
+                
+                with self.open_upload_file(file_path, salt) as f:
+                    for index in range(upload["chunk_count"]):
+                        if index in received:
+                            continue
+                        chunk, headers = await asyncio.to_thread(read_chunk, f, index, chunk_size)
+                        r = await self.client.put(f"{self.server_url}/upload/chunked/{upload_id}/{index}",
+                                                  content=chunk, headers=headers, timeout=30)
+                        r.raise_for_status()
+                        done = min(file_size, done + chunk_size)
+                        if progress:
+                            progress(done)
+                
+                # 服务端校验整个文件需要时间，超时放宽
+                r = await self.client.post(f"{self.server_url}/upload/chunked/{upload_id}/commit", json={
+                    "device_id": self.config.device_id,
+                    "client_name": self.config.client_name,
+                    "encrypted": self.cipher is not None,
+                    **meta
+                }, timeout=60)
+                r.raise_for_status()
+                return r
+            except httpx.HTTPError as e:
+                if attempt + 1 < TRANSFER_RETRIES:
+                    print(f"⚠️  分块上传中断，{retry_delay(attempt)}秒后续传: {e}")
+                    await asyncio.sleep(retry_delay(attempt))
+        print(f"❌ 分块上传失败: {file_name}")
+        return None
+    
+    def open_upload_file(self, file_path, salt=None):
+        """打开待上传的文件：启用加密时返回按需加密的密文视图（可 seek/read，内存中只保留一个分块），否则返回原文件"""
+        f = open(file_path, 'rb')
+        if self.cipher is None:
+            return f
+        return self.cipher.open_encrypted(f, os.fstat(f.fileno()).st_size, salt)
+    
+    async def upload_clipboard(self, content_type="text", text="", file_path=None, image=None, image_encoded=None,
+                         file_paths=None, generation=None):
+        """
+        上传剪贴板内容到服务端
+        :param image: ClipboardImage
+        :param image_encoded: 图片转码任务（Future，检测到变化时已提交到编码线程池），为空时在此提交
+        :param file_paths: 多个文件或包含文件夹时的路径列表（打包上传）
+        :param generation: 上传队列中的任务序号，有更新的内容入队后正在读取的请求体在下一个数据块处中止（为空则不检查）
+        """
+        max_file_size = self.config.max_file_size
+        try:
+            if content_type == "image" and image:
+                # 上传图片（按配置转码后的原始字节，流式上传；尺寸元数据为原图尺寸）
+                if image_encoded is None:
+                    image_encoded = self.submit_image_encode(image)
+                image_data, image_format = await asyncio.wrap_future(image_encoded)
+                if image_data is None:
+                    return
+                
+                image_size = len(image_data)
+                width = image.width
+                height = image.height
+                
+                if max_file_size and image_size > max_file_size:
+                    max_mb = max_file_size / (1024 * 1024)
+                    image_mb = image_size / (1024 * 1024)
+                    self.notify(
+                        "⚠️  图片过大",
+                        f"{width}x{height}\n大小 {image_mb:.1f}MB 超出限制 {max_mb:.1f}MB",
+                        warning=True,
+                        duration=3000
+                    )
+                    return
+                self.upload_queue.check_cancelled(generation)
+                
+                if self.cipher:
+                    # 盐由明文哈希派生，相同图片得到相同密文，秒传仍然有效
+                    image_data = await asyncio.to_thread(lambda: self.cipher.encrypt_bytes(
+                        image_data, self.cipher.content_salt(hashlib.sha256(image_data).hexdigest())))
+                blob_sha256 = await asyncio.to_thread(lambda: hashlib.sha256(image_data).hexdigest())
+                response = await self.upload_by_hash("image", blob_sha256,
+                                                     image_width=width, image_height=height, image_format=image_format)
+                if response is None:
+                    headers = self.stream_upload_headers("image", image_width=width, image_height=height)
+                    headers["X-Image-Format"] = image_format
+                    headers["Content-Length"] = str(len(image_data))
+                    # 与文件相同经 ProgressFile 分块发送，显示进度
+                    progress = self.make_upload_progress(f"图片 {width}x{height}", len(image_data), generation)
+                    try:
+                        response = await self.send_with_retry(lambda: self.client.post(
+                            f"{self.server_url}/upload/stream",
+                            content=iter_in_thread(ProgressFile(io.BytesIO(image_data), len(image_data), progress)),
+                            headers=headers,
+                            timeout=15
+                        ), f"图片 {width}x{height}")
+                    finally:
+                        self.notifier.progress("")
+                
+                if self.upload_succeeded(response, f"图片 {width}x{height}"):
+                    print(f"✅ 上传图片成功: {width}x{height} ({image_size/1024:.1f}KB) | {get_timestamp()}")
+                    self.notify("📤 图片同步", f"已上传: {width}x{height} ({image_size/1024:.1f}KB)")
+                    self.play_sound()
+            
+            elif content_type == "file" and file_path:
+                # 上传文件（分块读取发送，不整体读入内存，显示上传进度）
+                file_name = os.path.basename(file_path)
+                file_size = os.path.getsize(file_path)
+                progress = self.make_upload_progress(file_name, file_size, generation)
+                
+                blob_sha256 = await asyncio.to_thread(file_sha256, file_path)
+                blob_size, salt, remote_name = file_size, None, file_name
+                if self.cipher:
+                    # 上传密文：盐由明文哈希派生（相同文件得到相同密文，保留秒传），再计算密文的哈希
+                    salt = self.cipher.content_salt(blob_sha256)
+                    with self.open_upload_file(file_path, salt) as f:
+                        blob_sha256, blob_size = await asyncio.to_thread(stream_sha256, f), f.size
+                    remote_name = self.cipher.encrypt_text(file_name)
+                    progress = self.make_upload_progress(file_name, blob_size, generation)
+                self.upload_queue.check_cancelled(generation)
+                response = await self.upload_by_hash("file", blob_sha256, file_name=remote_name)
+                try:
+                    if response is None and file_size > self.config.chunked_upload_size:
+                        # 大文件分块上传，网络中断后可断点续传
+                        response = await self.upload_file_chunked(file_path, blob_sha256, blob_size, progress=progress,
+                                                                  salt=salt, content_type="file", file_name=remote_name)
+                        if response is None:
+                            return
+                    elif response is None:
+                        headers = self.stream_upload_headers("file", file_name=remote_name)
+                        # 可压缩的文件（日志、源码等）边读边压缩上传，服务端按压缩形式保存并原样下发（密文无法压缩）
+                        compressible = not self.cipher and await asyncio.to_thread(is_compressible_file, file_path)
+                        encoding = await self.get_upload_encoding() if compressible else None
+                        if encoding:
+                            headers["Content-Encoding"] = encoding
+                        
+                        async def send():
+                            if encoding:
+                                return await self.client.post(
+                                    f"{self.server_url}/upload/stream",
+                                    content=iter_in_thread(iter_compressed_file(file_path, encoding, progress=progress)),
+                                    headers=headers,
+                                    timeout=10
+                                )
+                            with self.open_upload_file(file_path, salt) as f:
+                                return await self.client.post(
+                                    f"{self.server_url}/upload/stream",
+                                    content=iter_in_thread(ProgressFile(f, blob_size, progress)),
+                                    headers={**headers, "Content-Length": str(blob_size)},
+                                    timeout=10
+                                )
+                        
+                        response = await self.send_with_retry(send, file_name)
+                finally:
+                    self.notifier.progress("")
+                
+                if self.upload_succeeded(response, file_name):
+                    print(f"✅ 上传文件成功: {file_name} ({file_size/1024:.1f}KB) | {get_timestamp()}")
+                    self.notify("📤 文件同步", f"已上传: {file_name} ({file_size/1024:.1f}KB)")
+                    self.play_sound()
+            
+            elif content_type == "file" and file_paths:
+                # 多个文件/文件夹：边遍历边打包为 tar 流式上传（不生成临时归档），服务端按一个文件保存
+                file_name = archive_name(file_paths)
+                try:
+                    entries, total_size = await asyncio.to_thread(collect_archive_entries, file_paths, max_file_size or 0)
+                except ArchiveTooLarge as e:
+                    max_mb = max_file_size / (1024 * 1024)
+                    print(f"⚠️  打包内容超出限制 {max_mb:.1f}MB，跳过上传: {file_name}")
+                    self.notify(
+                        "⚠️  文件过大",
+                        f"{file_name}\n大小超过 {e.args[0]/(1024*1024):.1f}MB，超出限制 {max_mb:.1f}MB",
+                        warning=True,
+                        duration=3000
+                    )
+                    return
+                self.upload_queue.check_cancelled(generation)
+                
+                progress = self.make_upload_progress(file_name, total_size, generation)
+                headers = self.stream_upload_headers(
+                    "file", file_name=self.cipher.encrypt_text(file_name) if self.cipher else file_name)
+                headers["X-Archive"] = ARCHIVE_FORMAT
+                encoding = await self.get_upload_encoding() if not self.cipher else None
+                if encoding:
+                    headers["Content-Encoding"] = encoding
+                
+                def send():
+                    # 重试时重新遍历打包
+                    body = iter_tar_stream(entries, progress=progress)
+                    if self.cipher:
+                        # 打包流边生成边加密（随机盐），不落盘、不整体缓存
+                        body = self.cipher.iter_encrypt(body)
+                    elif encoding:
+                        body = iter_compressed(body, encoding)
+                    return self.client.post(f"{self.server_url}/upload/stream", content=iter_in_thread(body),
+                                            headers=headers, timeout=10)
+                
+                try:
+                    response = await self.send_with_retry(send, file_name)
+                finally:
+                    self.notifier.progress("")
+                
+                if self.upload_succeeded(response, file_name):
+                    file_count = sum(1 for _, _, size in entries if size is not None)
+                    print(f"✅ 上传文件包成功: {file_name}（{file_count}个文件，{total_size/1024:.1f}KB） | {get_timestamp()}")
+                    self.notify("📤 文件同步", f"已上传: {file_name}（{file_count}个文件，{total_size/1024:.1f}KB）")
+                    self.play_sound()
+            else:
+                # 上传文本
+                text_preview = text[:30] if len(text) <= 30 else text[:30] + "..."
+                
+                payload = {
+                    "device_id": self.config.device_id,
+                    "client_name": self.config.client_name,
+                    "content_type": "text",
+                    "content": self.cipher.encrypt_text(text) if self.cipher else text,
+                    "encrypted": self.cipher is not None
+                }
+                response = await self.send_with_retry(lambda: self.post_json("/upload", payload, timeout=3), "文本")
+                
+                if self.upload_succeeded(response, "文本"):
+                    print(f"✅ 上传文本成功: {text_preview!r} | {get_timestamp()}")
+                    self.notify("📤 剪贴板同步", "上传成功")
+                    self.play_sound()
+        except UploadCancelled:
+            print(f"⏹️  已有更新的剪贴板内容，取消上传: {os.path.basename(file_path) if file_path else content_type}")
+        except Exception as e:
+            # 文件读取失败等非网络错误：不重试，输出原因
+            print(f"❌ 上传失败（{type(e).__name__}）: {e}")
+    
+    def submit_image_encode(self, image):
+        """在图片编码线程池中按配置转码图片，返回 Future"""
+        config = self.config
+        return self.image_encode_pool.submit(image.encode, config.image_format, config.image_quality,
+                                             config.image_max_dimension)
+    
+    # ----- 下载 -----
+    async def fetch_clipboard(self, wait=0):
+        """
+        从服务端拉取最新内容（wait>0 时使用长轮询，服务端无更新会挂起请求）
+        携带上次的 ETag，内容未变化时服务端返回 304，不再传输和解析完整内容
+        """
+        try:
+            params = {"wait": wait} if wait > 0 else {}
+            etag = self.state.last_fetch_etag
+            headers = {"If-None-Match": etag} if etag else {}
+            
+            # 长轮询请求需要在服务端挂起时间之上留出余量
+            r = await self.client.get(f"{self.server_url}/fetch", params=params, headers=headers,
+                                      timeout=wait + 5 if wait > 0 else 3)
+            if r.status_code == 304:
+                data = {"status": "no_update", "long_poll": wait > 0}
+                if r.headers.get("X-Poll-Interval"):
+                    data["poll_interval"] = r.headers["X-Poll-Interval"]
+                return data
+            if r.status_code != 200:
+                # url_prefix 错误（404）、频道名不合法（400）、频道数已满（503）等：按失败处理并退避，不当作新内容
+                try:
+                    detail = r.json().get("detail")
+                except ValueError:
+                    detail = None
+                print(f"❌ 拉取失败: HTTP {r.status_code}{f'：{detail}' if detail else ''}")
+                return None
+            data = r.json()
+            self.state.last_fetch_etag = r.headers.get("ETag")
+            return data
+        except Exception as e:
+            print("❌ 拉取失败:", e)
+            return None
+    
+    async def download_blob_to_file(self, blob_id, part_path):
+        """
+        流式下载文件/图片数据到 part_path（分块写入磁盘，内存占用与文件大小无关），并按 blob_id（SHA-256）校验
+        连接中断时用 HTTP Range 从已写入的位置继续；压缩传输的响应无法按原始字节续传，从头重新下载
+        返回是否下载成功
+        """
+        resumable = True
+        for attempt in range(TRANSFER_RETRIES):
+            offset = os.path.getsize(part_path) if resumable and os.path.exists(part_path) else 0
+            headers = {"Range": f"bytes={offset}-"} if offset else {}
+            try:
+                async with self.client.stream("GET", f"{self.server_url}/download/{blob_id}", headers=headers,
+                                              timeout=10) as r:
+                    if r.status_code == 200:
+                        # 服务端未按 Range 返回（如内存缓存的数据），从头接收
+                        offset = 0
+                    elif r.status_code == 416:
+                        # 临时文件已不小于实际内容（残留的错误数据），重新下载
+                        remove_file(part_path)
+                        continue
+                    elif r.status_code != 206:
+                        print(f"❌ 下载失败: HTTP {r.status_code}")
+                        return False
+                    resumable = "Content-Encoding" not in r.headers
+                    with open(part_path, "r+b" if offset else "wb") as f:
+                        f.seek(offset)
+                        f.truncate()
+                        async for chunk in r.aiter_bytes(1024 * 1024):
+                            await asyncio.to_thread(f.write, chunk)
+                if await asyncio.to_thread(file_sha256, part_path) == blob_id:
+                    return True
+                print("⚠️  下载数据校验失败，重新下载")
+                remove_file(part_path)
+            except httpx.RequestError as e:
+                if not resumable:
+                    remove_file(part_path)
+                if attempt + 1 < TRANSFER_RETRIES:
+                    received = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+                    print(f"⚠️  下载中断（已接收 {received/1024:.1f}KB），{retry_delay(attempt)}秒后继续: {e}")
+                    await asyncio.sleep(retry_delay(attempt))
+            except OSError as e:
+                print(f"❌ 下载文件写入失败: {e}")
+                remove_file(part_path)
+                return False
+        print("❌ 下载失败: 重试次数已用完")
+        return False
+    
+    def new_part_path(self, blob_id=None):
+        """创建下载临时文件路径并登记（停止时清理）：按 blob_id 命名可续传，否则使用随机文件名"""
+        if blob_id:
+            part_path = blob_part_path(blob_id)
+        else:
+            part_path = os.path.join(tempfile.gettempdir(), f"syncclipboard_{uuid.uuid4().hex}.part")
+        self.state.part_paths.add(part_path)
+        return part_path
+    
+    def discard_part(self, part_path):
+        """删除临时文件并取消登记"""
+        remove_file(part_path)
+        self.state.part_paths.discard(part_path)
+    
+    async def download_blob(self, blob_id):
+        """下载图片等数据的原始字节（经临时文件续传和校验）"""
+        part_path = self.new_part_path(blob_id)
+        if not await self.download_blob_to_file(blob_id, part_path):
+            return None
+        try:
+            return await asyncio.to_thread(read_file_bytes, part_path)
+        finally:
+            self.discard_part(part_path)
+    
+    def decrypt_metadata(self, data):
+        """解密收到的文本正文和文件名，返回解密后的副本；未加密的内容原样返回，无法解密时抛出 DecryptionError"""
+        if not data.get("encrypted"):
+            return data
+        if self.cipher is None:
+            raise DecryptionError("收到加密内容，但未配置 encryption_key")
+        data = dict(data)
+        if data.get("content_type", "text") == "text":
+            data["content"] = self.cipher.decrypt_text(data.get("content", ""))
+        if data.get("file_name"):
+            data["file_name"] = self.cipher.decrypt_text(data["file_name"])
+        return data
+    
+    async def get_payload_bytes(self, data, legacy_key):
+        """获取图片数据：新版服务端通过 blob_id 下载，旧版服务端直接内嵌 Base64"""
+        if data.get("blob_id") and data.get("encrypted"):
+            payload = await self.download_blob(data["blob_id"])
+            try:
+                return await asyncio.to_thread(self.cipher.decrypt_bytes, payload) if payload is not None else None
+            except DecryptionError as e:
+                print(f"❌ 解密失败: {e}")
+                return None
+        if data.get("blob_id"):
+            return await self.download_blob(data["blob_id"])
+        if data.get(legacy_key):
+            try:
+                return await asyncio.to_thread(base64.b64decode, data[legacy_key])
+            except Exception as e:
+                print(f"❌ 数据解码失败: {e}")
+        return None
+    
+    async def receive_file_payload(self, data):
+        """
+        将收到的文件数据写入临时文件，完整且校验通过后才返回路径（不完整的文件不会被放到剪贴板）
+        新版服务端流式下载，旧版服务端内嵌的 Base64 分段解码写入
+        """
+        if data.get("blob_id"):
+            part_path = self.new_part_path(data["blob_id"])
+            if not await self.download_blob_to_file(data["blob_id"], part_path):
+                return None
+            if not data.get("encrypted"):
+                return part_path
+            # 密文下载完整并校验后流式解密到新的临时文件（内存占用与文件大小无关）
+            plain_path = self.new_part_path()
+            try:
+                await asyncio.to_thread(self.cipher.decrypt_file, part_path, plain_path)
+                return plain_path
+            except (DecryptionError, OSError) as e:
+                print(f"❌ 解密失败: {e}")
+                self.discard_part(plain_path)
+                return None
+            finally:
+                self.discard_part(part_path)
+        if data.get("file_data"):
+            part_path = self.new_part_path()
+            try:
+                await asyncio.to_thread(base64_to_file, data["file_data"], part_path)
+                return part_path
+            except Exception as e:
+                print(f"❌ 文件解码失败: {e}")
+                self.discard_part(part_path)
+        return None
+    
+    async def materialize_remote_file(self, data):
+        """
+        下载收到的文件（文件包则解包），返回要放到剪贴板的路径列表，失败返回 None
+        成功后清理上一次下载的文件，并记录本次下载的路径
+        """
+        file_name = data.get("file_name")
+        part_path = await self.receive_file_payload(data) if file_name else None
+        if not part_path:
+            return None
+        
+        # 替换下载文件记录：延迟下载在粘贴时调用，与处理新内容互斥
+        async with self.download_record_lock:
+            # 删除上一次下载的文件
+            last_downloaded_file = self.state.last_downloaded_file
+            if last_downloaded_file and os.path.exists(last_downloaded_file):
+                try:
+                    remove_download(last_downloaded_file)
+                    print(f"🗑️  已清理上一次的文件: {os.path.basename(last_downloaded_file)}")
+                except Exception as e:
+                    print(f"⚠️  清理文件失败: {e}")
+            
+            if data.get("archive") == ARCHIVE_FORMAT:
+                # 文件包：顺序解包到新的临时文件夹，剪贴板放入解包出的所有顶层文件/文件夹
+                saved_path = tempfile.mkdtemp(prefix="syncclipboard_")
+                try:
+                    clipboard_paths = await asyncio.to_thread(extract_archive, part_path, saved_path)
+                except (tarfile.TarError, OSError) as e:
+                    print(f"❌ 文件包解包失败: {e}")
+                    remove_download(saved_path)
+                    return None
+                finally:
+                    self.discard_part(part_path)
+            else:
+                # 下载完整后原子重命名为最终文件名，再放到剪贴板
+                saved_path = unique_file_path(os.path.basename(file_name))
+                clipboard_paths = [saved_path]
+                try:
+                    os.replace(part_path, saved_path)
+                    self.state.part_paths.discard(part_path)
+                except OSError as e:
+                    print(f"❌ 文件保存失败: {e}")
+                    self.discard_part(part_path)
+                    return None
+            
+            # 记录本次下载的文件路径
+            self.state.last_downloaded_file = saved_path
+        return clipboard_paths
+    
+    async def materialize(self, data):
+        """延迟下载的内容在粘贴时调用：图片返回字节，文件返回路径列表，失败返回 None"""
+        name = data.get("file_name") or "图片"
+        print(f"📥 粘贴时下载: {name} | {get_timestamp()}")
+        if data.get("content_type") == "image":
+            return await self.get_payload_bytes(data, "image_data")
+        return await self.materialize_remote_file(data)
+    
+    async def write_clipboard(self, write, *args):
+        """写入远端内容 write(*args)：先记录下载时间（用于保护期判断），与检测本地变化互斥"""
+        def locked_write():
+            with self.clipboard_lock:
+                self.state.last_sync_download_time = time.time()
+                return write(*args)
+        
+        return await self.clipboard.call(locked_write)
+    
+    async def apply_remote_clipboard(self, data, restore=False):
+        """
+        处理服务端下发的新内容（轮询与推送共用），写入本地剪贴板
+        :param restore: 从历史记录恢复，跳过去重和本机内容判断，且不更新同步时间
+        """
+        state = self.state
+        
+        async with self.remote_apply_lock:
+            updated_at = data.get("updated_at")
+            # 推送与轮询可能先后收到同一条内容，已同步过的直接跳过
+            if not updated_at or (not restore and state.last_sync_time and updated_at <= state.last_sync_time):
+                return
+            
+            # 检查是否是自己上传的内容
+            if data.get("device_id") == self.config.device_id and not restore:
+                # 是自己上传的，直接更新时间戳，不处理
+                state.last_sync_time = updated_at
+            else:
+                client_name = data.get("client_name", "未知设备")
+                try:
+                    data = self.decrypt_metadata(data)
+                except DecryptionError as e:
+                    # 口令不一致或未配置：跳过这条内容，不再重复处理
+                    print(f"🔒 无法解密来自[{client_name}]的内容: {e}")
+                    self.notify("🔒 无法解密", f"来自[{client_name}]的内容已加密\n请检查 encryption_key 是否与其他设备一致",
+                                warning=True, duration=4000)
+                    if not restore:
+                        state.last_sync_time = updated_at
+                    return
+                content_type = data.get("content_type", "text")
+                # 延迟下载模式只放入元数据，粘贴时才下载（旧版服务端内嵌的数据直接使用）
+                lazy = self.config.lazy_download and self.clipboard.supports_lazy and bool(data.get("blob_id"))
+                
+                if content_type == "image":
+                    # 处理图片同步
+                    image_width = data.get("image_width", 0)
+                    image_height = data.get("image_height", 0)
+                    image_size = data.get("image_size", 0)
+                    
+                    image_data = None if lazy else await self.get_payload_bytes(data, "image_data")
+                    if lazy or image_data:
+                        if lazy:
+                            await self.write_clipboard(self.clipboard.set_lazy, data, lambda: self.spawn(self.materialize(data)))
+                            decoded_size = (image_width, image_height)
+                        else:
+                            image = await asyncio.to_thread(self.clipboard.decode_image, image_data)
+                            decoded_size = None if image is None else await self.write_clipboard(self.clipboard.set_image, image)
+                        
+                        if decoded_size is None:
+                            print("❌ 图片解码失败")
+                        else:
+                            if lazy:
+                                print(f"📋 收到图片（粘贴时下载）: {image_width}x{image_height} ({image_size/1024:.1f}KB) | {get_timestamp()}")
+                            else:
+                                # image_width/height 为原图尺寸，发送端可能缩小后上传
+                                scaled = "" if decoded_size in ((image_width, image_height), (0, 0)) else f"（传输尺寸 {decoded_size[0]}x{decoded_size[1]}）"
+                                print(f"✅ 下载图片成功: {image_width}x{image_height}{scaled} {data.get('image_format') or 'png'} ({image_size/1024:.1f}KB) | {get_timestamp()}")
+                            self.notify(
+                                "📥 图片同步",
+                                f"已接收到来自[{client_name}]的图片内容\n{image_width}x{image_height}\n💡 按 Ctrl+V 可直接粘贴",
+                                duration=4000
+                            )
+                            self.play_sound()
+                
+                elif content_type == "file":
+                    # 处理文件同步
+                    file_name = data.get("file_name")
+                    file_size = data.get("file_size", 0)
+                    
+                    lazy = lazy and bool(file_name)
+                    clipboard_paths = None if lazy else await self.materialize_remote_file(data)
+                    if lazy or clipboard_paths:
+                        if lazy:
+                            await self.write_clipboard(self.clipboard.set_lazy, data, lambda: self.spawn(self.materialize(data)))
+                        else:
+                            await self.write_clipboard(self.clipboard.set_files, clipboard_paths)
+                        
+                        if lazy:
+                            print(f"📋 收到文件（粘贴时下载）: {file_name} ({file_size/1024:.1f}KB) | {get_timestamp()}")
+                        else:
+                            print(f"✅ 下载文件成功: {file_name} ({file_size/1024:.1f}KB) | {get_timestamp()}")
+                        self.notify(
+                            "📥 文件同步",
+                            f"已接收到来自[{client_name}]的文件内容\n{file_name}\n💡 按 Ctrl+V 可直接粘贴",
+                            duration=4000
+                        )
+                        self.play_sound()
+                
+                else:
+                    # 处理文本同步
+                    new_text = data.get("content", "")
+                    text_preview = new_text[:30] if len(new_text) <= 30 else new_text[:30] + "..."
+                    
+                    await self.write_clipboard(self.clipboard.set_text, new_text)
+                    
+                    print(f"✅ 下载文本成功: {text_preview!r} | {get_timestamp()}")
+                    self.notify("📥 剪贴板同步", f"已接收到来自[{client_name}]的文本内容", duration=3000)
+                    self.play_sound()
+                
+                # 处理完成，更新时间戳
+                if not restore:
+                    state.last_sync_time = updated_at
+    
+    # ----- 历史记录 -----
+    async def fetch_history(self, limit=10):
+        """拉取最近的历史记录元数据（新的在前）"""
+        try:
+            r = await self.client.get(f"{self.server_url}/history", params={"limit": limit}, timeout=2)
+            if r.status_code == 200:
+                items = list(reversed(r.json().get("items", [])))
+                for item in items:
+                    # 加密内容的文件名在本地解密后显示（文本预览由服务端省略）
+                    if item.get("encrypted") and item.get("file_name"):
+                        try:
+                            item["file_name"] = self.decrypt_metadata(item)["file_name"]
+                        except DecryptionError:
+                            item["file_name"] = "🔒 无法解密的文件"
+                return items
+            print(f"❌ 拉取历史失败: HTTP {r.status_code}")
+        except Exception as e:
+            print("❌ 拉取历史失败:", e)
+        return None
+    
+    async def restore_history_item(self, seq):
+        """将一条历史记录的完整内容恢复到本地剪贴板"""
+        try:
+            r = await self.client.get(f"{self.server_url}/history/{seq}", timeout=3)
+            if r.status_code == 200:
+                await self.apply_remote_clipboard(r.json(), restore=True)
+            else:
+                print(f"❌ 恢复历史失败: HTTP {r.status_code}")
+        except Exception as e:
+            print("❌ 恢复历史失败:", e)
+    
+    # ----- 后台任务 -----
+    async def clipboard_watcher(self):
+        """监听剪贴板变化并上传（带保护期），事件模式下只在剪贴板变化时检测"""
+        state = self.state
+        clipboard = self.clipboard
+        
+        # 用于检测是否真正发生变化的缓存
+        last_text = ""
+        last_files = []
+        last_image_fingerprint = None
+        pause = 0  # 本轮检测后的等待秒数（0 表示等待剪贴板变化）
+        
+        def skip_recent_download_guard() -> bool:
+            """距离上次下载过短则跳过上传，并按原样打印提示与等待。"""
+            nonlocal pause
+            if state.last_sync_download_time > 0:
+                elapsed = time.time() - state.last_sync_download_time
+                if elapsed < SYNC_PROTECTION_SECONDS:
+                    print(f"🛡️ 距离上次下载 {elapsed:.1f}s < {SYNC_PROTECTION_SECONDS}s，跳过上传")
+                    pause = 0.5
+                    return True
+            return False
+        
+        def detect():
+            """检测一次剪贴板，有变化时加入上传队列（经 clipboard.call 在可以访问剪贴板的线程中执行）"""
+            nonlocal last_text, last_files, last_image_fingerprint
+            # 检测期间不会写入远端内容：读到的要么是写入前的内容，要么是已记录下载时间（处于保护期）的新内容
+            with self.clipboard_lock:
+                lazy = clipboard.is_lazy()
+                current_files = [] if lazy else clipboard.get_files()
+                
+                # 延迟下载的内容来自服务端，无需上传；清空缓存，之后复制任何内容都视为变化
+                if lazy:
+                    last_text = ""
+                    last_files = []
+                    last_image_fingerprint = None
+                
+                # 开始检测剪贴板内容
+                # 优先级1：文件
+                elif current_files and current_files != last_files:
+                    last_files = current_files
+                    last_text = ""
+                    last_image_fingerprint = None
+                    
+                    if not skip_recent_download_guard():
+                        self.queue_files(current_files)
+                
+                # 优先级2：图片（如果没有文件）
+                elif not current_files:
+                    current_image = clipboard.get_image()
+                    if current_image:
+                        # 用像素数据指纹判断是否变化，只有确实需要上传时才编码
+                        fingerprint = current_image.fingerprint()
+                        if fingerprint != last_image_fingerprint:
+                            last_image_fingerprint = fingerprint
+                            last_text = ""
+                            last_files = []
+                            
+                            if not skip_recent_download_guard() and self.config.max_file_size is not None:
+                                # 立即开始在线程池中转码，大小检查和上传在上传任务中进行
+                                self.upload_queue.put(content_type="image", image=current_image,
+                                                      image_encoded=self.submit_image_encode(current_image))
+                    
+                    # 优先级3：文本（如果既没有文件也没有图片）
+                    else:
+                        current_text = clipboard.get_text()
+                        if current_text != last_text:
+                            last_text = current_text
+                            last_files = []
+                            last_image_fingerprint = None
+                            
+                            if not skip_recent_download_guard():
+                                self.upload_queue.put(content_type="text", text=current_text)
+        
+        while True:
+            pause = 0
+            try:
+                # 优先级0：检查是否允许上传（重新开启上传时会触发一次检测）
+                if not state.allow_upload:
+                    await clipboard.wait_for_change()
+                    continue
+                await clipboard.call(detect)
+            
+            except Exception as e:
+                print("❌ 剪贴板监听错误:", e)
+            
+            if pause:
+                await asyncio.sleep(pause)
+            else:
+                await clipboard.wait_for_change()
+    
+    def queue_files(self, current_files):
+        """将剪贴板中的文件加入上传队列（超出大小限制时提示）"""
+        max_file_size = self.config.max_file_size
+        if max_file_size is None:
+            return
+        file_path = current_files[0]
+        
+        # 多个文件或包含文件夹：打包上传（遍历和大小检查在上传任务中进行）
+        if len(current_files) > 1 or os.path.isdir(file_path):
+            self.upload_queue.put(content_type="file", file_paths=current_files)
+            return
+        
+        file_size = os.path.getsize(file_path)
+        file_name = os.path.basename(file_path)
+        if max_file_size == 0 or file_size <= max_file_size:
+            self.upload_queue.put(content_type="file", file_path=file_path)
+        else:
+            max_mb = max_file_size / (1024 * 1024)
+            file_mb = file_size / (1024 * 1024)
+            self.notify(
+                "⚠️  文件过大",
+                f"{file_name}\n大小 {file_mb:.1f}MB 超出限制 {max_mb:.1f}MB",
+                warning=True,
+                duration=3000
+            )
+    
+    async def sync_from_server(self):
+        """按自适应间隔从服务端拉取更新并写入剪贴板（推送通道已连接时仅作为回退）"""
+        state = self.state
+        config = self.config
+        while True:
+            # 检查是否允许下载
+            if not state.allow_download:
+                await asyncio.sleep(config.sync_interval)
+                continue
+            
+            # 推送通道在线时暂停轮询，仅在需要补齐（如重新开启下载）时拉取一次
+            if state.push_connected:
+                if await self.resync_event.wait(config.sync_interval):
+                    self.resync_event.clear()
+                    data = await self.fetch_clipboard()
+                    self.first_fetch_event.set()
+                    if data and data.get("status") != "no_update":
+                        await self.apply_remote_clipboard(data)
+                continue
+            
+            # 携带上次的 ETag，让服务端判断是否需要返回数据
+            data = await self.fetch_clipboard(wait=config.long_poll_timeout)
+            self.first_fetch_event.set()
+            self.poll_scheduler.record(data)
+            
+            if data:
+                # 如果服务端返回 no_update，说明没有新内容，跳过处理
+                if data.get("status") == "no_update":
+                    # 长轮询已在服务端等待过，立即发起下一次挂起（服务端要求放慢时除外）；旧版服务端不支持长轮询时仍按间隔等待
+                    if not data.get("long_poll") or self.poll_scheduler.server_hint:
+                        await self.poll_scheduler.sleep()
+                    continue
+                
+                # 有新内容，处理更新
+                last_sync_time = state.last_sync_time
+                await self.apply_remote_clipboard(data)
+                
+                # 长轮询模式下处理完新内容后立即重新挂起（不支持长轮询的旧版服务端每次都返回完整内容，仍按间隔等待）
+                if config.long_poll_timeout > 0 and state.last_sync_time != last_sync_time:
+                    continue
+            
+            # 拉取失败时按指数退避等待
+            await self.poll_scheduler.sleep()
+    
+    async def push_receiver(self):
+        """通过 WebSocket 接收服务端推送的新内容，断线后指数退避重连"""
+        state = self.state
+        try:
+            connect = await asyncio.to_thread(_import_websocket_connect)
+        except ImportError:
+            print("⚠️  未安装 websockets，推送通道不可用，继续使用 HTTP 轮询")
+            return
+        
+        server_url = self.server_url
+        ws_base = "ws" + server_url[len("http"):] if server_url.startswith("http") else server_url
+        reconnect_delay = 1
+        
+        while True:
+            try:
+                # 带上 last_sync_time，服务端会在连接建立后补发错过的内容
+                params = {"channel": self.config.channel}
+                if state.last_sync_time:
+                    params["last_sync_time"] = state.last_sync_time
+                ws_url = f"{ws_base}/ws?{urlencode(params)}"
+                async with connect(ws_url, open_timeout=5, max_size=None) as ws:
+                    state.push_connected = True
+                    reconnect_delay = 1
+                    print(f"🔔 推送通道已连接 | {get_timestamp()}")
+                    while True:
+                        message = await ws.recv()
+                        # 下载关闭期间忽略推送，重新开启后由轮询任务补齐
+                        if not state.allow_download:
+                            continue
+                        await self.apply_remote_clipboard(json.loads(message))
+            except Exception as e:
+                if state.push_connected:
+                    print(f"⚠️  推送通道断开，回退为 HTTP 轮询: {e}")
+            finally:
+                state.push_connected = False
+            
+            # 断线重连（期间由 sync_from_server 轮询兜底）
+            await asyncio.sleep(reconnect_delay)
+            reconnect_delay = min(reconnect_delay * 2, 30)
@@ -0,0 +1,1120 @@
+"""
+SyncClipboard 测试
+服务端测试通过 TestClient 直接调用 server.app（读取当前目录的 config.ini，数据落在临时目录）
+
+用法（在项目根目录下）：
+    python -m unittest test
+    python -m pytest test.py
+"""
+import asyncio
+import gzip
+import hashlib
+import importlib.util
+import io
+import json
+import os
+import shutil
+import tarfile
+import tempfile
+import threading
+import time
+import unittest
+import unittest.mock
+import uuid
+from concurrent.futures import Future
+
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+import httpx
+from fastapi.testclient import TestClient
+
+import server
+from benchmark import start_local_server
+from sync_engine import (
+    ArchiveTooLarge, ClientConfig, ClipboardImage, DecryptionError, MemoryClipboard, PollScheduler, ProgressFile,
+    SyncEngine, UploadCancelled, UploadQueue, collect_archive_entries, encrypted_size, extract_archive,
+    iter_tar_stream, retry_delay,
+)
+
+HAS_CRYPTOGRAPHY = importlib.util.find_spec("cryptography") is not None
+
+
+def new_channel():
+    return f"test-{uuid.uuid4().hex[:8]}"
+
+
+class MockTransport(httpx.AsyncBaseTransport):
+    """请求交给 async handler(request) 处理，不访问网络（与 httpx.MockTransport 不同，请求体由 handler 逐块读取）"""
+    
+    def __init__(self, handler):
+        self.handler = handler
+    
+    async def handle_async_request(self, request):
+        return await self.handler(request)
+
+
+def mock_http(engine, handler):
+    engine._client = httpx.AsyncClient(transport=MockTransport(handler))
+
+
+class ServerTestCase(unittest.TestCase):
+    """每个测试使用独立的频道，互不影响"""
+    
+    @classmethod
+    def setUpClass(cls):
+        # 使用上下文管理器：所有请求共享同一个事件循环（长轮询的等待和唤醒需要在同一循环中）
+        cls.client = TestClient(server.app)
+        cls.client.__enter__()
+    
+    @classmethod
+    def tearDownClass(cls):
+        cls.client.__exit__(None, None, None)
+    
+    def setUp(self):
+        self.channel = new_channel()
+    
+    def url(self, path):
+        return f"{server.URL_PREFIX}{path}"
+    
+    def headers(self, channel=None, **extra):
+        return {"X-Channel": channel or self.channel, **extra}
+    
+    def upload_text(self, text, channel=None):
+        r = self.client.post(self.url("/upload"), headers=self.headers(channel),
+                             json={"content_type": "text", "content": text, "device_id": "test"})
+        self.assertEqual(r.status_code, 200, r.text)
+        return r.json()
+    
+    def upload_file(self, data, file_name="a.bin", channel=None):
+        r = self.client.post(self.url("/upload/stream"), content=data,
+                             headers=self.headers(channel, **{"X-Content-Type": "file", "X-File-Name": file_name,
+                                                              "X-Device-Id": "test"}))
+        self.assertEqual(r.status_code, 200, r.text)
+        return hashlib.sha256(data).hexdigest()
+    
+    def fetch(self, channel=None, **headers):
+        return self.client.get(self.url("/fetch"), headers=self.headers(channel, **headers))
+
+
+class LongPollTest(ServerTestCase):
+    """长轮询：上传后立即唤醒挂起的 /fetch，无更新时等到超时"""
+    
+    def test_wakes_on_upload(self):
+        self.upload_text("before")
+        last_sync_time = self.fetch().json()["updated_at"]
+        result = {}
+        
+        def poll():
+            started = time.monotonic()
+            r = self.client.get(self.url("/fetch"), params={"wait": 10, "last_sync_time": last_sync_time},
+                                headers=self.headers())
+            result.update(status=r.status_code, body=r.json(), elapsed=time.monotonic() - started)
+        
+        thread = threading.Thread(target=poll)
+        thread.start()
+        time.sleep(0.5)
+        self.upload_text("after")
+        thread.join(10)
+        
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(result["status"], 200)
+        self.assertEqual(result["body"]["content"], "after")
+        self.assertLess(result["elapsed"], 5)
+    
+    def test_times_out_without_update(self):
+        last_sync_time = self.upload_text("same")["updated_at"]
+        started = time.monotonic()
+        r = self.client.get(self.url("/fetch"), params={"wait": 0.5, "last_sync_time": last_sync_time},
+                            headers=self.headers())
+        self.assertEqual(r.json()["status"], "no_update")
+        self.assertTrue(r.json()["long_poll"])
+        self.assertGreaterEqual(time.monotonic() - started, 0.4)
+
+class BlobStoreTest(unittest.TestCase):
+    """内容寻址存储：相同内容只保存一份，超出磁盘上限时按 LRU 淘汰未引用的数据"""
+    
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix="syncclipboard_test_")
+        self.addCleanup(shutil.rmtree, self.root, True)
+        self.store = server.BlobStore(self.root, 3000, 0)
+    
+    def stored_files(self):
+        return sorted(os.listdir(self.root))
+    
+    def test_dedup(self):
+        data = os.urandom(1000)
+        sha256, size = self.store.put_bytes(data)
+        self.assertEqual((sha256, size), (hashlib.sha256(data).hexdigest(), 1000))
+        self.assertEqual(self.store.put_bytes(data), (sha256, 1000))
+        
+        async def chunks():
+            yield data[:500]
+            yield data[500:]
+        
+        self.assertEqual(asyncio.run(self.store.put_stream(chunks())), (sha256, 1000))
+        self.assertEqual(self.stored_files(), [sha256])
+        self.assertEqual(self.store.disk_bytes, 1000)
+    
+    def test_trims_least_recently_used(self):
+        a, _ = self.store.put_bytes(os.urandom(1000))
+        b, _ = self.store.put_bytes(os.urandom(1000))
+        c, _ = self.store.put_bytes(os.urandom(1000))
+        self.store.touch(a)
+        d, _ = self.store.put_bytes(os.urandom(1000))
+        # b 最久未使用，被淘汰
+        self.assertFalse(self.store.has(b))
+        self.assertEqual(self.stored_files(), sorted([a, c, d]))
+        self.assertLessEqual(self.store.disk_bytes, 3000)
+    
+    def test_keeps_referenced_and_new_blobs(self):
+        a, _ = self.store.put_bytes(os.urandom(1000))
+        self.store.acquire(a)
+        b, _ = self.store.put_bytes(os.urandom(1500))
+        self.store.acquire(b)
+        # 超出上限，但已有数据都被引用，刚保存的数据也在加入历史前保留
+        c, _ = self.store.put_bytes(os.urandom(1000))
+        self.assertTrue(all(self.store.has(sha256) for sha256 in (a, b, c)))
+        
+        self.store.acquire(c)
+        self.store.release(a)
+        self.assertFalse(self.store.has(a))
+        self.assertTrue(self.store.has(b) and self.store.has(c))
+    
+    def test_rejects_too_large(self):
+        with self.assertRaises(server.BlobTooLarge):
+            self.store.put_bytes(os.urandom(3001))
+        
+        async def chunks():
+            for _ in range(4):
+                yield os.urandom(1000)
+        
+        with self.assertRaises(server.BlobTooLarge):
+            asyncio.run(self.store.put_stream(chunks()))
+        self.assertEqual(self.stored_files(), [])
+
+
+
+class BlobUploadTest(ServerTestCase):
+    """上传的数据按内容去重：不同频道上传相同内容共用一份数据"""
+    
+    def test_upload_shares_blob_across_channels(self):
+        data = os.urandom(4096)
+        sha256 = self.upload_file(data)
+        self.assertEqual(self.upload_file(data, channel=new_channel()), sha256)
+        self.assertEqual(server.blob_store.refs[sha256], 2)
+        self.assertEqual(server.blob_store.size(sha256), len(data))
+    
+    def test_image_size_headers(self):
+        def upload(width, height):
+            return self.client.post(self.url("/upload/stream"), content=b"png",
+                                    headers=self.headers(**{"X-Content-Type": "image", "X-Image-Width": width,
+                                                            "X-Image-Height": height}))
+        
+        self.assertEqual(upload("1920", "1080").status_code, 200)
+        self.assertEqual((self.fetch().json()["image_width"], self.fetch().json()["image_height"]), (1920, 1080))
+        for width, height in (("abc", "1080"), ("1920", "-1"), ("1.5", "2")):
+            self.assertEqual(upload(width, height).status_code, 400)
+
+
+class ClipboardHistoryTest(ServerTestCase):
+    """历史记录环：按条数和字节数淘汰旧记录，游标增量获取"""
+    
+    def test_evicts_by_count_and_bytes(self):
+        history = server.ClipboardHistory(3, 100)
+        for i in range(5):
+            history.append({"content_type": "text", "content": f"item{i}"})
+        self.assertEqual([item["content"] for item, _ in history.items], ["item2", "item3", "item4"])
+        self.assertEqual((history.oldest_seq, history.latest_seq), (3, 5))
+        self.assertIsNone(history.get(2))
+        self.assertEqual(history.get(4)["content"], "item3")
+        
+        history.append({"content_type": "text", "content": "x" * 92})
+        self.assertEqual([item["seq"] for item, _ in history.items], [5, 6])
+        # 超出字节上限时仍保留最新一条
+        history.append({"content_type": "text", "content": "y" * 200})
+        self.assertEqual([item["seq"] for item, _ in history.items], [7])
+        self.assertEqual(history.total_bytes, 200)
+        self.assertEqual(history.text_bytes, 200)
+    
+    def test_since_cursor(self):
+        history = server.ClipboardHistory(10, 1000)
+        for i in range(5):
+            history.append({"content_type": "text", "content": f"item{i}"})
+        self.assertEqual([item["seq"] for item in history.since(0, 50)], [1, 2, 3, 4, 5])
+        self.assertEqual([item["seq"] for item in history.since(3, 50)], [4, 5])
+        self.assertEqual([item["seq"] for item in history.since(0, 2)], [4, 5])
+        self.assertEqual(history.since(5, 50), [])
+    
+    def test_history_api(self):
+        for i in range(3):
+            self.upload_text(f"text{i}" * 50)
+        r = self.client.get(self.url("/history"), headers=self.headers()).json()
+        self.assertEqual(r["cursor"], 3)
+        self.assertFalse(r["truncated"])
+        self.assertEqual([item["seq"] for item in r["items"]], [1, 2, 3])
+        # 列表只含预览，正文按 seq 获取
+        self.assertNotIn("content", r["items"][0])
+        self.assertEqual(r["items"][0]["content_preview"], ("text0" * 50)[:100])
+        self.assertEqual(r["items"][0]["content_length"], 250)
+        self.assertEqual(self.client.get(self.url("/history/1"), headers=self.headers()).json()["content"],
+                         "text0" * 50)
+        
+        self.upload_text("text3")
+        r = self.client.get(self.url("/history"), params={"since": 3}, headers=self.headers()).json()
+        self.assertEqual([item["content_preview"] for item in r["items"]], ["text3"])
+        self.assertEqual(r["cursor"], 4)
+        
+        self.assertEqual(self.client.get(self.url("/history/99"), headers=self.headers()).status_code, 404)
+    
+    def test_history_api_truncated(self):
+        with unittest.mock.patch.object(server, "HISTORY_MAX_ITEMS", 2):
+            for i in range(4):
+                self.upload_text(f"text{i}")
+        r = self.client.get(self.url("/history"), params={"since": 0}, headers=self.headers()).json()
+        self.assertTrue(r["truncated"])
+        self.assertEqual([item["seq"] for item in r["items"]], [3, 4])
+        self.assertEqual(self.client.get(self.url("/history/1"), headers=self.headers()).status_code, 404)
+    
+    def test_evicted_blob_released(self):
+        data = os.urandom(2048)
+        sha256 = self.upload_file(data)
+        channel = server.channels[self.channel]
+        channel.history.max_items = 1
+        self.upload_text("newer")
+        # 被淘汰的记录引用的数据不再属于本频道
+        self.assertFalse(channel.history.has_blob(sha256))
+        self.assertEqual(self.client.get(self.url(f"/download/{sha256}"), headers=self.headers()).status_code, 404)
+
+
+class ChannelIsolationTest(ServerTestCase):
+    """频道隔离：其他频道的内容不可见，数据不可下载、不可秒传引用"""
+    
+    def test_blob_not_visible_across_channels(self):
+        data = os.urandom(4096)
+        sha = self.upload_file(data)
+        other = new_channel()
+        
+        self.assertEqual(self.client.head(self.url(f"/blobs/{sha}"), headers=self.headers()).status_code, 200)
+        self.assertEqual(self.client.head(self.url(f"/blobs/{sha}"), headers=self.headers(other)).status_code, 404)
+        self.assertEqual(self.client.get(self.url(f"/download/{sha}"), headers=self.headers()).content, data)
+        self.assertEqual(self.client.get(self.url(f"/download/{sha}"), headers=self.headers(other)).status_code, 404)
+        
+        r = self.client.post(self.url("/upload"), headers=self.headers(other),
+                             json={"content_type": "file", "blob_sha256": sha, "file_name": "a.bin"})
+        self.assertEqual(r.status_code, 404)
+    
+    def test_text_not_visible_across_channels(self):
+        self.upload_text("secret")
+        other = new_channel()
+        self.assertNotEqual(self.fetch(other).json().get("content"), "secret")
+        self.assertEqual(self.client.get(self.url("/history"), headers=self.headers(other)).json()["items"], [])
+        self.assertEqual(self.client.get(self.url("/history/1"), headers=self.headers(other)).status_code, 404)
+    
+    def test_rejects_bad_channel_name(self):
+        for name in ("bad channel", "x" * 65, "a/b"):
+            self.assertEqual(self.fetch(name).status_code, 400)
+
+
+class CompressionTest(ServerTestCase):
+    """压缩协商：上传可压缩，JSON 响应按 Accept-Encoding 压缩，压缩保存的数据原样下发或流式解压"""
+    
+    def get_raw(self, path, **headers):
+        """不自动解压地读取响应，返回 (响应, 原始字节)"""
+        with self.client.stream("GET", self.url(path), headers=self.headers(**headers)) as r:
+            return r, b"".join(r.iter_raw())
+    
+    def test_accepted_encoding(self):
+        def accepted(value):
+            return server.accepted_encoding(unittest.mock.Mock(headers={"accept-encoding": value}))
+        
+        self.assertEqual(accepted("gzip, deflate"), "gzip")
+        self.assertEqual(accepted("GZIP;q=0.5"), "gzip")
+        self.assertIsNone(accepted("deflate, br"))
+        self.assertIsNone(accepted(""))
+        if server.zstandard:
+            # 按服务端优先级选择
+            self.assertEqual(accepted("gzip, zstd"), "zstd")
+        self.assertEqual(self.client.get(self.url("/status")).json()["encodings"], list(server.SUPPORTED_ENCODINGS))
+    
+    def test_fetch_compressed(self):
+        text = "compressible " * 500
+        self.upload_text(text)
+        r, raw = self.get_raw("/fetch", **{"Accept-Encoding": "gzip"})
+        self.assertEqual(r.headers["content-encoding"], "gzip")
+        self.assertEqual(json.loads(gzip.decompress(raw))["content"], text)
+        
+        r, raw = self.get_raw("/fetch", **{"Accept-Encoding": "identity"})
+        self.assertNotIn("content-encoding", r.headers)
+        self.assertEqual(json.loads(raw)["content"], text)
+        
+        # 小内容不压缩
+        self.upload_text("short")
+        r, raw = self.get_raw("/fetch", **{"Accept-Encoding": "gzip"})
+        self.assertNotIn("content-encoding", r.headers)
+    
+    def test_compressed_json_upload(self):
+        text = "你好" * 1000
+        body = gzip.compress(json.dumps({"content_type": "text", "content": text}).encode("utf-8"))
+        r = self.client.post(self.url("/upload"), content=body,
+                             headers=self.headers(**{"Content-Encoding": "gzip", "Content-Type": "application/json"}))
+        self.assertEqual(r.status_code, 200, r.text)
+        self.assertEqual(self.fetch().json()["content"], text)
+        
+        r = self.client.post(self.url("/upload"), content=b"not gzip",
+                             headers=self.headers(**{"Content-Encoding": "gzip"}))
+        self.assertEqual(r.status_code, 400)
+        r = self.client.post(self.url("/upload"), content=body, headers=self.headers(**{"Content-Encoding": "br"}))
+        self.assertEqual(r.status_code, 415)
+    
+    def test_upload_limits(self):
+        # 很小的压缩炸弹：解压到上限即停止并返回 413
+        bomb = gzip.compress(b" " * (64 * 1024 * 1024))
+        with unittest.mock.patch.object(server, "MAX_JSON_BYTES", 1024 * 1024):
+            r = self.client.post(self.url("/upload"), content=bomb, headers=self.headers(**{"Content-Encoding": "gzip"}))
+            self.assertEqual(r.status_code, 413)
+            r = self.client.post(self.url("/upload"), content=b" " * (1024 * 1024 + 1), headers=self.headers())
+            self.assertEqual(r.status_code, 413)
+        
+        # 不完整的压缩数据和非法 JSON 返回 400
+        body = gzip.compress(b'{"content_type": "text", "content": "a"}')
+        r = self.client.post(self.url("/upload"), content=body[:-10], headers=self.headers(**{"Content-Encoding": "gzip"}))
+        self.assertEqual(r.status_code, 400)
+        for content in (b"{not json", b"[1, 2]"):
+            self.assertEqual(self.client.post(self.url("/upload"), content=content, headers=self.headers()).status_code, 400)
+    
+    def test_stored_compressed_download(self):
+        data = b"log line\n" * 10000
+        sha256 = hashlib.sha256(data).hexdigest()
+        r = self.client.post(self.url("/upload/stream"), content=gzip.compress(data),
+                             headers=self.headers(**{"X-Content-Type": "file", "X-File-Name": "a.log",
+                                                     "Content-Encoding": "gzip"}))
+        self.assertEqual(r.json()["blob_id"], sha256)
+        info = server.blob_store.info(sha256)
+        self.assertEqual((info.size, info.encoding), (len(data), "gzip"))
+        self.assertLess(info.stored_size, len(data))
+        self.assertEqual(self.fetch().json()["file_size"], len(data))
+        
+        # 支持 gzip 的客户端直接收到保存的压缩数据
+        r, raw = self.get_raw(f"/download/{sha256}", **{"Accept-Encoding": "gzip"})
+        self.assertEqual(r.headers["content-encoding"], "gzip")
+        self.assertEqual(len(raw), info.stored_size)
+        self.assertEqual(gzip.decompress(raw), data)
+        
+        # 不支持时流式解压，可按原始字节续传
+        r, raw = self.get_raw(f"/download/{sha256}", **{"Accept-Encoding": "identity"})
+        self.assertNotIn("content-encoding", r.headers)
+        self.assertEqual(raw, data)
+        r, raw = self.get_raw(f"/download/{sha256}", **{"Accept-Encoding": "identity", "Range": "bytes=100-"})
+        self.assertEqual(r.status_code, 206)
+        self.assertEqual(raw, data[100:])
+
+
+class ChunkedUploadTest(ServerTestCase):
+    """分块上传：初始化、上传分块、断点恢复、提交"""
+    
+    def setUp(self):
+        super().setUp()
+        patcher = unittest.mock.patch.object(server, "UPLOAD_CHUNK_SIZE", 1024)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.data = os.urandom(1024 * 3 + 100)
+        self.sha = hashlib.sha256(self.data).hexdigest()
+    
+    def init(self):
+        r = self.client.post(self.url("/upload/chunked"), headers=self.headers(),
+                             json={"blob_sha256": self.sha, "size": len(self.data)})
+        self.assertEqual(r.status_code, 200, r.text)
+        return r.json()
+    
+    def put(self, upload_id, index, chunk=None):
+        chunk = self.data[index * 1024:(index + 1) * 1024] if chunk is None else chunk
+        return self.client.put(self.url(f"/upload/chunked/{upload_id}/{index}"), content=chunk,
+                               headers=self.headers(**{"X-Chunk-Sha256": hashlib.sha256(chunk).hexdigest()}))
+    
+    def commit(self, upload_id):
+        return self.client.post(self.url(f"/upload/chunked/{upload_id}/commit"), headers=self.headers(),
+                                json={"content_type": "file", "file_name": "big.bin", "device_id": "test"})
+    
+    def test_upload_resume_commit(self):
+        upload = self.init()
+        self.assertEqual(upload["chunk_count"], 4)
+        self.assertEqual(upload["received"], [])
+        upload_id = upload["upload_id"]
+        
+        for index in (0, 2):
+            self.assertEqual(self.put(upload_id, index).status_code, 200)
+        
+        r = self.commit(upload_id)
+        self.assertEqual(r.status_code, 409)
+        self.assertEqual(r.json()["received"], [0, 2])
+        
+        # 断点恢复：重新初始化只需补传缺少的分块
+        upload = self.init()
+        self.assertEqual(upload["upload_id"], upload_id)
+        self.assertEqual(upload["received"], [0, 2])
+        for index in (1, 3):
+            self.assertEqual(self.put(upload_id, index).status_code, 200)
+        
+        r = self.commit(upload_id)
+        self.assertEqual(r.status_code, 200, r.text)
+        self.assertEqual(self.client.get(self.url(f"/download/{self.sha}"), headers=self.headers()).content, self.data)
+        self.assertEqual(self.fetch().json()["blob_id"], self.sha)
+        
+        # 数据已存在：所有分块视为已收到
+        self.assertEqual(self.init()["received"], [0, 1, 2, 3])
+    
+    def test_rejects_bad_chunk(self):
+        upload_id = self.init()["upload_id"]
+        r = self.client.put(self.url(f"/upload/chunked/{upload_id}/0"), content=self.data[:1024],
+                            headers=self.headers(**{"X-Chunk-Sha256": "0" * 64}))
+        self.assertEqual(r.status_code, 400)
+        self.assertEqual(self.put(upload_id, 0, b"x" * 10).status_code, 400)
+        self.assertEqual(self.put(upload_id, 4, b"").status_code, 400)
+        self.assertEqual(self.init()["received"], [])
+    
+    def test_rejects_oversized_chunk(self):
+        upload_id = self.init()["upload_id"]
+        chunk = self.data[:1024]
+        r = self.put(upload_id, 0, chunk + b"x")
+        self.assertEqual(r.status_code, 413)
+        # 解压后超过分块大小
+        r = self.client.put(self.url(f"/upload/chunked/{upload_id}/0"), content=gzip.compress(chunk * 100),
+                            headers=self.headers(**{"X-Chunk-Sha256": hashlib.sha256(chunk).hexdigest(),
+                                                    "Content-Encoding": "gzip"}))
+        self.assertEqual(r.status_code, 413)
+        self.assertEqual(self.init()["received"], [])
+    
+    def test_session_limits(self):
+        def init(sha, size=len(self.data)):
+            return self.client.post(self.url("/upload/chunked"), headers=self.headers(),
+                                    json={"blob_sha256": sha, "size": size})
+        
+        # 每个频道同时进行的上传数有上限，恢复已有的上传不受影响
+        with unittest.mock.patch.object(server, "MAX_CHUNKED_UPLOADS", 2):
+            self.init()
+            self.assertEqual(init("1" * 64).status_code, 200)
+            self.assertEqual(init("2" * 64).status_code, 429)
+            self.assertEqual(self.init()["upload_id"], self.sha)
+            r = self.client.post(self.url("/upload/chunked"), headers=self.headers(new_channel()),
+                                 json={"blob_sha256": "2" * 64, "size": len(self.data)})
+            self.assertEqual(r.status_code, 200)
+    
+    def test_session_counts_against_disk_limit(self):
+        store = server.blob_store
+        with unittest.mock.patch.object(store, "disk_limit", 0):
+            store._trim_disk()
+        limit = store.disk_bytes + store.reserved_bytes + len(self.data) * 3 // 2
+        with unittest.mock.patch.object(store, "disk_limit", limit):
+            reserved = store.reserved_bytes
+            self.init()
+            self.assertEqual(store.reserved_bytes, reserved + len(self.data))
+            r = self.client.post(self.url("/upload/chunked"), headers=self.headers(),
+                                 json={"blob_sha256": "3" * 64, "size": len(self.data)})
+            self.assertEqual(r.status_code, 413)
+            
+            # 过期的会话释放预留空间
+            with unittest.mock.patch.object(server, "UPLOAD_EXPIRE_SECONDS", -1):
+                server.sweep_chunked_uploads()
+            self.assertLessEqual(store.reserved_bytes, reserved)
+            upload_id = self.init()["upload_id"]
+            for index in range(4):
+                self.assertEqual(self.put(upload_id, index).status_code, 200)
+            self.assertEqual(self.commit(upload_id).status_code, 200)
+            self.assertLessEqual(store.reserved_bytes, reserved)
+            self.assertTrue(store.has(self.sha))
+    
+    def test_unknown_upload(self):
+        r = self.put(uuid.uuid4().hex, 0)
+        self.assertEqual(r.status_code, 404)
+    
+    def test_other_channel_must_upload_content(self):
+        data = os.urandom(4096)
+        sha = self.upload_file(data)
+        other = new_channel()
+        
+        r = self.client.post(self.url("/upload/chunked"), headers=self.headers(other),
+                             json={"blob_sha256": sha, "size": len(data)})
+        self.assertEqual(r.json()["received"], [])
+        r = self.client.post(self.url(f"/upload/chunked/{sha}/commit"), headers=self.headers(other),
+                             json={"content_type": "file", "file_name": "a.bin"})
+        self.assertEqual(r.status_code, 409)
+    
+    
+    def test_range_download(self):
+        data = os.urandom(4096)
+        sha = self.upload_file(data)
+        
+        def download(value):
+            return self.client.get(self.url(f"/download/{sha}"), headers=self.headers(Range=value))
+        
+        r = download("bytes=100-199")
+        self.assertEqual(r.status_code, 206)
+        self.assertEqual(r.headers["content-range"], f"bytes 100-199/{len(data)}")
+        self.assertEqual(r.content, data[100:200])
+        self.assertEqual(download("bytes=4000-").content, data[4000:])
+        self.assertEqual(download("bytes=-10").content, data[-10:])
+        # 不支持的格式返回完整内容，超出范围返回 416
+        self.assertEqual(download("bytes=0-1,5-6").status_code, 200)
+        r = download(f"bytes={len(data)}-")
+        self.assertEqual(r.status_code, 416)
+        self.assertEqual(r.headers["content-range"], f"bytes */{len(data)}")
+
+
+class FetchETagTest(ServerTestCase):
+    """/fetch 的 ETag 与 304"""
+    
+    def test_not_modified(self):
+        self.upload_text("hello")
+        r = self.fetch()
+        self.assertEqual(r.status_code, 200)
+        etag = r.headers["ETag"]
+        self.assertEqual(r.json()["content"], "hello")
+        
+        r = self.fetch(**{"If-None-Match": etag})
+        self.assertEqual(r.status_code, 304)
+        self.assertEqual(r.content, b"")
+        
+        self.upload_text("world")
+        r = self.fetch(**{"If-None-Match": etag})
+        self.assertEqual(r.status_code, 200)
+        self.assertNotEqual(r.headers["ETag"], etag)
+        self.assertEqual(r.json()["content"], "world")
+    
+    def test_compressed_representation_matches(self):
+        self.upload_text("hello" * 1000)
+        r = self.fetch(**{"Accept-Encoding": "gzip"})
+        self.assertEqual(r.status_code, 200)
+        # 压缩表示的 ETag 同样视为同一内容
+        r = self.fetch(**{"If-None-Match": r.headers["ETag"]})
+        self.assertEqual(r.status_code, 304)
+    
+    def test_long_poll_with_etag(self):
+        self.upload_text("same")
+        etag = self.fetch().headers["ETag"]
+        r = self.client.get(self.url("/fetch"), params={"wait": 0.2}, headers=self.headers(**{"If-None-Match": etag}))
+        self.assertEqual(r.status_code, 304)
+        self.assertEqual(r.headers["ETag"], etag)
+
+
+
+class UploadQueueTest(unittest.TestCase):
+    """后台上传队列：只保留最新的待上传任务，进行中的旧上传被取消"""
+    
+    def test_latest_wins(self):
+        queue = UploadQueue()
+        encoded = Future()
+        queue.put(content_type="image", image_encoded=encoded)
+        queue.put(content_type="text", text="a")
+        queue.put(content_type="text", text="b")
+        # 被取代的任务中尚未开始的图片转码被取消
+        self.assertTrue(encoded.cancelled())
+        job = queue.take()
+        self.assertEqual((job["text"], job["generation"]), ("b", 3))
+        self.assertIsNone(queue.take())
+    
+    def test_check_cancelled(self):
+        queue = UploadQueue()
+        queue.put(content_type="text", text="a")
+        generation = queue.take()["generation"]
+        queue.check_cancelled(generation)
+        queue.check_cancelled(None)
+        queue.put(content_type="text", text="b")
+        with self.assertRaises(UploadCancelled):
+            queue.check_cancelled(generation)
+    
+    def test_cancels_upload_in_progress(self):
+        engine = SyncEngine(ClientConfig(), MemoryClipboard())
+        self.addCleanup(engine.stop)
+        engine.upload_queue.put(content_type="file", file_path="a.bin")
+        generation = engine.upload_queue.take()["generation"]
+        total = 4 * 1024 * 1024
+        body = ProgressFile(io.BytesIO(bytes(total)), total, engine.make_upload_progress("a.bin", total, generation))
+        self.assertEqual(len(body.read(1024 * 1024)), 1024 * 1024)
+        # 有更新的内容入队后，发送中的请求体在下一个数据块处中止
+        engine.upload_queue.put(content_type="text", text="newer")
+        with self.assertRaises(UploadCancelled):
+            body.read(1024 * 1024)
+    
+    def test_cancels_image_upload_in_progress(self):
+        engine = SyncEngine(ClientConfig(), MemoryClipboard())
+        self.addCleanup(engine.stop)
+        total = 4 * 1024 * 1024
+        sent = []
+        
+        async def handler(request):
+            if request.url.path == "/upload/stream":
+                async for chunk in request.stream:
+                    sent.append(len(chunk))
+                    # 发送第一个数据块后复制了新内容
+                    engine.upload_queue.put(content_type="text", text="newer")
+            return httpx.Response(404)
+        
+        mock_http(engine, handler)
+        engine.upload_queue.put(content_type="image")
+        generation = engine.upload_queue.take()["generation"]
+        image_encoded = Future()
+        image_encoded.set_result((bytes(total), "png"))
+        engine.run_sync(engine.upload_clipboard(content_type="image", image=ClipboardImage(b"", 100, 100),
+                                                image_encoded=image_encoded, generation=generation))
+        self.assertEqual(sent, [ProgressFile.CHUNK_SIZE])
+    
+    def test_worker_cancels_superseded_upload(self):
+        engine = SyncEngine(ClientConfig(), MemoryClipboard())
+        self.addCleanup(engine.stop)
+        started = threading.Event()
+        uploaded = []
+        cancelled = []
+        
+        async def upload_clipboard(**job):
+            uploaded.append(job["text"])
+            started.set()
+            try:
+                await asyncio.sleep(5 if job["text"] == "a" else 0)
+            except asyncio.CancelledError:
+                cancelled.append(job["text"])
+                raise
+        
+        async def copy_repeatedly():
+            for text in ("b", "c", "d"):
+                engine.upload_queue.put(content_type="text", text=text)
+        
+        engine.upload_clipboard = upload_clipboard
+        engine.spawn(engine.upload_worker())
+        engine.upload_queue.put(content_type="text", text="a")
+        self.assertTrue(started.wait(5))
+        # 第一条上传期间连续复制：进行中的上传被取消，只上传最后一条
+        engine.run_sync(copy_repeatedly())
+        deadline = time.monotonic() + 5
+        while len(uploaded) < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(uploaded, ["a", "d"])
+        self.assertEqual(cancelled, ["a"])
+
+
+class ExtractArchiveTest(unittest.TestCase):
+    """多文件/文件夹打包：流式打包后解包得到相同内容，解包时拒绝绝对路径、路径穿越和链接"""
+    
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix="syncclipboard_test_")
+        self.addCleanup(shutil.rmtree, self.work_dir, True)
+        self.target_dir = os.path.join(self.work_dir, "target")
+        os.makedirs(self.target_dir)
+        self.archive_path = os.path.join(self.work_dir, "a.tar")
+    
+    def make_archive(self, members):
+        with tarfile.open(self.archive_path, "w") as tar:
+            for name, data, kind in members:
+                info = tarfile.TarInfo(name)
+                info.type = kind
+                if kind == tarfile.SYMTYPE:
+                    info.linkname = data
+                    tar.addfile(info)
+                else:
+                    info.size = len(data)
+                    tar.addfile(info, io.BytesIO(data))
+    
+    def test_rejects_unsafe_members(self):
+        outside = os.path.join(self.work_dir, "evil")
+        self.make_archive([
+            ("../evil", b"x", tarfile.REGTYPE),
+            ("dir/../../evil", b"x", tarfile.REGTYPE),
+            (os.path.abspath(outside), b"x", tarfile.REGTYPE),
+            ("link", "/etc/passwd", tarfile.SYMTYPE),
+            ("dir/ok.txt", b"ok", tarfile.REGTYPE),
+        ])
+        top_level = extract_archive(self.archive_path, self.target_dir)
+        
+        self.assertFalse(os.path.exists(outside))
+        self.assertFalse(os.path.lexists(os.path.join(self.target_dir, "link")))
+        self.assertEqual(top_level, [os.path.join(self.target_dir, "dir")])
+        with open(os.path.join(self.target_dir, "dir", "ok.txt"), "rb") as f:
+            self.assertEqual(f.read(), b"ok")
+    
+    def test_round_trip(self):
+        source = os.path.join(self.work_dir, "source")
+        os.makedirs(os.path.join(source, "sub", "empty"))
+        files = {"a.txt": b"a", os.path.join("sub", "b.bin"): os.urandom(300 * 1024)}
+        for name, data in files.items():
+            with open(os.path.join(source, name), "wb") as f:
+                f.write(data)
+        single = os.path.join(self.work_dir, "single.txt")
+        with open(single, "wb") as f:
+            f.write(b"single")
+        
+        entries, total = collect_archive_entries([source, single])
+        self.assertEqual(total, sum(len(data) for data in files.values()) + len(b"single"))
+        with open(self.archive_path, "wb") as f:
+            for chunk in iter_tar_stream(entries):
+                f.write(chunk)
+        
+        top_level = extract_archive(self.archive_path, self.target_dir)
+        self.assertEqual(top_level, [os.path.join(self.target_dir, "source"), os.path.join(self.target_dir, "single.txt")])
+        for name, data in files.items():
+            with open(os.path.join(self.target_dir, "source", name), "rb") as f:
+                self.assertEqual(f.read(), data)
+        self.assertTrue(os.path.isdir(os.path.join(self.target_dir, "source", "sub", "empty")))
+    
+    def test_size_limit(self):
+        source = os.path.join(self.work_dir, "source")
+        os.makedirs(source)
+        for i in range(3):
+            with open(os.path.join(source, f"{i}.bin"), "wb") as f:
+                f.write(bytes(1000))
+        with self.assertRaises(ArchiveTooLarge):
+            collect_archive_entries([source], max_size=2500)
+
+
+class PollSchedulerTest(unittest.TestCase):
+    """自适应轮询：活动后快速拉取，空闲时逐步放慢，失败时指数退避，遵守服务端建议的间隔"""
+    
+    def setUp(self):
+        self.scheduler = PollScheduler(1, 16)
+        # 固定抖动，便于比较
+        patcher = unittest.mock.patch("random.uniform", lambda low, high: 1)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+    
+    def go_idle(self):
+        self.scheduler.last_activity -= PollScheduler.ACTIVE_SECONDS
+    
+    def test_idle_backoff(self):
+        no_update = {"status": "no_update"}
+        self.scheduler.record(no_update)
+        # 活动后的一段时间内保持最短间隔
+        self.assertEqual(self.scheduler.next_delay(), 1)
+        self.go_idle()
+        delays = []
+        for _ in range(6):
+            self.scheduler.record(no_update)
+            delays.append(self.scheduler.next_delay())
+        self.assertEqual(delays, [2, 4, 8, 16, 16, 16])
+        
+        self.scheduler.record({"status": "ok", "content": "new"})
+        self.assertEqual(self.scheduler.next_delay(), 1)
+    
+    def test_failure_backoff(self):
+        for attempt in range(8):
+            self.scheduler.record(None)
+            self.assertEqual(self.scheduler.next_delay(), retry_delay(attempt))
+        self.assertEqual(self.scheduler.next_delay(), 30)
+        self.scheduler.record({"status": "no_update"})
+        self.assertEqual(self.scheduler.next_delay(), 1)
+    
+    def test_server_hint(self):
+        self.scheduler.record({"status": "no_update", "poll_interval": "5"})
+        self.assertEqual(self.scheduler.next_delay(), 5)
+        self.scheduler.record({"status": "no_update", "poll_interval": "invalid"})
+        self.assertEqual(self.scheduler.next_delay(), 1)
+    
+    def test_jitter(self):
+        with unittest.mock.patch("random.uniform", wraps=lambda low, high: high) as uniform:
+            self.assertAlmostEqual(self.scheduler.next_delay(), 1 + PollScheduler.JITTER)
+        uniform.assert_called_with(1 - PollScheduler.JITTER, 1 + PollScheduler.JITTER)
+    
+    def test_activity_wakes_sleep(self):
+        self.go_idle()
+        for _ in range(5):
+            self.scheduler.record({"status": "no_update"})
+        threading.Timer(0.2, self.scheduler.activity).start()
+        started = time.monotonic()
+        asyncio.run(self.scheduler.sleep())
+        self.assertLess(time.monotonic() - started, 5)
+
+
+class FetchFailureTest(unittest.TestCase):
+    """拉取失败（含服务端返回的错误状态码）按失败处理，不当作新内容，也不会连续重试"""
+    
+    def make_engine(self, status_code, body):
+        config = ClientConfig()
+        config.long_poll_timeout = 25
+        config.enable_push = False
+        engine = SyncEngine(config, MemoryClipboard())
+        self.addCleanup(engine.stop)
+        self.requests = []
+        
+        async def handler(request):
+            self.requests.append(request)
+            return httpx.Response(status_code, json=body)
+        
+        mock_http(engine, handler)
+        return engine
+    
+    def test_error_status(self):
+        for status_code, body in ((404, {"detail": "Not Found"}), (400, {"detail": "频道名不合法"}),
+                                  (503, {"detail": "频道数已达上限"})):
+            engine = self.make_engine(status_code, body)
+            self.assertIsNone(engine.run_sync(engine.fetch_clipboard(wait=25)))
+            self.assertIsNone(engine.state.last_fetch_etag)
+    
+    def test_long_poll_backs_off(self):
+        engine = self.make_engine(404, {"detail": "Not Found"})
+        engine.spawn(engine.sync_from_server())
+        time.sleep(1)
+        engine.stop()
+        # 第一次失败后等待约 1 秒再重试
+        self.assertLessEqual(len(self.requests), 2)
+        self.assertGreaterEqual(engine.poll_scheduler.failures, 1)
+        self.assertEqual(engine.clipboard.get_text(), "")
+
+
+class ConcurrencyTest(unittest.TestCase):
+    """拉取、上传在同一个事件循环中并发进行：慢速上传不影响拉取，停止时立即取消进行中的请求"""
+    
+    def test_slow_upload_does_not_delay_fetch(self):
+        config = ClientConfig()
+        config.enable_push = False
+        engine = SyncEngine(config, MemoryClipboard())
+        self.addCleanup(engine.stop)
+        uploads = []
+        remote = {"content_type": "text", "content": "remote", "device_id": "other", "client_name": "other",
+                  "updated_at": "2026-01-01T00:00:00"}
+        
+        async def handler(request):
+            if request.url.path == "/upload":
+                # 上传挂起，直到被取消
+                uploads.append(request)
+                await asyncio.sleep(30)
+            # 上传开始后其他设备才有新内容
+            if not uploads or request.headers.get("If-None-Match") == "v1":
+                return httpx.Response(304)
+            return httpx.Response(200, json=remote, headers={"ETag": "v1"})
+        
+        mock_http(engine, handler)
+        engine.clipboard.copy_text("local")
+        engine.start()
+        deadline = time.monotonic() + 5
+        while not (uploads and engine.clipboard.get_text() == "remote") and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(len(uploads), 1)
+        self.assertEqual(engine.clipboard.get_text(), "remote")
+        
+        # 上传仍在进行，停止时立即取消
+        started = time.monotonic()
+        engine.stop()
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertFalse(engine.loop_thread.is_alive())
+    
+    def test_stop_cancels_long_poll(self):
+        config = ClientConfig()
+        config.long_poll_timeout = 25
+        config.enable_push = False
+        engine = SyncEngine(config, MemoryClipboard())
+        self.addCleanup(engine.stop)
+        polling = threading.Event()
+        
+        async def handler(request):
+            polling.set()
+            await asyncio.sleep(30)
+        
+        mock_http(engine, handler)
+        engine.start()
+        self.assertTrue(polling.wait(5))
+        started = time.monotonic()
+        engine.stop()
+        self.assertLess(time.monotonic() - started, 1)
+
+
+class PartFileCleanupTest(unittest.TestCase):
+    """停止时只清理本引擎创建的下载临时文件，不影响共用临时目录的其他实例"""
+    
+    def test_stop_removes_own_part_files(self):
+        engine = SyncEngine(ClientConfig(), MemoryClipboard())
+        other = SyncEngine(ClientConfig(), MemoryClipboard())
+        own_paths = [engine.new_part_path(hashlib.sha256(b"own").hexdigest()), engine.new_part_path()]
+        other_path = other.new_part_path()
+        for path in own_paths + [other_path]:
+            with open(path, "wb") as f:
+                f.write(b"partial")
+        self.addCleanup(other.stop)
+        
+        engine.stop()
+        for path in own_paths:
+            self.assertFalse(os.path.exists(path))
+        self.assertTrue(os.path.exists(other_path))
+        other.stop()
+        self.assertFalse(os.path.exists(other_path))
+
+
+class PollIntervalHintTest(ServerTestCase):
+    """服务端通过无更新响应下发建议的轮询间隔"""
+    
+    def test_poll_interval_hint(self):
+        self.upload_text("same")
+        response = self.fetch().json()
+        etag = self.fetch().headers["ETag"]
+        with unittest.mock.patch.object(server, "POLL_INTERVAL_HINT", 5):
+            r = self.fetch(**{"If-None-Match": etag})
+            self.assertEqual(r.headers["X-Poll-Interval"], "5")
+            r = self.client.get(self.url("/fetch"), params={"last_sync_time": response["updated_at"]},
+                                headers=self.headers())
+            self.assertEqual(r.json()["poll_interval"], 5)
+
+
+@unittest.skipUnless(HAS_CRYPTOGRAPHY, "需要安装 cryptography")
+class ContentCipherTest(unittest.TestCase):
+    """端到端加密：分块 AEAD 往返，拒绝篡改、截断和错误的密钥"""
+    
+    @classmethod
+    def setUpClass(cls):
+        from sync_engine import ContentCipher, ENCRYPTION_CHUNK_SIZE
+        cls.cipher = ContentCipher("passphrase", "channel")
+        cls.chunk_size = ENCRYPTION_CHUNK_SIZE
+    
+    def test_round_trip(self):
+        for size in (0, 1, self.chunk_size - 1, self.chunk_size, self.chunk_size * 2 + 7):
+            data = os.urandom(size)
+            encrypted = self.cipher.encrypt_bytes(data)
+            self.assertEqual(len(encrypted), encrypted_size(size))
+            self.assertEqual(self.cipher.decrypt_bytes(encrypted), data)
+        self.assertEqual(self.cipher.decrypt_text(self.cipher.encrypt_text("你好")), "你好")
+    
+    def test_rejects_tampering(self):
+        encrypted = bytearray(self.cipher.encrypt_bytes(os.urandom(self.chunk_size + 10)))
+        for position in (0, len(encrypted) // 2, len(encrypted) - 1):
+            tampered = bytearray(encrypted)
+            tampered[position] ^= 1
+            with self.assertRaises(DecryptionError):
+                self.cipher.decrypt_bytes(bytes(tampered))
+    
+    def test_rejects_truncation(self):
+        data = os.urandom(self.chunk_size * 2 + 10)
+        encrypted = self.cipher.encrypt_bytes(data)
+        # 截掉最后一块、截断到分块边界、只剩文件头
+        for length in (len(encrypted) - 1, encrypted_size(self.chunk_size) - 16, encrypted_size(0) - 16):
+            with self.assertRaises(DecryptionError):
+                self.cipher.decrypt_bytes(encrypted[:length])
+    
+    def test_rejects_other_key(self):
+        from sync_engine import ContentCipher
+        encrypted = self.cipher.encrypt_bytes(b"data")
+        for other in (ContentCipher("other", "channel"), ContentCipher("passphrase", "other")):
+            with self.assertRaises(DecryptionError):
+                other.decrypt_bytes(encrypted)
+    
+    def test_encrypted_reader_matches_encrypt_bytes(self):
+        data = os.urandom(self.chunk_size * 3 + 123)
+        plain_sha256 = hashlib.sha256(data).hexdigest()
+        salt = self.cipher.content_salt(plain_sha256)
+        expected = self.cipher.encrypt_bytes(data, salt)
+        
+        with self.cipher.open_encrypted(io.BytesIO(data), len(data), salt) as reader:
+            self.assertEqual(len(reader), len(expected))
+            self.assertEqual(reader.read(), expected)
+        # 按任意大小读取、seek 回开头重读（上传重试）得到相同密文
+        with self.cipher.open_encrypted(io.BytesIO(data), len(data), salt) as reader:
+            parts = []
+            while True:
+                part = reader.read(1000)
+                if not part:
+                    break
+                parts.append(part)
+            self.assertEqual(b"".join(parts), expected)
+            reader.seek(0)
+            self.assertEqual(reader.read(), expected)
+
+
+class EngineSyncTest(unittest.TestCase):
+    """两个使用内存剪贴板的同步引擎经本机 server.py 互相同步"""
+    
+    @classmethod
+    def setUpClass(cls):
+        cls.work_dir = tempfile.mkdtemp(prefix="syncclipboard_test_")
+        cls.process, cls.server_url = start_local_server(cls.work_dir, 64 * 1024 * 1024)
+    
+    @classmethod
+    def tearDownClass(cls):
+        cls.process.terminate()
+        cls.process.wait(10)
+        shutil.rmtree(cls.work_dir, True)
+    
+    def make_engine(self, channel, encryption_key=""):
+        config = ClientConfig()
+        config.server_url = self.server_url
+        config.channel = channel
+        config.encryption_key = encryption_key
+        config.client_name = "test"
+        config.device_id = uuid.uuid4().hex
+        config.enable_popup = False
+        config.enable_sound = False
+        config.lazy_download = False
+        engine = SyncEngine(config, MemoryClipboard())
+        self.addCleanup(engine.stop)
+        return engine
+    
+    def sync(self, sender, receiver):
+        data = receiver.run_sync(receiver.fetch_clipboard())
+        self.assertIn("updated_at", data)
+        self.assertNotEqual(data.get("status"), "no_update")
+        receiver.run_sync(receiver.apply_remote_clipboard(data))
+    
+    def check_sync(self, encryption_key=""):
+        channel = new_channel()
+        sender = self.make_engine(channel, encryption_key)
+        receiver = self.make_engine(channel, encryption_key)
+        
+        sender.run_sync(sender.upload_clipboard("text", text="hello 你好"))
+        self.sync(sender, receiver)
+        self.assertEqual(receiver.clipboard.get_text(), "hello 你好")
+        
+        file_path = os.path.join(self.work_dir, f"{uuid.uuid4().hex[:8]}.bin")
+        data = os.urandom(200 * 1024)
+        with open(file_path, "wb") as f:
+            f.write(data)
+        sender.run_sync(sender.upload_clipboard("file", file_path=file_path))
+        self.sync(sender, receiver)
+        files = receiver.clipboard.get_files()
+        self.assertEqual(len(files), 1)
+        self.assertEqual(os.path.basename(files[0]), os.path.basename(file_path))
+        with open(files[0], "rb") as f:
+            self.assertEqual(f.read(), data)
+        
+        # 内容未变化时拉取返回 no_update（304）
+        self.assertEqual(receiver.run_sync(receiver.fetch_clipboard()).get("status"), "no_update")
+    
+    def test_sync(self):
+        self.check_sync()
+    
+    @unittest.skipUnless(HAS_CRYPTOGRAPHY, "需要安装 cryptography")
+    def test_sync_encrypted(self):
+        self.check_sync("passphrase")
+    
+    def test_sync_folder_and_image(self):
+        channel = new_channel()
+        sender = self.make_engine(channel)
+        receiver = self.make_engine(channel)
+        
+        folder = os.path.join(self.work_dir, uuid.uuid4().hex[:8])
+        os.makedirs(folder)
+        with open(os.path.join(folder, "a.txt"), "w", encoding="utf-8") as f:
+            f.write("a" * 5000)
+        sender.run_sync(sender.upload_clipboard("file", file_paths=[folder]))
+        self.sync(sender, receiver)
+        files = receiver.clipboard.get_files()
+        self.assertEqual([os.path.basename(path) for path in files], [os.path.basename(folder)])
+        with open(os.path.join(files[0], "a.txt"), encoding="utf-8") as f:
+            self.assertEqual(f.read(), "a" * 5000)
+        
+        image = ClipboardImage(os.urandom(50 * 1024), 10, 20)
+        sender.run_sync(sender.upload_clipboard("image", image=image))
+        self.sync(sender, receiver)
+        self.assertEqual(receiver.clipboard.get_image().data, image.data)
+    
+    def test_background_sync(self):
+        channel = new_channel()
+        sender = self.make_engine(channel)
+        receiver = self.make_engine(channel)
+        for engine in (sender, receiver):
+            engine.config.long_poll_timeout = 5
+            engine.start()
+        self.assertTrue(receiver.run_sync(receiver.first_fetch_event.wait(5)))
+        
+        # 模拟用户复制：发送端检测到变化后上传，接收端通过推送或长轮询收到
+        sender.clipboard.copy_text("copied")
+        deadline = time.monotonic() + 10
+        while receiver.clipboard.get_text() != "copied" and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(receiver.clipboard.get_text(), "copied")
+
+
+if __name__ == "__main__":
+    unittest.main()